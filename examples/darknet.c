@@ -188,6 +188,13 @@ void partial(char *cfgfile, char *weightfile, char *outfile, int max)
     save_weights_upto(net, outfile, max);
 }
 
+void snapshot(char *cfgfile, char *weightfile, char *outfile)
+{
+    gpu_index = -1;
+    network *net = load_network(cfgfile, weightfile, 0);
+    save_network_snapshot(net, cfgfile, outfile);
+}
+
 void print_weights(char *cfgfile, char *weightfile, int n)
 {
     gpu_index = -1;
@@ -490,6 +497,8 @@ int main(int argc, char **argv)
         print_weights(argv[2], argv[3], atoi(argv[4]));
     } else if (0 == strcmp(argv[1], "partial")){
         partial(argv[2], argv[3], argv[4], atoi(argv[5]));
+    } else if (0 == strcmp(argv[1], "snapshot")){
+        snapshot(argv[2], argv[3], argv[4]);
     } else if (0 == strcmp(argv[1], "average")){
         average(argc, argv);
     } else if (0 == strcmp(argv[1], "visualize")){
@@ -429,6 +429,7 @@ typedef enum {
 typedef struct network{
     int n;
     int batch;
+    int max_batch;
     size_t *seen;
     int *t;
     float epoch;
@@ -485,6 +486,12 @@ typedef struct network{
     float *cost;
     float clip;
 
+    void *snapshot;
+    size_t snapshot_size;
+
+    double *profile;
+    int *profile_runs;
+
 #ifdef GPU
     float *input_gpu;
     float *truth_gpu;
@@ -494,6 +501,17 @@ typedef struct network{
 
 } network;
 
+typedef struct{
+    LAYER_TYPE type;
+    int w, h, c;
+    int out_w, out_h, out_c;
+    int runs;
+    double ms;
+    double flops;
+    size_t output_bytes;
+    size_t workspace_bytes;
+} layer_profile;
+
 typedef struct {
     int w;
     int h;
@@ -584,6 +602,8 @@ typedef struct{
 
 
 network *load_network(char *cfg, char *weights, int clear);
+network *load_network_batch(char *cfg, char *weights, int clear, int batch);
+network *load_network_shared(char *cfg, network *base, int batch);
 load_args get_base_args(network *net);
 
 void free_data(data d);
@@ -678,15 +698,24 @@ int option_find_int(list *l, char *key, int def);
 int option_find_int_quiet(list *l, char *key, int def);
 
 network *parse_network_cfg(char *filename);
+network *parse_network_cfg_batch(char *filename, int batch);
 void save_weights(network *net, char *filename);
 void load_weights(network *net, char *filename);
 void save_weights_upto(network *net, char *filename, int cutoff);
 void load_weights_upto(network *net, char *filename, int start, int cutoff);
+void save_network_snapshot(network *net, char *cfgfile, char *filename);
+network *load_network_snapshot(char *filename, int batch);
 
 void zero_objectness(layer l);
 void get_region_detections(layer l, int w, int h, int netw, int neth, float thresh, int *map, float tree_thresh, int relative, detection *dets);
 int get_yolo_detections(layer l, int w, int h, int netw, int neth, float thresh, int *map, int relative, detection *dets);
 void free_network(network *net);
+void reset_batchnorm_statistics(network *net);
+void set_network_profiling(network *net, int on);
+void reset_network_profile(network *net);
+int get_network_profile(network *net, layer_profile *profile, int n);
+char *get_layer_string(LAYER_TYPE a);
+void free_network_shared(network *net);
 void set_batch_network(network *net, int b);
 void set_temp_network(network *net, float t);
 image load_image(char *filename, int w, int h, int c);
@@ -740,12 +769,16 @@ float *network_predict(network *net, float *input);
 
 int network_width(network *net);
 int network_height(network *net);
+int network_max_batch(network *net);
 float *network_predict_image(network *net, image im);
+int network_hierarchy_predictions(network *net, float *predictions, int n, int only_leaves);
 void network_detect(network *net, image im, float thresh, float hier_thresh, float nms, detection *dets);
 detection *get_network_boxes(network *net, int w, int h, float thresh, float hier, int *map, int relative, int *num);
+detection *get_network_boxes_batch(network *net, int b, int w, int h, float thresh, float hier, int *map, int relative, int *num);
 void free_detections(detection *dets, int n);
 
 void reset_network_state(network *net, int b);
+void reorder_network_state(network *net, int *rows);
 
 char **get_labels(char *filename);
 void do_nms_obj(detection *dets, int total, int classes, float thresh);
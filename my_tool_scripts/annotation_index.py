@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""Parse VOC xml annotation files once into a compact columnar index shared by the dataset tools.
+
+    The index is a single .npz file holding, per image, the xml path, mtime, size, sha1, width and height, and for
+    all objects together flat arrays of boxes (xmin, ymin, xmax, ymax), class name ids and difficult flags, with
+    offsets[i]:offsets[i + 1] being the objects of image i. Class names are stored once each and as written in the
+    xml, the tools which lower-case them do so when mapping them to their categories, objects without a <name> or
+    a <bndbox> are left out since no tool uses them.
+    preprocess_for_yolo.py and create_coco_annotations.py take --index to read annotations from it instead of the
+    xml files, an xml file which is not in the index or changed after the index was built is parsed as before.
+
+Example usage:
+    ./annotation_index.py build --data_dir path_to_data_dir -o annotations.npz -j 8
+    ./annotation_index.py build --xml_list train_xml_paths_1000.txt -o annotations.npz
+    ./annotation_index.py info annotations.npz
+"""
+
+import argparse
+import glob
+import hashlib
+import multiprocessing as mp
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+def parse_xml(xml_path):
+    """
+    returns (width, height, sha1, [(name, difficult, xmin, ymin, xmax, ymax)]) of a VOC xml file
+    """
+    with open(xml_path, "rb") as f:
+        content = f.read()
+    root = ET.fromstring(content)
+    size = root.find("size")
+    width = int(size.find("width").text)
+    height = int(size.find("height").text)
+
+    objects = []
+    for obj in root.iter("object"):
+        name_node = obj.find("name")
+        xmlbox = obj.find("bndbox")
+        if name_node is None or name_node.text is None or xmlbox is None:
+            continue
+        difficult_node = obj.find("difficult")
+        difficult = difficult_node is not None and difficult_node.text is not None and int(difficult_node.text) == 1
+        objects.append((name_node.text, difficult,
+                        float(xmlbox.find("xmin").text), float(xmlbox.find("ymin").text),
+                        float(xmlbox.find("xmax").text), float(xmlbox.find("ymax").text)))
+    return width, height, hashlib.sha1(content).hexdigest(), objects
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class AnnotationIndex(object):
+    columns = ["xml_paths", "mtimes", "sizes", "sha1s", "widths", "heights", "offsets", "boxes", "name_ids",
+               "difficult", "names"]
+
+    def __init__(self, arrays):
+        for column in AnnotationIndex.columns:
+            setattr(self, column, arrays[column])
+        self._positions = None
+
+    @staticmethod
+    def build(xml_paths, jobs=1, previous=None):
+        """
+        parses xml_paths with jobs processes, the entries of an existing index for files which did not change since
+        it was built are reused
+        """
+        xml_paths = [os.path.abspath(p) for p in xml_paths]
+        stats = [file_stat(p) for p in xml_paths]
+        parsed = [None] * len(xml_paths)
+        if previous is not None:
+            for k, (path, stat) in enumerate(zip(xml_paths, stats)):
+                i = previous.find(path, stat)
+                if i is not None:
+                    parsed[k] = previous.record(i)
+        todo = [k for k, p in enumerate(parsed) if p is None]
+        if jobs > 1 and len(todo) > 1:
+            pool = mp.Pool(jobs)
+            try:
+                results = pool.map(parse_xml, [xml_paths[k] for k in todo],
+                                   chunksize=max(1, min(256, len(todo) // (4 * jobs))))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [parse_xml(xml_paths[k]) for k in todo]
+        for k, result in zip(todo, results):
+            parsed[k] = result
+
+        names = {}
+        offsets = np.zeros(len(xml_paths) + 1, dtype=np.int64)
+        for k, (_, _, _, objects) in enumerate(parsed):
+            offsets[k + 1] = offsets[k] + len(objects)
+            for obj in objects:
+                names.setdefault(obj[0], len(names))
+        num = int(offsets[-1])
+        boxes = np.empty((num, 4), dtype=np.float64)
+        name_ids = np.empty(num, dtype=np.int32)
+        difficult = np.empty(num, dtype=bool)
+        j = 0
+        for _, _, _, objects in parsed:
+            for name, diff, x1, y1, x2, y2 in objects:
+                boxes[j] = (x1, y1, x2, y2)
+                name_ids[j] = names[name]
+                difficult[j] = diff
+                j += 1
+
+        return AnnotationIndex({
+            "xml_paths": np.array(xml_paths, dtype=np.str_),
+            "mtimes": np.array([s[0] for s in stats], dtype=np.int64),
+            "sizes": np.array([s[1] for s in stats], dtype=np.int64),
+            "sha1s": np.array([p[2] for p in parsed], dtype="S40"),
+            "widths": np.array([p[0] for p in parsed], dtype=np.int32),
+            "heights": np.array([p[1] for p in parsed], dtype=np.int32),
+            "offsets": offsets,
+            "boxes": boxes,
+            "name_ids": name_ids,
+            "difficult": difficult,
+            "names": np.array(sorted(names, key=names.get), dtype=np.str_),
+        })
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as f:
+            return AnnotationIndex(dict((column, f[column]) for column in AnnotationIndex.columns))
+
+    def save(self, path):
+        # np.savez appends .npz to names without it, write to the exact path instead
+        with open(path, "wb") as f:
+            np.savez(f, **dict((column, getattr(self, column)) for column in AnnotationIndex.columns))
+
+    def __len__(self):
+        return len(self.xml_paths)
+
+    def find(self, xml_path, stat=None):
+        """
+        position of xml_path in the index, None if it is not there or the file changed since the index was built
+        """
+        if self._positions is None:
+            self._positions = dict((p, i) for i, p in enumerate(self.xml_paths.tolist()))
+        i = self._positions.get(os.path.abspath(xml_path))
+        if i is None:
+            return None
+        if stat is None:
+            stat = file_stat(xml_path)
+        if stat != (self.mtimes[i], self.sizes[i]):
+            return None
+        return i
+
+    def record(self, i):
+        # image i in the format parse_xml returns
+        begin, end = self.offsets[i], self.offsets[i + 1]
+        objects = [(self.names[n], d, x1, y1, x2, y2) for n, d, (x1, y1, x2, y2) in
+                   zip(self.name_ids[begin:end].tolist(), self.difficult[begin:end].tolist(),
+                       self.boxes[begin:end].tolist())]
+        return int(self.widths[i]), int(self.heights[i]), self.sha1s[i].decode(), objects
+
+    def class_map(self, category_list, lower_case=False):
+        """
+        maps the name ids of the index to positions in category_list, -1 for names not in it. Names are matched as
+        written unless lower_case is set, then they are lower-cased first
+        """
+        category_ids = {}
+        for i, name in enumerate(category_list):
+            category_ids.setdefault(name, i)
+        return np.array([category_ids.get(name.lower() if lower_case else name, -1) for name in self.names.tolist()],
+                        dtype=np.int32)
+
+    def objects(self, i, class_map, skip_difficult=True):
+        """
+        (boxes, class ids) of the objects of image i whose class is in class_map, boxes are xmin, ymin, xmax, ymax
+        """
+        begin, end = self.offsets[i], self.offsets[i + 1]
+        class_ids = class_map[self.name_ids[begin:end]]
+        keep = class_ids >= 0
+        if skip_difficult:
+            keep &= ~self.difficult[begin:end]
+        return self.boxes[begin:end][keep], class_ids[keep]
+
+
+def find_xml_files(data_dir):
+    return sorted(glob.glob(os.path.join(data_dir, "**", "*.xml"), recursive=True))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="build or inspect the annotation index of a VOC style dataset")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    b = sub.add_parser("build", help="parse xml annotation files into an index")
+    b.add_argument("--data_dir", "-d", help="a directory searched recursively for xml annotation files")
+    b.add_argument("--xml_list", "-l", help="a text file contains xml annotation paths, one path per-line")
+    b.add_argument("--output", "-o", required=True, help="the index file to write")
+    b.add_argument("--jobs", "-j", type=int, default=1, help="number of parsing processes, default to 1")
+    b.add_argument("--update", "-u", action="store_true",
+                   help="reuse the entries of an existing output index for unchanged files")
+
+    i = sub.add_parser("info", help="print the number of images and objects per class of an index")
+    i.add_argument("index")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "build":
+        if args.data_dir is None and args.xml_list is None:
+            print("specify the xml annotation files with --data_dir or --xml_list")
+            sys.exit(-1)
+        xml_paths = []
+        if args.data_dir is not None:
+            xml_paths.extend(find_xml_files(args.data_dir))
+        if args.xml_list is not None:
+            with open(args.xml_list, "r") as f:
+                xml_paths.extend(line.strip() for line in f if line.strip())
+        previous = None
+        if args.update and os.path.isfile(args.output):
+            previous = AnnotationIndex.load(args.output)
+        index = AnnotationIndex.build(xml_paths, args.jobs, previous)
+        index.save(args.output)
+        print("indexed %d images with %d objects into %s" % (len(index), len(index.boxes), args.output))
+    else:
+        index = AnnotationIndex.load(args.index)
+        print("%d images, %d objects, %d difficult" % (len(index), len(index.boxes), index.difficult.sum()))
+        counts = np.bincount(index.name_ids, minlength=len(index.names))
+        for name, count in sorted(zip(index.names.tolist(), counts.tolist()), key=lambda x: -x[1]):
+            print("%8d %s" % (count, name))
@@ -3,9 +3,12 @@
 
 import argparse
 import json
+import multiprocessing as mp
 import xml.etree.ElementTree as ET
 import os
+import shutil
 import sys
+import time
 
 
 def create_categories(category_list):
@@ -33,9 +36,12 @@ def get_licenses():
 
 
 class ImageInfoLoader(object):
-    def __init__(self, category_list):
+    def __init__(self, category_list, index=None):
         self._annotation_id = 0
         self._category_list = category_list
+        self._index = index
+        if index is not None:
+            self._class_map = index.class_map(category_list, lower_case=True)
 
     def load_image_info(self, image_path):
         assert os.path.isfile(image_path), "%s does not exist" % image_path
@@ -55,6 +61,11 @@ class ImageInfoLoader(object):
         xml_annotation_path = path_without_suffix + ".xml"
         assert os.path.isfile(xml_annotation_path), "%s does not exist" % xml_annotation_path
 
+        if self._index is not None:
+            i = self._index.find(xml_annotation_path)
+            if i is not None:
+                return image, self.load_indexed_annotations(image, i)
+
         annotation_list = []
         with open(xml_annotation_path, "r") as annotation_file:
             tree = ET.parse(annotation_file)
@@ -101,28 +112,142 @@ class ImageInfoLoader(object):
 
         return image, annotation_list
 
+    def load_indexed_annotations(self, image, i):
+        # the same annotations as parsing the xml file gives, from image i of the annotation index
+        image["width"] = int(self._index.widths[i])
+        image["height"] = int(self._index.heights[i])
+
+        annotation_list = []
+        boxes, class_ids = self._index.objects(i, self._class_map)
+        for (x1, y1, x2, y2), cls_id in zip(boxes.tolist(), class_ids.tolist()):
+            self._annotation_id += 1
+            box_w = x2 - x1
+            box_h = y2 - y1
+            annotation = {
+                "id": self._annotation_id,
+                "image_id": image["id"],
+                "category_id": cls_id + 1,
+                "iscrowd": 0,
+                "bbox": [x1, y1, box_w, box_h],
+                "area": box_w * box_h,
+                "segmentation": [[x1, y1, x1, y2, x2, y2, x2, y1]]
+            }
+            if annotation["area"] < 32 ** 2:
+                print("image %s has small gt box" % image["filename"])
+            annotation_list.append(annotation)
+        return annotation_list
+
+
+# the loader of a worker process, set by init_worker
+worker_loader = None
+
+
+def init_worker(category_list, index):
+    global worker_loader
+    worker_loader = ImageInfoLoader(category_list, index)
+
+
+def load_image_info_worker(image_path):
+    return worker_loader.load_image_info(image_path)
 
-def process_image_set(image_set_path, category_list, output_path):
-    coco_annotations = {
-        "info": get_dataset_info(),
-        "licenses": get_licenses(),
-        "images": [],
-        "annotations": [],
-        "categories": create_categories(category_list)
-    }
 
-    img_info_loader = ImageInfoLoader(category_list)
+class CocoAnnotationWriter(object):
+    """
+    writes a coco annotation file one image at a time: images go straight to the output file and annotations to
+    a temporary file next to it, which is appended after the images, so memory use does not grow with the number
+    of images. Annotation ids are assigned here, in the order the annotations are added. Everything is written to
+    temporary files which only replace output_path in close(), abort() removes them instead.
+    """
+    def __init__(self, output_path, category_list, indent=None):
+        self._output_path = output_path
+        self._indent = indent
+        self._separators = (",", ":") if indent is None else (",", ": ")
+        self._partial_path = output_path + ".tmp"
+        self._output = open(self._partial_path, "w")
+        self._annotations_path = output_path + ".annotations.tmp"
+        self._annotations = open(self._annotations_path, "w+")
+        self.num_images = 0
+        self.num_annotations = 0
+
+        self._categories = create_categories(category_list)
+        header = self._dumps({"info": get_dataset_info(), "licenses": get_licenses()})
+        # leave the object open for the images and annotations arrays
+        self._output.write(header[:-1].rstrip() + "," + self._newline() + '"images":[')
+
+    def _newline(self):
+        return "" if self._indent is None else "\n"
+
+    def _dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, indent=self._indent, separators=self._separators)
+
+    def add(self, image, annotations):
+        if self.num_images > 0:
+            self._output.write(",")
+        self._output.write(self._newline() + self._dumps(image))
+        self.num_images += 1
+        for annotation in annotations:
+            self.num_annotations += 1
+            annotation["id"] = self.num_annotations
+            if self.num_annotations > 1:
+                self._annotations.write(",")
+            self._annotations.write(self._newline() + self._dumps(annotation))
+
+    def close(self):
+        self._output.write(self._newline() + "]," + self._newline() + '"annotations":[')
+        self._annotations.seek(0)
+        shutil.copyfileobj(self._annotations, self._output)
+        self._output.write(self._newline() + "]," + self._newline() + '"categories":' +
+                           self._dumps(self._categories) + self._newline() + "}" + self._newline())
+        self._annotations.close()
+        os.remove(self._annotations_path)
+        self._output.close()
+        os.replace(self._partial_path, self._output_path)
+
+    def abort(self):
+        for f, path in ((self._annotations, self._annotations_path), (self._output, self._partial_path)):
+            f.close()
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def process_image_set(image_set_path, category_list, output_path, index=None, jobs=1, indent=None,
+                      progress_interval=1000):
     with open(image_set_path, "r") as image_set_file:
-        for item in image_set_file:
+        total = sum(1 for item in image_set_file if item.strip())
+
+    writer = CocoAnnotationWriter(output_path, category_list, indent)
+    pool = None
+    start = time.time()
+    try:
+        with open(image_set_path, "r") as image_set_file:
             # strip the ending '\n'
-            image_path = item.strip()
-            img, anns = img_info_loader.load_image_info(image_path)
-            coco_annotations["images"].append(img)
-            if len(anns) > 0:
-                coco_annotations["annotations"].extend(anns)
+            image_paths = (item.strip() for item in image_set_file if item.strip())
+            if jobs > 1:
+                pool = mp.Pool(jobs, initializer=init_worker, initargs=(category_list, index))
+                results = pool.imap(load_image_info_worker, image_paths, chunksize=64)
+            else:
+                img_info_loader = ImageInfoLoader(category_list, index)
+                results = (img_info_loader.load_image_info(image_path) for image_path in image_paths)
 
-    with open(output_path, "w") as output_file:
-        json.dump(coco_annotations, output_file, ensure_ascii=False, indent=2)
+            for img, anns in results:
+                writer.add(img, anns)
+                if progress_interval and writer.num_images % progress_interval == 0:
+                    print("%d/%d images, %d annotations, %.1f images/s" %
+                          (writer.num_images, total, writer.num_annotations,
+                           writer.num_images / max(time.time() - start, 1e-6)), file=sys.stderr)
+    except BaseException:
+        # stop the workers still loading images and leave no half written output behind
+        if pool is not None:
+            pool.terminate()
+        writer.abort()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    writer.close()
+    print("wrote %d images and %d annotations to %s in %.1f seconds" %
+          (writer.num_images, writer.num_annotations, output_path, time.time() - start), file=sys.stderr)
 
 
 def load_categories(categories_file):
@@ -138,6 +263,14 @@ if __name__ == "__main__":
     parser.add_argument("--categories_file", dest="categories_file", required=True,
                         help="a text file contains all the object categories, one category per-line")
     parser.add_argument("--output", "-o", help="the output file path", default="annotations.json")
+    parser.add_argument("--index", default=None,
+                        help="an annotation index built by annotation_index.py to read the annotations from")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes parsing the xml annotations, default to 1")
+    parser.add_argument("--indent", type=int, default=None,
+                        help="indent the output json by this many spaces, it is written compact by default")
+    parser.add_argument("--progress_interval", type=int, default=1000,
+                        help="report progress every this many images, 0 to disable")
     args = parser.parse_args()
 
     if not os.path.isfile(args.image_set):
@@ -150,4 +283,10 @@ if __name__ == "__main__":
 
     all_categories = load_categories(args.categories_file)
 
-    process_image_set(args.image_set, all_categories, args.output)
+    index = None
+    if args.index is not None:
+        from annotation_index import AnnotationIndex
+        index = AnnotationIndex.load(args.index)
+
+    process_image_set(args.image_set, all_categories, args.output, index, args.jobs, args.indent,
+                      args.progress_interval)
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""Evaluate coco-style detection results against coco-style annotations without pycocotools.
+
+    Computes the 12 numbers COCOeval.summarize() prints for bbox results (AP over IoU 0.50:0.95, at 0.50 and
+    0.75, per area range, and AR at 1, 10 and 100 detections per image) plus VOC-style AP at a single IoU, for all
+    categories and per category. Matching follows COCOeval.evaluateImg and VOC's voc_eval exactly, but runs on
+    all images of a category at once, one detection rank at a time, so the numbers agree with
+    evaluate_by_coco_api.py up to the rounding of the final means. Categories are evaluated in parallel with --jobs.
+
+Example usage:
+    ./evaluate_detections.py -a val_coco_annotations.json -r coco_results_fixed.json -j 8
+    ./evaluate_detections.py -a val_coco_annotations.json -r coco_results_fixed.json --voc_iou 0.5 --voc07
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+
+import numpy as np
+
+# the parameters of COCOeval for bbox evaluation
+IOU_THRESHOLDS = np.linspace(.5, 0.95, int(np.round((0.95 - .5) / .05)) + 1, endpoint=True)
+RECALL_THRESHOLDS = np.linspace(.0, 1.00, int(np.round((1.00 - .0) / .01)) + 1, endpoint=True)
+MAX_DETS = [1, 10, 100]
+AREA_RANGES = np.array([[0 ** 2, 1e5 ** 2], [0 ** 2, 32 ** 2], [32 ** 2, 96 ** 2], [96 ** 2, 1e5 ** 2]])
+AREA_NAMES = ["all", "small", "medium", "large"]
+
+
+def box_iou(dt_boxes, gt_boxes, gt_crowd=None, plus_one=0.):
+    """
+    iou of dt_boxes (n x 4) against the gt_boxes of the same image (n x g x 4), boxes are x, y, w, h.
+    The union with a crowd gt box is the detected box alone as in COCOeval, plus_one=1 measures boxes the
+    VOC way, x2 - x1 + 1 pixels wide
+    """
+    dx, dy, dw, dh = [dt_boxes[:, np.newaxis, k] for k in range(4)]
+    gx, gy, gw, gh = [gt_boxes[..., k] for k in range(4)]
+    dw, dh, gw, gh = dw + plus_one, dh + plus_one, gw + plus_one, gh + plus_one
+    iw = np.minimum(dx + dw, gx + gw) - np.maximum(dx, gx)
+    ih = np.minimum(dy + dh, gy + gh) - np.maximum(dy, gy)
+    inter = np.where((iw > 0) & (ih > 0), iw * ih, 0.)
+    union = dw * dh + gw * gh - inter
+    if gt_crowd is not None:
+        union = np.where(gt_crowd, dw * dh, union)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(inter > 0, inter / union, 0.)
+
+
+def group_by_image(images, num_images, order=None):
+    """
+    slot of every element within its image, for elements already grouped by image in order (default: as
+    given, stable), returns (order, starts, counts, slots), slots listed in order
+    """
+    if order is None:
+        order = np.argsort(images, kind="stable")
+    counts = np.bincount(images, minlength=num_images)
+    starts = np.cumsum(counts) - counts
+    slots = np.arange(len(order)) - starts[images[order]]
+    return order, starts, counts, slots
+
+
+class CategoryData(object):
+    """
+    the annotations and detections of one category, on the images which have either. gts are padded to
+    images x max gts per image, in annotation order, detections are flat arrays sorted by image, then by
+    descending score with ties in result file order, which is the order COCOeval considers them in
+    """
+    def __init__(self, gt_images, gt_boxes, gt_areas, gt_crowd, dt_images, dt_boxes, dt_scores):
+        self.images = np.unique(np.concatenate([gt_images, dt_images]))
+        num_images = len(self.images)
+
+        local = np.searchsorted(self.images, gt_images)
+        order, _, counts, slots = group_by_image(local, num_images)
+        width = max(int(counts.max()) if num_images else 0, 1)
+        self.gt_valid = np.zeros((num_images, width), dtype=bool)
+        self.gt_boxes = np.zeros((num_images, width, 4))
+        self.gt_areas = np.zeros((num_images, width))
+        self.gt_crowd = np.zeros((num_images, width), dtype=bool)
+        rows = local[order]
+        self.gt_valid[rows, slots] = True
+        self.gt_boxes[rows, slots] = gt_boxes[order]
+        self.gt_areas[rows, slots] = gt_areas[order]
+        self.gt_crowd[rows, slots] = gt_crowd[order]
+
+        local = np.searchsorted(self.images, dt_images)
+        order = np.lexsort((np.arange(len(local)), -dt_scores, local))
+        _, self.dt_starts, self.dt_counts, self.dt_ranks = group_by_image(local, num_images, order)
+        self.dt_boxes = dt_boxes[order]
+        self.dt_scores = dt_scores[order]
+        self.dt_file_order = order
+
+    def ranks(self, max_rank=None):
+        """
+        yields (images, detections) per detection rank, the local images which have a detection of that rank and
+        the position of those detections in the flat arrays
+        """
+        if not len(self.dt_scores):
+            return
+        by_count = np.argsort(-self.dt_counts, kind="stable")
+        num_ranks = int(self.dt_counts.max())
+        if max_rank is not None:
+            num_ranks = min(num_ranks, max_rank)
+        for r in range(num_ranks):
+            active = by_count[:np.count_nonzero(self.dt_counts > r)]
+            yield active, self.dt_starts[active] + r
+
+
+def match_coco(data):
+    """
+    the greedy matching of COCOeval.evaluateImg for all area ranges and iou thresholds at once, returns
+    (matched, ignored), boolean area ranges x iou thresholds x detections
+    """
+    num_areas, num_ious = len(AREA_RANGES), len(IOU_THRESHOLDS)
+    thresholds = np.minimum(IOU_THRESHOLDS, 1 - 1e-10)[:, np.newaxis, np.newaxis]
+    gt_ignored = data.gt_crowd | (data.gt_areas < AREA_RANGES[:, 0, np.newaxis, np.newaxis]) | \
+        (data.gt_areas > AREA_RANGES[:, 1, np.newaxis, np.newaxis])
+    dt_areas = data.dt_boxes[:, 2] * data.dt_boxes[:, 3]
+    dt_outside = (dt_areas < AREA_RANGES[:, 0, np.newaxis]) | (dt_areas > AREA_RANGES[:, 1, np.newaxis])
+
+    taken = np.zeros((num_areas, num_ious) + data.gt_valid.shape, dtype=bool)
+    matched = np.zeros((num_areas, num_ious, len(data.dt_scores)), dtype=bool)
+    ignored = np.zeros_like(matched)
+    for active, d in data.ranks(MAX_DETS[-1]):
+        iou = box_iou(data.dt_boxes[d], data.gt_boxes[active], data.gt_crowd[active])
+        ig = gt_ignored[:, np.newaxis, active]
+        # a matched gt is taken unless it is a crowd, every detection may match one
+        eligible = (~taken[:, :, active] | data.gt_crowd[active]) & data.gt_valid[active] & (iou >= thresholds)
+        picks = []
+        for group in (eligible & ~ig, eligible & ig):
+            # the best iou, the last of equal ones as COCOeval does
+            score = np.where(group, iou, -1.)
+            picks.append((group.any(axis=-1), score.shape[-1] - 1 - np.argmax(score[..., ::-1], axis=-1)))
+        (has_kept, kept), (has_ignored, kept_ignored) = picks
+        # an ignored gt is only matched when no other one is
+        m = np.where(has_kept, kept, kept_ignored)
+        hit = has_kept | has_ignored
+        a, t, n = np.nonzero(hit)
+        taken[a, t, active[n], m[a, t, n]] = True
+        matched[:, :, d] = hit
+        hit_ignored = np.take_along_axis(np.broadcast_to(ig, eligible.shape), m[..., np.newaxis], axis=-1)[..., 0]
+        ignored[:, :, d] = np.where(hit, hit_ignored, dt_outside[:, np.newaxis, d])
+    return matched, ignored
+
+
+def accumulate_coco(data, matched, ignored):
+    """
+    precision (iou thresholds x recall thresholds x area ranges x max dets) and recall (iou thresholds x area
+    ranges x max dets) of one category as COCOeval.accumulate computes them, -1 where there is no gt
+    """
+    num_areas, num_ious, num_recalls = len(AREA_RANGES), len(IOU_THRESHOLDS), len(RECALL_THRESHOLDS)
+    precision = -np.ones((num_ious, num_recalls, num_areas, len(MAX_DETS)))
+    recall = -np.ones((num_ious, num_areas, len(MAX_DETS)))
+    gt_ignored = data.gt_crowd | (data.gt_areas < AREA_RANGES[:, 0, np.newaxis, np.newaxis]) | \
+        (data.gt_areas > AREA_RANGES[:, 1, np.newaxis, np.newaxis])
+    num_positives = np.count_nonzero(data.gt_valid & ~gt_ignored, axis=(1, 2))
+
+    order = np.argsort(-data.dt_scores, kind="mergesort")
+    for m, max_det in enumerate(MAX_DETS):
+        keep = order[data.dt_ranks[order] < max_det]
+        nd = len(keep)
+        for a in range(num_areas):
+            if num_positives[a] == 0:
+                continue
+            if nd == 0:
+                precision[:, :, a, m] = 0
+                recall[:, a, m] = 0
+                continue
+            dt_matched = matched[a][:, keep]
+            dt_ignored = ignored[a][:, keep]
+            tp = np.cumsum(dt_matched & ~dt_ignored, axis=1).astype(float)
+            fp = np.cumsum(~dt_matched & ~dt_ignored, axis=1).astype(float)
+            rc = tp / num_positives[a]
+            pr = tp / (fp + tp + np.spacing(1))
+            recall[:, a, m] = rc[:, -1]
+            # precision made monotonically decreasing, then sampled at the recall thresholds
+            pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+            for t in range(num_ious):
+                inds = np.searchsorted(rc[t], RECALL_THRESHOLDS, side="left")
+                valid = inds < nd
+                q = np.zeros(num_recalls)
+                q[valid] = pr[t, inds[valid]]
+                precision[t, :, a, m] = q
+    return precision, recall
+
+
+def voc_ap(rec, prec, use_07_metric=False):
+    """
+    area under the precision/recall curve as the VOC devkit computes it, the 11 point version of VOC2007 with
+    use_07_metric set
+    """
+    if use_07_metric:
+        ap = 0.
+        for t in np.arange(0., 1.1, 0.1):
+            p = np.max(prec[rec >= t]) if np.any(rec >= t) else 0
+            ap = ap + p / 11.
+        return ap
+    mrec = np.concatenate(([0.], rec, [1.]))
+    mpre = np.concatenate(([0.], prec, [0.]))
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    i = np.where(mrec[1:] != mrec[:-1])[0]
+    return np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
+
+
+def evaluate_voc(data, iou_thresh=0.5, use_07_metric=False):
+    """
+    VOC-style AP of one category, crowd gts take the place of difficult ones, -1 if there is no other gt
+    """
+    num_positives = np.count_nonzero(data.gt_valid & ~data.gt_crowd)
+    if num_positives == 0:
+        return -1.
+    detected = np.zeros(data.gt_valid.shape, dtype=bool)
+    tp = np.zeros(len(data.dt_scores), dtype=bool)
+    fp = np.zeros(len(data.dt_scores), dtype=bool)
+    for active, d in data.ranks():
+        iou = np.where(data.gt_valid[active], box_iou(data.dt_boxes[d], data.gt_boxes[active], plus_one=1.), -np.inf)
+        # a detection is checked against its best gt only, a second detection of a gt is a false positive
+        j = np.argmax(iou, axis=1)
+        hit = iou[np.arange(len(d)), j] > iou_thresh
+        difficult = hit & data.gt_crowd[active, j]
+        first = hit & ~difficult & ~detected[active, j]
+        tp[d] = first
+        fp[d] = ~first & ~difficult
+        detected[active[first], j[first]] = True
+    # all detections by descending score, ties in result file order
+    order = np.lexsort((data.dt_file_order, -data.dt_scores))
+    tp = np.cumsum(tp[order]).astype(float)
+    fp = np.cumsum(fp[order]).astype(float)
+    rec = tp / num_positives
+    prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+    return voc_ap(rec, prec, use_07_metric)
+
+
+def evaluate_category(task):
+    """
+    returns (precision, recall, voc ap, number of gts, number of detections) of one category
+    """
+    columns, voc_iou, use_07_metric = task
+    data = CategoryData(*columns)
+    matched, ignored = match_coco(data)
+    precision, recall = accumulate_coco(data, matched, ignored)
+    num_gts = int(np.count_nonzero(data.gt_valid & ~data.gt_crowd))
+    return precision, recall, evaluate_voc(data, voc_iou, use_07_metric), num_gts, len(data.dt_scores)
+
+
+def load_annotations(annotations_path):
+    """
+    returns (sorted image ids, categories sorted by id, annotation columns: image ids, category ids, boxes,
+    areas, crowd flags)
+    """
+    with open(annotations_path, "r") as f:
+        dataset = json.load(f)
+    image_ids = np.unique(np.array([image["id"] for image in dataset["images"]], dtype=np.int64))
+    categories = sorted(dataset["categories"], key=lambda c: c["id"])
+    annotations = dataset["annotations"]
+    columns = (np.array([a["image_id"] for a in annotations], dtype=np.int64),
+               np.array([a["category_id"] for a in annotations], dtype=np.int64),
+               np.array([a["bbox"] for a in annotations], dtype=np.float64).reshape(-1, 4),
+               np.array([a["area"] for a in annotations], dtype=np.float64),
+               np.array([bool(a.get("iscrowd", 0)) for a in annotations], dtype=bool))
+    return image_ids, categories, columns
+
+
+def load_results(results_path):
+    """
+    returns the columns image ids, category ids, boxes and scores of a coco-style result file
+    """
+    with open(results_path, "r") as f:
+        results = json.load(f)
+    return (np.array([r["image_id"] for r in results], dtype=np.int64),
+            np.array([r["category_id"] for r in results], dtype=np.int64),
+            np.array([r["bbox"] for r in results], dtype=np.float64).reshape(-1, 4),
+            np.array([r["score"] for r in results], dtype=np.float64))
+
+
+def positions(ids, sorted_ids):
+    # positions of ids in sorted_ids, -1 for ids which are not there
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+    return np.where((len(sorted_ids) > 0) & (sorted_ids[pos] == ids), pos, -1)
+
+
+def evaluate(annotations_path, results_path, jobs=1, voc_iou=0.5, use_07_metric=False):
+    """
+    returns a dict of categories, precision (iou thresholds x recall thresholds x categories x area ranges x max
+    dets), recall (iou thresholds x categories x area ranges x max dets) laid out as COCOeval.eval has them,
+    voc_ap, num_gts and num_dets per category
+    """
+    image_ids, categories, (gt_image_ids, gt_category_ids, gt_boxes, gt_areas, gt_crowd) = \
+        load_annotations(annotations_path)
+    dt_image_ids, dt_category_ids, dt_boxes, dt_scores = load_results(results_path)
+    category_ids = np.array([c["id"] for c in categories], dtype=np.int64)
+
+    dt_images = positions(dt_image_ids, image_ids)
+    assert np.all(dt_images >= 0), "Results do not correspond to current coco set"
+    gt_images = positions(gt_image_ids, image_ids)
+    gt_categories = positions(gt_category_ids, category_ids)
+    gt_categories[gt_images < 0] = -1
+    dt_categories = positions(dt_category_ids, category_ids)
+
+    gt_order = np.argsort(gt_categories, kind="stable")
+    gt_splits = np.searchsorted(gt_categories[gt_order], np.arange(len(categories) + 1))
+    dt_order = np.argsort(dt_categories, kind="stable")
+    dt_splits = np.searchsorted(dt_categories[dt_order], np.arange(len(categories) + 1))
+    tasks = []
+    for k in range(len(categories)):
+        g = gt_order[gt_splits[k]:gt_splits[k + 1]]
+        d = dt_order[dt_splits[k]:dt_splits[k + 1]]
+        tasks.append(((gt_images[g], gt_boxes[g], gt_areas[g], gt_crowd[g], dt_images[d], dt_boxes[d],
+                       dt_scores[d]), voc_iou, use_07_metric))
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = mp.Pool(jobs)
+        try:
+            results = pool.map(evaluate_category, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [evaluate_category(task) for task in tasks]
+
+    return {
+        "categories": categories,
+        "precision": np.stack([r[0] for r in results], axis=2) if results else
+        -np.ones((len(IOU_THRESHOLDS), len(RECALL_THRESHOLDS), 0, len(AREA_RANGES), len(MAX_DETS))),
+        "recall": np.stack([r[1] for r in results], axis=1) if results else
+        -np.ones((len(IOU_THRESHOLDS), 0, len(AREA_RANGES), len(MAX_DETS))),
+        "voc_ap": np.array([r[2] for r in results]),
+        "num_gts": np.array([r[3] for r in results], dtype=np.int64),
+        "num_dets": np.array([r[4] for r in results], dtype=np.int64),
+        "voc_iou": voc_iou,
+    }
+
+
+def mean_valid(s):
+    # mean of the entries which are not -1, -1 if there is none
+    s = s[s > -1]
+    return np.mean(s) if len(s) else -1.
+
+
+def summarize(evaluation):
+    """
+    prints the 12 lines of COCOeval.summarize() and returns its stats
+    """
+    precision, recall = evaluation["precision"], evaluation["recall"]
+
+    def summarize_one(ap, iou_thr=None, area="all", max_dets=100):
+        title = "Average Precision" if ap else "Average Recall"
+        kind = "(AP)" if ap else "(AR)"
+        iou = "{:0.2f}:{:0.2f}".format(IOU_THRESHOLDS[0], IOU_THRESHOLDS[-1]) if iou_thr is None \
+            else "{:0.2f}".format(iou_thr)
+        a = AREA_NAMES.index(area)
+        m = MAX_DETS.index(max_dets)
+        s = precision[..., a, m] if ap else recall[..., a, m]
+        if iou_thr is not None:
+            s = s[np.where(iou_thr == IOU_THRESHOLDS)[0]]
+        value = mean_valid(s)
+        print(" {:<18} {} @[ IoU={:<9} | area={:>6s} | maxDets={:>3d} ] = {:0.3f}".format(
+            title, kind, iou, area, max_dets, value))
+        return value
+
+    return np.array([
+        summarize_one(True),
+        summarize_one(True, iou_thr=.5),
+        summarize_one(True, iou_thr=.75),
+        summarize_one(True, area="small"),
+        summarize_one(True, area="medium"),
+        summarize_one(True, area="large"),
+        summarize_one(False, max_dets=MAX_DETS[0]),
+        summarize_one(False, max_dets=MAX_DETS[1]),
+        summarize_one(False, max_dets=MAX_DETS[2]),
+        summarize_one(False, area="small"),
+        summarize_one(False, area="medium"),
+        summarize_one(False, area="large"),
+    ])
+
+
+def print_per_category(evaluation):
+    precision, recall = evaluation["precision"], evaluation["recall"]
+    t50 = np.where(IOU_THRESHOLDS == .5)[0]
+    t75 = np.where(IOU_THRESHOLDS == .75)[0]
+    print("%-20s %8s %8s %8s %8s %8s %8s %8s" % ("category", "AP", "AP50", "AP75", "AR100", "VOC AP", "gts", "dets"))
+    for k, category in enumerate(evaluation["categories"]):
+        p = precision[:, :, k, 0, -1]
+        values = [mean_valid(p), mean_valid(p[t50]), mean_valid(p[t75]), mean_valid(recall[:, k, 0, -1]),
+                  evaluation["voc_ap"][k]]
+        print("%-20s %s %8d %8d" % (category["name"][:20],
+                                    " ".join("%8.3f" % v if v > -1 else "%8s" % "-" for v in values),
+                                    evaluation["num_gts"][k], evaluation["num_dets"][k]))
+    print("VOC mAP@%g = %0.4f" % (evaluation["voc_iou"], mean_valid(evaluation["voc_ap"])))
+
+
+if __name__ == "__main__":
+    description_msg = '''\
+generate coco-style object detection evaluation results for a test dataset, as the COCO evaluation api does,
+plus VOC-style AP and the AP of every category, based on the coco-style annotations and detection results.
+'''
+
+    parser = argparse.ArgumentParser(description=description_msg,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--annotations", "-a", required=True,
+                        help="a json file contains coco-style annotations for the evaluation dataset")
+    parser.add_argument("--results", "-r", required=True,
+                        help="a json file contains the coco-style detection results for the evaluation dataset")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes evaluating categories in parallel, default to 1")
+    parser.add_argument("--voc_iou", type=float, default=0.5,
+                        help="the iou a detection needs to match a gt in the VOC-style AP, default to 0.5")
+    parser.add_argument("--voc07", action="store_true",
+                        help="compute the VOC-style AP with the 11 point metric of VOC2007")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.annotations):
+        print("%s does not exist" % args.annotations)
+        sys.exit(-1)
+    if not os.path.isfile(args.results):
+        print("%s does not exist" % args.results)
+        sys.exit(-1)
+
+    evaluation = evaluate(args.annotations, args.results, args.jobs, args.voc_iou, args.voc07)
+    summarize(evaluation)
+    print("")
+    print_per_category(evaluation)
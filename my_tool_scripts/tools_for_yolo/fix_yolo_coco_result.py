@@ -2,10 +2,95 @@
 # coding=utf-8
 
 import argparse
+import heapq
 import json
 import os
 import sys
 
+# the darknet used coco-ids, see definition of 'static int coco_ids[]' at the top of
+# https://github.com/pjreddie/darknet/blob/master/examples/detector.c
+darknet_coco_ids = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 27, 28,
+                    31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55,
+                    56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 67, 70, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 84,
+                    85, 86, 87, 88, 89, 90]
+
+fixed_id_map = {v: i+1 for i, v in enumerate(darknet_coco_ids)}
+
+
+def read_detections(input_file):
+    """
+    yields the detections of a darknet result file one at a time, 'darknet detector valid' writes one detection
+    per line between a '[' and a ']' line, any other json list (e.g. an indented one) is loaded as a whole
+    """
+    first = input_file.readline().strip()
+    second = input_file.readline().strip().rstrip(",")
+    if first != "[" or not (second.startswith("{") and second.endswith("}")):
+        input_file.seek(0)
+        for detection in json.load(input_file):
+            yield detection
+        return
+    yield json.loads(second)
+    for line in input_file:
+        line = line.strip().rstrip(",")
+        if line and line != "]":
+            yield json.loads(line)
+
+
+def select_top_k(detections, top_k):
+    # the top_k highest scored detections, in their original order
+    if top_k is None or len(detections) <= top_k:
+        return detections
+    keep = sorted(heapq.nlargest(top_k, range(len(detections)), key=lambda i: detections[i]["score"]))
+    return [detections[i] for i in keep]
+
+
+def group_by_image(detections):
+    # darknet writes all detections of an image together, so only the current image is ever held in memory
+    image_id = None
+    group = []
+    for detection in detections:
+        if detection["image_id"] != image_id and group:
+            yield group
+            group = []
+        image_id = detection["image_id"]
+        group.append(detection)
+    if group:
+        yield group
+
+
+def fix_result(input_path, output_path, score_thresh=0., top_k=None):
+    """
+    rewrites a darknet coco result file line by line, mapping category ids and dropping detections below
+    score_thresh or beyond the top_k of their image, returns the number of detections (read, written)
+    """
+    num_read = 0
+    num_written = 0
+    seen_images = set()
+
+    def filtered(detections):
+        nonlocal num_read
+        for detection in detections:
+            num_read += 1
+            if detection["score"] >= score_thresh:
+                yield detection
+
+    with open(input_path, "r") as input_file, open(output_path, "w") as output_file:
+        output_file.write("[")
+        for group in group_by_image(filtered(read_detections(input_file))):
+            image_id = group[0]["image_id"]
+            if top_k is not None and image_id in seen_images:
+                print("detections of image %s are not contiguous, top %d is applied per run of them" %
+                      (image_id, top_k))
+            seen_images.add(image_id)
+            for detection in select_top_k(group, top_k):
+                detection["category_id"] = fixed_id_map[detection["category_id"]]
+                output_file.write(("\n" if num_written == 0 else ",\n") +
+                                  json.dumps(detection, ensure_ascii=False, separators=(",", ":")))
+                num_written += 1
+        output_file.write("\n]\n")
+    return num_read, num_written
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="fix category id of the darknet generated coco-style validation result")
@@ -13,31 +98,21 @@ if __name__ == "__main__":
                         help="path to the darknet generated result file, \
 the file contains a json list of which each element was a detected box")
     parser.add_argument("--output_path", "-o", required=False, help="path to the output result file")
+    parser.add_argument("--score_thresh", "-s", type=float, default=0.,
+                        help="drop detections scored below this, default to 0")
+    parser.add_argument("--top_k", "-k", type=int, default=None,
+                        help="keep at most this many of the highest scored detections per image, e.g. 100 as the "
+                             "coco evaluation does, default to keep all")
     args = parser.parse_args()
 
     if not os.path.isfile(args.input_path):
         print("%s does not exist" % args.input_path)
         sys.exit(-1)
 
-    # the darknet used coco-ids, see definition of 'static int coco_ids[]' at the top of
-    # https://github.com/pjreddie/darknet/blob/master/examples/detector.c
-    darknet_coco_ids = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 27, 28,
-                        31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55,
-                        56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 67, 70, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 84,
-                        85, 86, 87, 88, 89, 90]
-
-    fixed_id_map = {v: i+1 for i, v in enumerate(darknet_coco_ids)}
-
     output_path = args.output_path
     if output_path is None:
         input_path_splits = args.input_path.rsplit(".", 1)
         output_path = input_path_splits[0] + "_fixed" + "." + input_path_splits[1]
 
-    with open(args.input_path, "r") as input_file:
-        detection_list = json.load(input_file)
-        for detection in detection_list:
-            c_id = detection["category_id"]
-            detection["category_id"] = fixed_id_map[c_id]
-
-    with open(output_path, "w") as output_file:
-        json.dump(detection_list, output_file, ensure_ascii=False, indent=2)
+    num_read, num_written = fix_result(args.input_path, output_path, args.score_thresh, args.top_k)
+    print("wrote %d of %d detections to %s" % (num_written, num_read, output_path))
@@ -2,33 +2,180 @@
 # coding=utf-8
 
 import argparse
+import hashlib
+import json
+import multiprocessing as mp
 import xml.etree.ElementTree as ET
 import os
 import sys
 import shutil
 
 
+def parse_xml_annotation(xml_ann_path, category_ids):
+    """
+    parse a VOC xml annotation file, returns (yolo annotations, sha1 of the file content),
+    a module level function so that worker processes can run it
+    """
+    assert os.path.isfile(xml_ann_path), "xml annotation file %s does not exist" % xml_ann_path
+
+    with open(xml_ann_path, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha1(content).hexdigest()
+
+    yolo_annotations = []
+    root = ET.fromstring(content)
+
+    size = root.find('size')
+    image_w = int(size.find('width').text)
+    image_h = int(size.find('height').text)
+
+    # sometimes the width and height was 0 in the annotation file
+    if image_w < 1 or image_h < 1:
+        print("%s has invalid image size: width %d, height %d" % (xml_ann_path, image_w, image_h))
+        return yolo_annotations, digest
+
+    for obj in root.iter('object'):
+        difficult_node = obj.find('difficult')
+        if difficult_node is not None and difficult_node.text is not None and int(difficult_node.text) == 1:
+            continue
+
+        name_node = obj.find('name')
+        # in case there's no <name> tag or the tag has empty content
+        if name_node is None or name_node.text is None:
+            continue
+
+        cls_id = category_ids.get(name_node.text.lower())
+        if cls_id is None:
+            # print("non-listed class name %s in %s" % (name_node.text.lower(), xml_ann_path))
+            continue
+
+        xmlbox = obj.find('bndbox')
+        if xmlbox is not None:
+            b = (float(xmlbox.find('xmin').text), float(xmlbox.find('xmax').text),
+                 float(xmlbox.find('ymin').text), float(xmlbox.find('ymax').text))
+            bb = PreProcessForYolo.convert_to_yolo_box((image_w, image_h), b)
+
+            yolo_annotations.append({"class_id": cls_id, "box": bb})
+
+    return yolo_annotations, digest
+
+
+def parse_xml_annotation_worker(args):
+    return parse_xml_annotation(*args)
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class LabelManifest(object):
+    """
+    records, for every xml annotation converted into a yolo label file, the mtime, size and sha1 of the xml and
+    the number of boxes written, together with the category list used, so that an incremental run can tell which
+    label files are still up to date. An xml whose mtime or size changed but whose content did not is not
+    converted again either.
+    """
+    file_name = ".manifest.json"
+
+    def __init__(self, labels_dir, category_list):
+        self._path = os.path.join(labels_dir, LabelManifest.file_name)
+        self._categories = hashlib.sha1("\n".join(category_list).encode("utf-8")).hexdigest()
+        self._old_entries = {}
+        self._entries = {}
+        if os.path.isfile(self._path):
+            with open(self._path, "r") as f:
+                manifest = json.load(f)
+            # a changed category list changes the class ids of every label file
+            if manifest.get("categories") == self._categories:
+                self._old_entries = manifest["entries"]
+
+    def lookup(self, xml_path):
+        """
+        returns the manifest entry of xml_path if its label file is still up to date, otherwise None
+        """
+        entry = self._old_entries.get(xml_path)
+        if entry is None:
+            return None
+        st = os.stat(xml_path)
+        if entry["mtime"] != st.st_mtime_ns or entry["size"] != st.st_size:
+            if entry["size"] != st.st_size or entry["sha1"] != file_digest(xml_path):
+                return None
+        if entry["boxes"] > 0 and not os.path.isfile(entry["label"]):
+            return None
+        return entry
+
+    def record(self, xml_path, digest, boxes, label_path):
+        st = os.stat(xml_path)
+        self._entries[xml_path] = {"mtime": st.st_mtime_ns, "size": st.st_size, "sha1": digest, "boxes": boxes,
+                                   "label": label_path}
+
+    def save(self):
+        """
+        removes the label files of annotations not seen in this run, then writes the manifest
+        """
+        kept = set(entry["label"] for entry in self._entries.values())
+        removed = 0
+        for xml_path, entry in self._old_entries.items():
+            label_path = entry["label"]
+            if xml_path not in self._entries and label_path not in kept and label_path and os.path.isfile(label_path):
+                os.remove(label_path)
+                removed += 1
+        with open(self._path, "w") as f:
+            json.dump({"categories": self._categories, "entries": self._entries}, f)
+        return removed
+
+
 class PreProcessForYolo(object):
     possible_image_suffix = [".jpg", ".png", ".jpeg", ".JPG", ".PNG", ".JPEG"]
 
-    def __init__(self, img_set_file, categories_file, append_id=False):
+    def __init__(self, img_set_file, categories_file, append_id=False, jobs=1, manifest=None, index=None):
         assert os.path.isfile(img_set_file), "%s does not exist" % img_set_file
 
         self._image_set_file = img_set_file
         self._append_id = append_id
         self._image_id = 1
+        self._jobs = jobs
+        self._manifest = manifest
         with open(categories_file, "r") as f:
             self._category_list = [line.strip() for line in f]
+        self._category_ids = dict((name, i) for i, name in reversed(list(enumerate(self._category_list))))
+        self._index = index
+        if index is not None:
+            self._class_map = index.class_map(self._category_list, lower_case=True)
 
         print(self._category_list)
 
         self._valid_images = []
         self._valid_xml_annotations = []
+        self._converted = 0
+        self._reused = 0
 
     def process(self):
         with open(self._image_set_file, "r") as f:
-            for line in f:
-                self.process_image_path(line.strip())
+            img_paths = [line.strip() for line in f]
+
+        # both the image and xml annotation files must exist
+        pairs = []
+        for img_path in img_paths:
+            xml_annotation_path = img_path.rsplit(".", 1)[0] + ".xml"
+            if os.path.isfile(img_path) and os.path.isfile(xml_annotation_path):
+                pairs.append((img_path, xml_annotation_path))
+
+        # manifest entries of the label files which are still up to date, None for those must be converted
+        entries = [None] * len(pairs)
+        if self._manifest is not None:
+            entries = [self._manifest.lookup(xml_path) for _, xml_path in pairs]
+        to_parse = [xml_path for (_, xml_path), entry in zip(pairs, entries) if entry is None]
+
+        parsed = iter(self.parse_annotations(to_parse))
+        for (img_path, _), entry in zip(pairs, entries):
+            if entry is None:
+                self.process_image_path(img_path, *next(parsed))
+            else:
+                self.process_image_path(img_path, entry=entry)
+
+        print("%s: %d label files converted, %d up to date" % (self._image_set_file, self._converted, self._reused))
 
         num = len(self._valid_images)
         if num > 0:
@@ -44,15 +191,70 @@ class PreProcessForYolo(object):
                 for p in self._valid_xml_annotations:
                     f.write(p + "\n")
 
-    def process_image_path(self, img_path):
+    def parse_annotations(self, xml_paths):
+        """
+        (yolo annotations, sha1) of every xml annotation file, taken from the annotation index when it has the file
+        """
+        parsed = [None] * len(xml_paths)
+        if self._index is not None:
+            for k, xml_path in enumerate(xml_paths):
+                i = self._index.find(xml_path)
+                if i is not None:
+                    parsed[k] = self.get_indexed_annotation(i)
+        to_parse = [k for k, p in enumerate(parsed) if p is None]
+
+        # parsing is the expensive part and independent per file, renaming and writing the label files stays in
+        # this process and in the order of the image set file, since image ids depend on it
+        if self._jobs > 1 and len(to_parse) > 1:
+            pool = mp.Pool(self._jobs)
+            try:
+                results = pool.map(parse_xml_annotation_worker,
+                                   [(xml_paths[k], self._category_ids) for k in to_parse],
+                                   chunksize=max(1, min(256, len(to_parse) // (4 * self._jobs))))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [parse_xml_annotation(xml_paths[k], self._category_ids) for k in to_parse]
+        for k, result in zip(to_parse, results):
+            parsed[k] = result
+        return parsed
+
+    def get_indexed_annotation(self, i):
+        # the same as parse_xml_annotation() for image i of the annotation index
+        image_w = int(self._index.widths[i])
+        image_h = int(self._index.heights[i])
+        digest = self._index.sha1s[i].decode()
+        if image_w < 1 or image_h < 1:
+            print("%s has invalid image size: width %d, height %d" % (self._index.xml_paths[i], image_w, image_h))
+            return [], digest
+
+        boxes, class_ids = self._index.objects(i, self._class_map)
+        return [{"class_id": cls_id, "box": PreProcessForYolo.convert_to_yolo_box((image_w, image_h),
+                                                                               (x1, x2, y1, y2))}
+                for (x1, y1, x2, y2), cls_id in zip(boxes.tolist(), class_ids.tolist())], digest
+
+    def process_image_path(self, img_path, yolo_annotations=None, digest=None, entry=None):
+        """
+        yolo_annotations and digest come from parse_xml_annotation() and are computed here if not given,
+        entry is the manifest entry of an xml annotation whose label file is still up to date
+        """
         xml_annotation_path = img_path.rsplit(".", 1)[0] + ".xml"
-        # both the image and xml annotation files must exist
-        if not os.path.isfile(img_path) or not os.path.isfile(xml_annotation_path):
-            return
+        if entry is not None:
+            boxes = entry["boxes"]
+            digest = entry["sha1"]
+        else:
+            if yolo_annotations is None:
+                # both the image and xml annotation files must exist
+                if not os.path.isfile(img_path) or not os.path.isfile(xml_annotation_path):
+                    return
+                yolo_annotations, digest = parse_xml_annotation(xml_annotation_path, self._category_ids)
+            boxes = len(yolo_annotations)
 
-        yolo_annotations = self.get_yolo_annotation(xml_annotation_path)
         # ignore those have no valid annotations
-        if len(yolo_annotations) < 1:
+        if boxes < 1:
+            if self._manifest is not None:
+                self._manifest.record(xml_annotation_path, digest, 0, None)
             return
 
         fixed_image_path = PreProcessForYolo.fix_image_name(img_path)
@@ -71,53 +273,22 @@ class PreProcessForYolo(object):
         if not os.path.isdir(label_dir):
             os.makedirs(label_dir)
 
-        with open(yolo_label_path, "w") as f:
-            for ann in yolo_annotations:
-                f.write(str(ann["class_id"]) + " " + " ".join([str(a) for a in ann["box"]]) + "\n")
-
-    def get_yolo_annotation(self, xml_ann_path):
-        assert os.path.isfile(xml_ann_path), "xml annotation file %s does not exist" % xml_ann_path
-
-        yolo_annotations = []
-        with open(xml_ann_path, "r") as f:
-            tree = ET.parse(f)
-            root = tree.getroot()
-
-            size = root.find('size')
-            image_w = int(size.find('width').text)
-            image_h = int(size.find('height').text)
+        if entry is not None:
+            # the label file is up to date, it only has to follow its image if that was renamed
+            if entry["label"] != yolo_label_path:
+                os.rename(entry["label"], yolo_label_path)
+            self._reused += 1
+        else:
+            with open(yolo_label_path, "w") as f:
+                for ann in yolo_annotations:
+                    f.write(str(ann["class_id"]) + " " + " ".join([str(a) for a in ann["box"]]) + "\n")
+            self._converted += 1
 
-            # sometimes the width and height was 0 in the annotation file
-            if image_w < 1 or image_h < 1:
-                print("%s has invalid image size: width %d, height %d" % (xml_ann_path, image_w, image_h))
-                return yolo_annotations
+        if self._manifest is not None:
+            self._manifest.record(path_no_suffix + ".xml", digest, boxes, yolo_label_path)
 
-            for obj in root.iter('object'):
-                difficult_node = obj.find('difficult')
-                if difficult_node is not None and difficult_node.text is not None and int(difficult_node.text) == 1:
-                    continue
-
-                name_node = obj.find('name')
-                # in case there's no <name> tag or the tag has empty content
-                if name_node is None or name_node.text is None:
-                    continue
-
-                lower_case_class_name = name_node.text.lower()
-                if lower_case_class_name not in self._category_list:
-                    # print("non-listed class name %s in %s" % (lower_case_class_name, xml_ann_path))
-                    continue
-
-                cls_id = self._category_list.index(lower_case_class_name)
-
-                xmlbox = obj.find('bndbox')
-                if xmlbox is not None:
-                    b = (float(xmlbox.find('xmin').text), float(xmlbox.find('xmax').text),
-                         float(xmlbox.find('ymin').text), float(xmlbox.find('ymax').text))
-                    bb = PreProcessForYolo.convert_to_yolo_box((image_w, image_h), b)
-
-                    yolo_annotations.append({"class_id": cls_id, "box": bb})
-
-            return yolo_annotations
+    def get_yolo_annotation(self, xml_ann_path):
+        return parse_xml_annotation(xml_ann_path, self._category_ids)[0]
 
     @staticmethod
     def append_image_id(img_path, img_id):
@@ -204,6 +375,10 @@ preprocess the dataset for yolo training and validation:
 (3) append an unique integer to the name of each image in the validation set, so that darknet can guess the id of
     an image during validataion;
 (4) exclude images with invalid class name or have no bounding box annotation;
+with --incremental the 'labels' directory is kept between runs, a manifest in it records the mtime, size and sha1 of
+every converted xml annotation, and only label files whose xml annotation or the category list changed are created
+again, label files of annotations no longer in the image sets are removed. --jobs parses the xml annotations in
+that many processes.
 '''
 
     data_dir_help = '''\
@@ -219,6 +394,12 @@ directory as it's corresponding image.
                         help="path to a text file contains all validation image paths, one path per-line")
     parser.add_argument("--categories_file", "-c", required=True,
                         help="path to a text file contains all the object categories, one category per-line")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of processes parsing the xml annotations, default to 1")
+    parser.add_argument("--incremental", "-i", action="store_true",
+                        help="keep the existing label files and only convert the changed xml annotations")
+    parser.add_argument("--index", default=None,
+                        help="an annotation index built by annotation_index.py to read the annotations from")
 
     return parser.parse_args()
 
@@ -250,15 +431,33 @@ if __name__ == "__main__":
         print("%s does not exist" % args.categories_file)
         sys.exit(-1)
 
+    index = None
+    if args.index is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+        from annotation_index import AnnotationIndex
+        index = AnnotationIndex.load(args.index)
+
     labels_dir = os.path.join(args.data_dir, "labels")
-    if os.path.isdir(labels_dir):
-        shutil.rmtree(labels_dir)
-    os.mkdir(labels_dir)
+    manifest = None
+    if args.incremental:
+        if not os.path.isdir(labels_dir):
+            os.mkdir(labels_dir)
+        with open(args.categories_file, "r") as f:
+            manifest = LabelManifest(labels_dir, [line.strip() for line in f])
+    else:
+        if os.path.isdir(labels_dir):
+            shutil.rmtree(labels_dir)
+        os.mkdir(labels_dir)
 
     if args.train_set is not None:
-        train_preprocessor = PreProcessForYolo(args.train_set, args.categories_file)
+        train_preprocessor = PreProcessForYolo(args.train_set, args.categories_file, jobs=args.jobs,
+                                               manifest=manifest, index=index)
         train_preprocessor.process()
 
     if args.val_set is not None:
-        val_preprocessor = PreProcessForYolo(args.val_set, args.categories_file, append_id=True)
+        val_preprocessor = PreProcessForYolo(args.val_set, args.categories_file, append_id=True, jobs=args.jobs,
+                                             manifest=manifest, index=index)
         val_preprocessor.process()
+
+    if manifest is not None:
+        print("removed %d stale label files" % manifest.save())
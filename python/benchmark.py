@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""CPU benchmark of the bundled cfgs through the python bindings, with randomly initialized weights.
+
+`run` measures for every cfg, each in its own process so load time, first pass and peak RSS are not
+polluted by the cfgs before it:
+    load_s              p50/p90/p99 of parse + random weight init
+    cold_ms             p50/p90/p99 of the first forward pass after loading
+    warm_ms             p50/p90/p99 single image latency after warmup
+    throughput          images per second at every --batches size
+    decode_ms, nms_ms   get_network_boxes + numpy decoding, and do_nms_obj (detection cfgs only)
+    peak_rss_mb         peak resident set size of the process
+load_s and cold_ms are sampled over --cold_runs loads, each in a fresh process of its own, the other
+metrics come from one more process. Everything is written to one json file. `compare` checks a run against
+a baseline run and exits with status 1 when a metric got worse by more than --tolerance.
+
+Example usage:
+    ./python/benchmark.py run -o before.json
+    ./python/benchmark.py run -o after.json --cfgs cfg/yolov3-tiny.cfg --batches 1 4
+    ./python/benchmark.py compare before.json after.json --tolerance .1
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_CFGS = ["cfg/yolov3-tiny.cfg", "cfg/yolov2-tiny.cfg", "cfg/tiny.cfg", "cfg/darknet19.cfg",
+                "cfg/resnet50.cfg"]
+
+# metrics where a larger value is better, everything else is a time or a size
+HIGHER_IS_BETTER = ("throughput",)
+# single samples written by older runs, too noisy to flag a regression on
+SINGLE_SAMPLE = ("load_s", "cold_ms")
+
+
+def percentiles(samples):
+    return {"p50": float(np.percentile(samples, 50)), "p90": float(np.percentile(samples, 90)),
+            "p99": float(np.percentile(samples, 99))}
+
+
+def is_detector(cfg):
+    with open(cfg) as f:
+        text = f.read()
+    return "[yolo]" in text or "[region]" in text or "[detection]" in text
+
+
+def load_bench_net(cfg, batch=None):
+    import darknet as dn
+    net = dn.load_net(cfg.encode(), None, 0) if batch is None else dn.load_net_batch(cfg.encode(), None, 0, batch)
+    # random weights with all-zero batchnorm statistics blow up to nan, which would skew every timing
+    dn.reset_batchnorm_statistics(net)
+    return net
+
+
+def bench_input(net, batch):
+    import darknet as dn
+    rng = np.random.RandomState(0)
+    return rng.rand(batch*3*dn.network_width(net)*dn.network_height(net)).astype(np.float32)
+
+
+def bench_cold(cfg):
+    # load time and latency of the first pass of a freshly loaded network, in seconds and milliseconds
+    import darknet as dn
+    from ctypes import POINTER, c_float
+    start = time.time()
+    net = load_bench_net(cfg)
+    load_s = time.time() - start
+    dn.set_batch_network(net, 1)
+    x = bench_input(net, 1)
+    start = time.time()
+    dn.network_predict(net, x.ctypes.data_as(POINTER(c_float)))
+    cold_ms = 1000*(time.time() - start)
+    dn.free_network(net)
+    return load_s, cold_ms
+
+
+def bench_cfg(cfg, batches, iterations, warmup, thresh):
+    import darknet as dn
+    from ctypes import POINTER, c_float, c_int, pointer
+    res = {}
+    net = load_bench_net(cfg)
+    dn.set_batch_network(net, 1)
+    w = dn.network_width(net)
+    h = dn.network_height(net)
+    x = bench_input(net, max(batches + [1]))
+    data = x.ctypes.data_as(POINTER(c_float))
+
+    for _ in range(warmup):
+        dn.network_predict(net, data)
+    samples = []
+    for _ in range(iterations):
+        start = time.time()
+        dn.network_predict(net, data)
+        samples.append(1000*(time.time() - start))
+    res["warm_ms"] = percentiles(samples)
+
+    if is_detector(cfg):
+        decode, nms = [], []
+        for _ in range(iterations):
+            pnum = pointer(c_int(0))
+            start = time.time()
+            dets = dn.get_network_boxes(net, w, h, thresh, .5, None, 0, pnum)
+            num = pnum[0]
+            classes = dets[0].classes if num else 0
+            mid = time.time()
+            if num:
+                dn.do_nms_obj(dets, num, classes, .45)
+            end = time.time()
+            dn.detections_to_arrays(dets, num, classes)
+            decode.append(1000*(mid - start + time.time() - end))
+            nms.append(1000*(end - mid))
+            dn.free_detections(dets, num)
+        res["decode_ms"] = percentiles(decode)
+        res["nms_ms"] = percentiles(nms)
+        res["detections"] = num
+    dn.free_network(net)
+
+    res["throughput"] = {}
+    for batch in batches:
+        net = load_bench_net(cfg, batch)
+        dn.network_predict(net, data)
+        runs = max(1, iterations // batch)
+        start = time.time()
+        for _ in range(runs):
+            dn.network_predict(net, data)
+        res["throughput"][str(batch)] = runs*batch / (time.time() - start)
+        dn.free_network(net)
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    scale = 1024.*1024 if sys.platform == "darwin" else 1024.
+    res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return res
+
+
+def bench_worker(args):
+    return bench_cfg(*args)
+
+
+def in_fresh_process(context, func, args):
+    pool = context.Pool(1)
+    try:
+        return pool.apply(func, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run(cfgs, batches, iterations, warmup, thresh, cold_runs, out):
+    results = {}
+    # fork a fresh process per cfg and per cold load, the parent never loads libdarknet
+    context = mp.get_context("fork")
+    for cfg in cfgs:
+        print("benchmarking %s" % cfg)
+        cold = [in_fresh_process(context, bench_cold, (cfg,)) for _ in range(cold_runs)]
+        results[cfg] = in_fresh_process(context, bench_worker, ((cfg, batches, iterations, warmup, thresh),))
+        results[cfg]["load_s"] = percentiles([c[0] for c in cold])
+        results[cfg]["cold_ms"] = percentiles([c[1] for c in cold])
+        print(json.dumps(results[cfg], indent=1))
+    report = {"machine": {"platform": platform.platform(), "processor": platform.processor(),
+                          "cpus": mp.cpu_count(), "python": platform.python_version(),
+                          "omp_num_threads": os.environ.get("OMP_NUM_THREADS")},
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "settings": {"batches": batches, "iterations": iterations, "warmup": warmup, "thresh": thresh,
+                           "cold_runs": cold_runs},
+              "results": results}
+    with open(out, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+def flatten(res, prefix=""):
+    # {"warm_ms": {"p50": 1}} -> {"warm_ms.p50": 1}
+    flat = {}
+    for key, value in res.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and key != "detections":
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(baseline, current, tolerance):
+    with open(baseline) as f:
+        base = json.load(f)["results"]
+    with open(current) as f:
+        cur = json.load(f)["results"]
+    regressions = 0
+    print("%-24s %-20s %12s %12s %8s" % ("cfg", "metric", "baseline", "current", "change"))
+    for cfg in sorted(set(base) & set(cur)):
+        b = flatten(base[cfg])
+        c = flatten(cur[cfg])
+        for metric in sorted(set(b) & set(c)):
+            if not b[metric] or metric in SINGLE_SAMPLE:
+                continue
+            change = (c[metric] - b[metric]) / b[metric]
+            worse = -change if metric.startswith(HIGHER_IS_BETTER) else change
+            flag = ""
+            if worse > tolerance:
+                flag = "REGRESSION"
+                regressions += 1
+            elif worse < -tolerance:
+                flag = "improved"
+            print("%-24s %-20s %12.3f %12.3f %+7.1f%% %s" % (os.path.basename(cfg), metric, b[metric], c[metric],
+                                                             100*change, flag))
+    for cfg in sorted(set(base) ^ set(cur)):
+        print("%s is only in %s" % (cfg, baseline if cfg in base else current))
+    print("%d regressions" % regressions)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="cpu benchmark of darknet cfgs with random weights",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    r = sub.add_parser("run", help="benchmark cfgs and write the results to a json file")
+    r.add_argument("--cfgs", nargs="+", default=DEFAULT_CFGS)
+    r.add_argument("--batches", type=int, nargs="+", default=[1, 2, 4, 8], help="batch sizes for throughput")
+    r.add_argument("--iterations", type=int, default=20, help="timed passes per measurement")
+    r.add_argument("--warmup", type=int, default=3, help="untimed passes before measuring warm latency")
+    r.add_argument("--thresh", type=float, default=.5, help="detection threshold used when timing decoding")
+    r.add_argument("--cold_runs", type=int, default=5, help="fresh processes sampled for load and first pass")
+    r.add_argument("--out", "-o", required=True, help="json file to write")
+
+    c = sub.add_parser("compare", help="flag regressions between two runs")
+    c.add_argument("baseline")
+    c.add_argument("current")
+    c.add_argument("--tolerance", type=float, default=.1, help="relative change allowed before flagging")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        run(args.cfgs, args.batches, args.iterations, args.warmup, args.thresh, args.cold_runs, args.out)
+    else:
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""Static cost model of a darknet cfg: output shape, parameters, FLOPs and memory of every layer, no weights
+or libdarknet needed.
+
+Shapes follow the make_*_layer functions in src/, except that layers darknet leaves without a shape
+(softmax, dropout, ...) pass their input shape through. FLOPs count a multiply-add as 2 for convolutional,
+deconvolutional, local and connected layers, recurrent layers as the sum of their gate layers for one time
+step, and one op per output for everything else, as get_network_profile does. A recurrent net runs
+batch*time_steps rows, so pass that as the batch to compare with its profile. Activation bytes are the float32
+output of a layer for the whole batch, workspace bytes the im2col buffer, which the network allocates once at
+its largest size.
+
+Example usage:
+    ./python/cfg_cost.py cfg/yolov3.cfg
+    ./python/cfg_cost.py cfg/yolov3.cfg --width 608 --height 608 --batch 4
+    ./python/cfg_cost.py cfg/*.cfg --summary --sort bflops
+"""
+
+import argparse
+import json
+import os
+
+FLOAT_BYTES = 4
+
+
+def read_cfg(filename):
+    # [(section type, {option: value string})] like read_cfg in src/parser.c
+    sections = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            if line[0] == "[":
+                sections.append((line, {}))
+            elif "=" in line and sections:
+                key, value = line.split("=", 1)
+                sections[-1][1][key.strip()] = value.strip()
+    return sections
+
+
+SECTION_TYPES = {
+    "[conv]": "convolutional", "[convolutional]": "convolutional",
+    "[deconv]": "deconvolutional", "[deconvolutional]": "deconvolutional",
+    "[local]": "local", "[conn]": "connected", "[connected]": "connected",
+    "[max]": "maxpool", "[maxpool]": "maxpool", "[avg]": "avgpool", "[avgpool]": "avgpool",
+    "[route]": "route", "[shortcut]": "shortcut", "[upsample]": "upsample", "[reorg]": "reorg",
+    "[yolo]": "yolo", "[region]": "region", "[detection]": "detection",
+    "[soft]": "softmax", "[softmax]": "softmax", "[dropout]": "dropout", "[cost]": "cost",
+    "[crop]": "crop", "[activation]": "activation", "[logistic]": "logxent", "[l2norm]": "l2norm",
+    "[lrn]": "normalization", "[normalization]": "normalization", "[batchnorm]": "batchnorm",
+    "[rnn]": "rnn", "[gru]": "gru", "[lstm]": "lstm", "[crnn]": "crnn",
+}
+
+
+def get_int(options, key, default):
+    return int(options.get(key, default))
+
+
+def layer_cost(kind, options, w, h, c, inputs, layers, index):
+    # returns (out_w, out_h, out_c, outputs, params, flops per image, workspace floats)
+    bn = get_int(options, "batch_normalize", 0)
+    if kind == "convolutional":
+        n = get_int(options, "filters", 1)
+        size = get_int(options, "size", 1)
+        stride = get_int(options, "stride", 1)
+        groups = get_int(options, "groups", 1)
+        pad = size // 2 if get_int(options, "pad", 0) else get_int(options, "padding", 0)
+        ow = (w + 2*pad - size) // stride + 1
+        oh = (h + 2*pad - size) // stride + 1
+        weights = c // groups * n * size * size
+        return ow, oh, n, ow*oh*n, weights + n + (n if bn else 0), 2.*weights*ow*oh, ow*oh*size*size*c // groups
+    if kind == "deconvolutional":
+        n = get_int(options, "filters", 1)
+        size = get_int(options, "size", 1)
+        stride = get_int(options, "stride", 1)
+        pad = size // 2 if get_int(options, "pad", 0) else get_int(options, "padding", 0)
+        ow = (w - 1)*stride + size - 2*pad
+        oh = (h - 1)*stride + size - 2*pad
+        weights = c * n * size * size
+        return ow, oh, n, ow*oh*n, weights + n + (n if bn else 0), 2.*weights*w*h, w*h*size*size*n
+    if kind == "local":
+        n = get_int(options, "filters", 1)
+        size = get_int(options, "size", 1)
+        stride = get_int(options, "stride", 1)
+        pad = get_int(options, "pad", 0)
+        ow = (w - (1 if pad else size)) // stride + 1
+        oh = (h - (1 if pad else size)) // stride + 1
+        weights = ow*oh*size*size*c*n
+        return ow, oh, n, ow*oh*n, weights + ow*oh*n, 2.*weights, ow*oh*size*size*c
+    if kind == "connected":
+        n = get_int(options, "output", 1)
+        return 1, 1, n, n, inputs*n + n + (n if bn else 0), 2.*inputs*n, 0
+    if kind in ("rnn", "gru", "lstm"):
+        n = get_int(options, "output", 1)
+        # rnn is input, self and output connected layers, gru six and lstm eight gates
+        gates = {"rnn": (1, 2), "gru": (3, 3), "lstm": (4, 4)}[kind]
+        weights = gates[0]*inputs*n + gates[1]*n*n
+        count = sum(gates)
+        return 1, 1, n, n, weights + count*n + (count*n if bn else 0), 2.*weights, 0
+    if kind == "crnn":
+        hidden = get_int(options, "hidden_filters", 1)
+        n = get_int(options, "output_filters", 1)
+        weights = 9*(c*hidden + hidden*hidden + hidden*n)
+        return w, h, n, w*h*n, weights + 2*hidden + n, 2.*weights*w*h, w*h*9*max(c, hidden)
+    if kind == "maxpool":
+        stride = get_int(options, "stride", 1)
+        size = get_int(options, "size", stride)
+        padding = get_int(options, "padding", (size - 1) // 2)
+        ow = (w + 2*padding) // stride
+        oh = (h + 2*padding) // stride
+        return ow, oh, c, ow*oh*c, 0, float(ow*oh*c), 0
+    if kind == "avgpool":
+        return 1, 1, c, c, 0, float(c), 0
+    if kind == "upsample":
+        stride = get_int(options, "stride", 2)
+        if stride < 0:
+            ow, oh = w // -stride, h // -stride
+        else:
+            ow, oh = w*stride, h*stride
+        return ow, oh, c, ow*oh*c, 0, float(ow*oh*c), 0
+    if kind == "reorg":
+        stride = get_int(options, "stride", 1)
+        if get_int(options, "reverse", 0):
+            ow, oh, oc = w*stride, h*stride, c // (stride*stride)
+        else:
+            ow, oh, oc = w // stride, h // stride, c*stride*stride
+        if get_int(options, "extra", 0):
+            return 0, 0, 0, inputs + get_int(options, "extra", 0), 0, float(inputs), 0
+        return ow, oh, oc, ow*oh*oc, 0, float(ow*oh*oc), 0
+    if kind == "route":
+        sources = [int(i) for i in options["layers"].split(",")]
+        sources = [layers[i if i >= 0 else index + i] for i in sources]
+        first = sources[0]
+        ow, oh, oc = first["output"]
+        for s in sources[1:]:
+            if s["output"][:2] == (ow, oh):
+                oc += s["output"][2]
+            else:
+                ow = oh = oc = 0
+        outputs = sum(s["outputs"] for s in sources)
+        return ow, oh, oc, outputs, 0, float(outputs), 0
+    if kind == "shortcut":
+        return w, h, c, w*h*c, 0, float(w*h*c), 0
+    if kind == "crop":
+        ow = get_int(options, "crop_width", 1)
+        oh = get_int(options, "crop_height", 1)
+        return ow, oh, c, ow*oh*c, 0, float(ow*oh*c), 0
+    if kind == "batchnorm":
+        return w, h, c, w*h*c, 2*c, float(w*h*c), 0
+    # yolo, region, detection, softmax, dropout, cost, activation, logistic, l2norm, normalization
+    return w, h, c, inputs, 0, float(inputs), 0
+
+
+def analyze(sections, width=None, height=None, batch=1):
+    """
+    Per layer and total cost of a parsed cfg at the given input size and batch (the cfg's own width and
+    height by default). Returns {"input": (w, h, c), "batch": batch, "layers": [...], "total": {...}}.
+    """
+    if not sections or sections[0][0] not in ("[net]", "[network]"):
+        raise ValueError("first section must be [net] or [network]")
+    net = sections[0][1]
+    w = width or get_int(net, "width", 0)
+    h = height or get_int(net, "height", 0)
+    c = get_int(net, "channels", 0)
+    inputs = get_int(net, "inputs", w*h*c)
+    input_shape = (w, h, c)
+    layers = []
+    for index, (section, options) in enumerate(sections[1:]):
+        kind = SECTION_TYPES.get(section)
+        if kind is None:
+            raise ValueError("unknown section %s" % section)
+        ow, oh, oc, outputs, params, flops, workspace = layer_cost(kind, options, w, h, c, inputs, layers, index)
+        layers.append({"layer": index, "type": kind, "input": (w, h, c), "output": (ow, oh, oc),
+                       "outputs": outputs, "params": params, "bflops": flops*batch/1e9,
+                       "activation_bytes": outputs*batch*FLOAT_BYTES,
+                       "workspace_bytes": workspace*batch*FLOAT_BYTES if kind == "local" else
+                       workspace*FLOAT_BYTES})
+        w, h, c, inputs = ow, oh, oc, outputs
+    total = {"layers": len(layers),
+             "params": sum(l["params"] for l in layers),
+             "bflops": sum(l["bflops"] for l in layers),
+             "activation_bytes": sum(l["activation_bytes"] for l in layers),
+             "workspace_bytes": max([l["workspace_bytes"] for l in layers] + [0]),
+             "output": layers[-1]["output"] if layers else input_shape}
+    total["weights_bytes"] = total["params"]*FLOAT_BYTES
+    return {"input": input_shape, "batch": batch, "layers": layers, "total": total}
+
+
+def analyze_cfg(filename, width=None, height=None, batch=1):
+    return analyze(read_cfg(filename), width, height, batch)
+
+
+def format_cost(cost):
+    lines = ["%5s %-15s %16s %16s %12s %10s %14s" % ("layer", "type", "input", "output", "params", "BFLOPs",
+                                                      "activations")]
+    for l in cost["layers"]:
+        lines.append("%5d %-15s %16s %16s %12d %10.3f %14d" % (l["layer"], l["type"], "%dx%dx%d" % l["input"],
+                                                               "%dx%dx%d" % l["output"], l["params"], l["bflops"],
+                                                               l["activation_bytes"]))
+    t = cost["total"]
+    lines.append("%5s %-15s %16s %16s %12d %10.3f %14d" % ("", "total", "%dx%dx%d" % cost["input"],
+                                                           "%dx%dx%d" % t["output"], t["params"], t["bflops"],
+                                                           t["activation_bytes"]))
+    lines.append("workspace %d bytes, weights %d bytes, batch %d" % (t["workspace_bytes"], t["weights_bytes"],
+                                                                     cost["batch"]))
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="compute cost of darknet cfgs without loading weights",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("cfgs", nargs="+", help="cfg files to analyze")
+    parser.add_argument("--width", type=int, default=None, help="input width, the cfg's own by default")
+    parser.add_argument("--height", type=int, default=None, help="input height, the cfg's own by default")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--summary", action="store_true", help="one line of totals per cfg")
+    parser.add_argument("--sort", default=None, choices=["params", "bflops", "activation_bytes"],
+                        help="order the summary by this total")
+    parser.add_argument("--json", action="store_true", help="print json instead of tables")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    costs = [(cfg, analyze_cfg(cfg, args.width, args.height, args.batch)) for cfg in args.cfgs]
+    if args.sort:
+        costs.sort(key=lambda c: c[1]["total"][args.sort])
+    if args.json:
+        print(json.dumps(dict((cfg, cost if not args.summary else cost["total"]) for cfg, cost in costs), indent=1))
+    elif args.summary:
+        print("%-32s %12s %10s %14s" % ("cfg", "params", "BFLOPs", "activations"))
+        for cfg, cost in costs:
+            t = cost["total"]
+            print("%-32s %12d %10.3f %14d" % (os.path.basename(cfg), t["params"], t["bflops"], t["activation_bytes"]))
+    else:
+        for cfg, cost in costs:
+            print(cfg)
+            print(format_cost(cost))
@@ -1,6 +1,14 @@
 from ctypes import *
+import json
 import math
+import os
 import random
+import threading
+import numpy as np
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 def sample(probs):
     s = sum(probs)
@@ -38,119 +46,624 @@ class IMAGE(Structure):
                 ("c", c_int),
                 ("data", POINTER(c_float))]
 
+class LAYER_PROFILE(Structure):
+    _fields_ = [("type", c_int),
+                ("w", c_int),
+                ("h", c_int),
+                ("c", c_int),
+                ("out_w", c_int),
+                ("out_h", c_int),
+                ("out_c", c_int),
+                ("runs", c_int),
+                ("ms", c_double),
+                ("flops", c_double),
+                ("output_bytes", c_size_t),
+                ("workspace_bytes", c_size_t)]
+
 class METADATA(Structure):
     _fields_ = [("classes", c_int),
                 ("names", POINTER(c_char_p))]
 
     
 
-#lib = CDLL("/home/pjreddie/documents/darknet/libdarknet.so", RTLD_GLOBAL)
-lib = CDLL("libdarknet.so", RTLD_GLOBAL)
-lib.network_width.argtypes = [c_void_p]
-lib.network_width.restype = c_int
-lib.network_height.argtypes = [c_void_p]
-lib.network_height.restype = c_int
+DEFAULT_LIB_PATHS = ["libdarknet.so",
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "libdarknet.so")]
+lib_lock = threading.Lock()
+loaded_lib = None
+bindings = []
 
-predict = lib.network_predict
-predict.argtypes = [c_void_p, POINTER(c_float)]
-predict.restype = POINTER(c_float)
+def load_library(path=None):
+    """
+    Load libdarknet and use it for every binding in this module. path defaults to $DARKNET_LIB, then
+    libdarknet.so on the loader path, then the one built at the root of this repository. Called
+    implicitly by the first binding used, call it explicitly to pick another library.
+    """
+    global loaded_lib
+    with lib_lock:
+        if loaded_lib is not None and path is None:
+            return loaded_lib
+        if path:
+            paths = [path]
+        elif os.environ.get("DARKNET_LIB"):
+            paths = [os.environ["DARKNET_LIB"]]
+        else:
+            paths = DEFAULT_LIB_PATHS
+        error = None
+        for p in paths:
+            try:
+                lib = CDLL(p, RTLD_GLOBAL)
+            except OSError as e:
+                error = e
+                continue
+            # rebind everything already resolved against a previously loaded library
+            for b in bindings:
+                b.func = None
+            loaded_lib = lib
+            return lib
+        raise error
 
-set_gpu = lib.cuda_set_device
-set_gpu.argtypes = [c_int]
+class Binding(object):
+    # a C function resolved and typed on its first call, optional ones are no-ops when the library lacks them
+    def __init__(self, name, argtypes, restype=None, optional=False):
+        self.name = name
+        self.argtypes = argtypes
+        self.restype = restype
+        self.optional = optional
+        self.func = None
 
-make_image = lib.make_image
-make_image.argtypes = [c_int, c_int, c_int]
-make_image.restype = IMAGE
+    def resolve(self):
+        if self.func is None:
+            lib = load_library()
+            if self.optional and not hasattr(lib, self.name):
+                self.func = lambda *args: None
+            else:
+                func = getattr(lib, self.name)
+                func.argtypes = self.argtypes
+                func.restype = self.restype
+                self.func = func
+        return self.func
 
-get_network_boxes = lib.get_network_boxes
-get_network_boxes.argtypes = [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int, POINTER(c_int)]
-get_network_boxes.restype = POINTER(DETECTION)
+    def __call__(self, *args):
+        func = self.func or self.resolve()
+        return func(*args)
 
-make_network_boxes = lib.make_network_boxes
-make_network_boxes.argtypes = [c_void_p]
-make_network_boxes.restype = POINTER(DETECTION)
+def bind(name, argtypes, restype=None, optional=False):
+    b = Binding(name, argtypes, restype, optional)
+    bindings.append(b)
+    return b
 
-free_detections = lib.free_detections
-free_detections.argtypes = [POINTER(DETECTION), c_int]
+class LazyLibrary(object):
+    # keeps dn.lib working for code that calls into the library directly, the library is loaded on the first
+    # attribute looked up through it
+    def __getattr__(self, name):
+        return getattr(load_library(), name)
 
-free_ptrs = lib.free_ptrs
-free_ptrs.argtypes = [POINTER(c_void_p), c_int]
+lib = LazyLibrary()
 
-network_predict = lib.network_predict
-network_predict.argtypes = [c_void_p, POINTER(c_float)]
+network_width = bind("network_width", [c_void_p], c_int)
+network_height = bind("network_height", [c_void_p], c_int)
+network_max_batch = bind("network_max_batch", [c_void_p], c_int)
+predict = bind("network_predict", [c_void_p, POINTER(c_float)], POINTER(c_float))
+set_gpu = bind("cuda_set_device", [c_int], optional=True)
+make_image = bind("make_image", [c_int, c_int, c_int], IMAGE)
+get_network_boxes = bind("get_network_boxes", [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int,
+                                               POINTER(c_int)], POINTER(DETECTION))
+make_network_boxes = bind("make_network_boxes", [c_void_p, c_float, POINTER(c_int)], POINTER(DETECTION))
+fill_network_boxes = bind("fill_network_boxes", [c_void_p, c_int, c_int, c_float, c_float, POINTER(c_int), c_int,
+                                                 POINTER(DETECTION)])
+num_detections = bind("num_detections", [c_void_p, c_float], c_int)
+free_detections = bind("free_detections", [POINTER(DETECTION), c_int])
+free_ptrs = bind("free_ptrs", [POINTER(c_void_p), c_int])
+network_predict = bind("network_predict", [c_void_p, POINTER(c_float)], POINTER(c_float))
+reset_rnn = bind("reset_rnn", [c_void_p])
+reset_network_state = bind("reset_network_state", [c_void_p, c_int])
+reorder_network_state = bind("reorder_network_state", [c_void_p, POINTER(c_int)])
+load_net = bind("load_network", [c_char_p, c_char_p, c_int], c_void_p)
+free_network = bind("free_network", [c_void_p])
+load_net_snapshot = bind("load_network_snapshot", [c_char_p, c_int], c_void_p)
+save_net_snapshot = bind("save_network_snapshot", [c_void_p, c_char_p, c_char_p])
+load_net_shared = bind("load_network_shared", [c_char_p, c_void_p, c_int], c_void_p)
+free_net_shared = bind("free_network_shared", [c_void_p])
+load_net_batch = bind("load_network_batch", [c_char_p, c_char_p, c_int, c_int], c_void_p)
+set_batch_network = bind("set_batch_network", [c_void_p, c_int])
+reset_batchnorm_statistics = bind("reset_batchnorm_statistics", [c_void_p])
+network_outputs = bind("network_outputs", [c_void_p], c_int)
+get_network_boxes_batch = bind("get_network_boxes_batch", [c_void_p, c_int, c_int, c_int, c_float, c_float,
+                                                           POINTER(c_int), c_int, POINTER(c_int)], POINTER(DETECTION))
+do_nms_obj = bind("do_nms_obj", [POINTER(DETECTION), c_int, c_int, c_float])
+do_nms_sort = bind("do_nms_sort", [POINTER(DETECTION), c_int, c_int, c_float])
+free_image = bind("free_image", [IMAGE])
+letterbox_image = bind("letterbox_image", [IMAGE, c_int, c_int], IMAGE)
+letterbox_image_into = bind("letterbox_image_into", [IMAGE, c_int, c_int, IMAGE])
+fill_image = bind("fill_image", [IMAGE, c_float])
+load_meta = bind("get_metadata", [c_char_p], METADATA)
+load_image = bind("load_image_color", [c_char_p, c_int, c_int], IMAGE)
+rgbgr_image = bind("rgbgr_image", [IMAGE])
+predict_image = bind("network_predict_image", [c_void_p, IMAGE], POINTER(c_float))
+hierarchy_predictions = bind("network_hierarchy_predictions", [c_void_p, POINTER(c_float), c_int, c_int], c_int)
+set_profiling = bind("set_network_profiling", [c_void_p, c_int])
+reset_profile = bind("reset_network_profile", [c_void_p])
+get_network_profile = bind("get_network_profile", [c_void_p, POINTER(LAYER_PROFILE), c_int], c_int)
+get_layer_string = bind("get_layer_string", [c_int], c_char_p)
 
-reset_rnn = lib.reset_rnn
-reset_rnn.argtypes = [c_void_p]
+def top_k_classes(scores, top_k=None):
+    # indexes of the top_k highest scores of every row, best first, ties in class order as sorted() gives,
+    # argpartition keeps it linear in the number of classes when top_k is small
+    n = scores.shape[-1]
+    if top_k is None or top_k >= n:
+        return np.argsort(-scores, axis=-1, kind='stable')
+    idx = np.argpartition(-scores, top_k - 1, axis=-1)[..., :top_k]
+    idx.sort(axis=-1)
+    order = np.argsort(-np.take_along_axis(scores, idx, -1), axis=-1, kind='stable')
+    return np.take_along_axis(idx, order, -1)
 
-load_net = lib.load_network
-load_net.argtypes = [c_char_p, c_char_p, c_int]
-load_net.restype = c_void_p
+def classify_arrays(net, meta, out, n, top_k=None, hierarchy=True):
+    # (indexes, scores) of the best classes for n rows of network output out, with hierarchy the
+    # predictions of a tree model are first turned into leaf probabilities in place, as the classifier does
+    if hierarchy:
+        hierarchy_predictions(net, out, n, 1)
+    scores = np.ctypeslib.as_array(out, shape=(n, network_outputs(net)))[:, :meta.classes]
+    idx = top_k_classes(scores, top_k)
+    return idx, np.take_along_axis(scores, idx, -1)
 
-do_nms_obj = lib.do_nms_obj
-do_nms_obj.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+def classification_tuples(meta, idx, scores):
+    return [(meta.names[i], s) for i, s in zip(idx.tolist(), scores.tolist())]
 
-do_nms_sort = lib.do_nms_sort
-do_nms_sort.argtypes = [POINTER(DETECTION), c_int, c_int, c_float]
+def classify(net, meta, im, top_k=None, hierarchy=True):
+    out = predict_image(net, im)
+    idx, scores = classify_arrays(net, meta, out, 1, top_k, hierarchy)
+    return classification_tuples(meta, idx[0], scores[0])
 
-free_image = lib.free_image
-free_image.argtypes = [IMAGE]
+def get_layer_profile(net):
+    """
+    One dict per layer: type, input and output shape, mean forward milliseconds over the passes run since
+    set_profiling(net, 1) or reset_profile(net), FLOPs of one pass and output/workspace bytes.
+    """
+    n = get_network_profile(net, None, 0)
+    profile = (LAYER_PROFILE*n)()
+    get_network_profile(net, profile, n)
+    return [{"layer": i, "type": get_layer_string(p.type).decode(), "input": (p.w, p.h, p.c),
+             "output": (p.out_w, p.out_h, p.out_c), "runs": p.runs, "ms": p.ms, "flops": p.flops,
+             "output_bytes": p.output_bytes, "workspace_bytes": p.workspace_bytes} for i, p in enumerate(profile)]
 
-letterbox_image = lib.letterbox_image
-letterbox_image.argtypes = [IMAGE, c_int, c_int]
-letterbox_image.restype = IMAGE
+def format_layer_profile(profile):
+    lines = ["%5s %-15s %16s %16s %10s %10s %12s %12s" % ("layer", "type", "input", "output", "ms", "BFLOPs",
+                                                           "out bytes", "workspace")]
+    for p in profile:
+        lines.append("%5d %-15s %16s %16s %10.3f %10.3f %12d %12d" % (
+            p["layer"], p["type"], "%dx%dx%d" % p["input"], "%dx%dx%d" % p["output"], p["ms"], p["flops"]/1e9,
+            p["output_bytes"], p["workspace_bytes"]))
+    lines.append("%5s %-15s %16s %16s %10.3f %10.3f" % ("", "total", "", "", sum(p["ms"] for p in profile),
+                                                        sum(p["flops"] for p in profile)/1e9))
+    return "\n".join(lines)
 
-load_meta = lib.get_metadata
-lib.get_metadata.argtypes = [c_char_p]
-lib.get_metadata.restype = METADATA
+def dump_layer_profile(profile, filename, chrome_trace=False):
+    # plain json list, or a chrome://tracing / perfetto file with the layers laid out back to back
+    if chrome_trace:
+        events = []
+        ts = 0.
+        for p in profile:
+            events.append({"name": "%d %s" % (p["layer"], p["type"]), "ph": "X", "ts": ts, "dur": p["ms"]*1000,
+                           "pid": 0, "tid": 0, "args": p})
+            ts += p["ms"]*1000
+        data = {"traceEvents": events, "displayTimeUnit": "ms"}
+    else:
+        data = profile
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=1)
 
-load_image = lib.load_image_color
-load_image.argtypes = [c_char_p, c_int, c_int]
-load_image.restype = IMAGE
+def image_from_array(arr):
+    # wrap a C-contiguous float32 c x h x w array as an IMAGE without copying, the array is kept
+    # alive by the returned IMAGE, never call free_image on it
+    if arr.dtype != np.float32 or arr.ndim != 3 or not arr.flags['C_CONTIGUOUS']:
+        raise ValueError("expected a C-contiguous float32 array of shape (c, h, w)")
+    c, h, w = arr.shape
+    im = IMAGE(w, h, c, arr.ctypes.data_as(POINTER(c_float)))
+    im.array = arr
+    return im
 
-rgbgr_image = lib.rgbgr_image
-rgbgr_image.argtypes = [IMAGE]
+def image_to_array(im):
+    # view of im.data as a c x h x w float32 array, only valid until the IMAGE is freed
+    return np.ctypeslib.as_array(im.data, shape=(im.c, im.h, im.w))
 
-predict_image = lib.network_predict_image
-predict_image.argtypes = [c_void_p, IMAGE]
-predict_image.restype = POINTER(c_float)
+def array_to_image(arr, bgr=False):
+    # h x w x c uint8 array (as returned by scipy/PIL, or OpenCV with bgr=True) to an IMAGE,
+    # the transpose, channel swap and scaling to [0, 1] happen in a single pass
+    if arr.ndim == 2:
+        arr = arr[:, :, np.newaxis]
+    if bgr:
+        arr = arr[:, :, ::-1]
+    h, w, c = arr.shape
+    data = np.empty((c, h, w), dtype=np.float32)
+    np.multiply(arr.transpose(2, 0, 1), np.float32(1/255.), out=data, casting='unsafe')
+    return image_from_array(data)
 
-def classify(net, meta, im):
-    out = predict_image(net, im)
-    res = []
-    for i in range(meta.classes):
-        res.append((meta.names[i], out[i]))
-    res = sorted(res, key=lambda x: -x[1])
+DETECTION_DTYPE = np.dtype({'names': ['bbox', 'classes', 'prob', 'mask', 'objectness', 'sort_class'],
+                            'formats': [(np.float32, 4), np.int32, np.uintp, np.uintp, np.float32, np.int32],
+                            'offsets': [DETECTION.bbox.offset, DETECTION.classes.offset, DETECTION.prob.offset,
+                                        DETECTION.mask.offset, DETECTION.objectness.offset,
+                                        DETECTION.sort_class.offset],
+                            'itemsize': sizeof(DETECTION)})
+
+def detections_to_raw(dets, num, classes):
+    # returns boxes (n x 4, x/y/w/h), objectness (n) and probs (n x classes) of the boxes with
+    # nonzero objectness, the input nms works on
+    d = np.frombuffer((c_char*(num*sizeof(DETECTION))).from_address(addressof(dets.contents)), DETECTION_DTYPE)
+    # a box scores nothing in any class unless its objectness is above the detection threshold
+    keep = np.flatnonzero(d['objectness'] > 0)
+    probs = np.empty((len(keep), classes), dtype=np.float32)
+    row_bytes = classes*sizeof(c_float)
+    dst = probs.ctypes.data
+    for k, ptr in enumerate(d['prob'][keep].tolist()):
+        memmove(dst + k*row_bytes, ptr, row_bytes)
+    return d['bbox'][keep], d['objectness'][keep], probs
+
+def detections_to_arrays(dets, num, classes, thresh=0, best_class_only=False):
+    # returns boxes (n x 4, x/y/w/h), scores (n) and class ids (n) sorted by descending score,
+    # one row per (box, class) pair scoring above thresh, or per box with best_class_only
+    if num == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+    boxes, _, probs = detections_to_raw(dets, num, classes)
+    if best_class_only:
+        rows = np.arange(len(probs))
+        cols = probs.argmax(axis=1)
+        scores = probs[rows, cols]
+        valid = scores > thresh
+        rows, cols, scores = rows[valid], cols[valid], scores[valid]
+    else:
+        rows, cols = np.nonzero(probs > thresh)
+        scores = probs[rows, cols]
+    order = np.argsort(-scores, kind='stable')
+    return boxes[rows[order]], scores[order], cols[order].astype(np.int32)
+
+def decode_detections_arrays(meta, dets, num, nms=.45, best_class_only=False, nms_method="c", top_k=None):
+    # nms_method "c" runs do_nms_obj, anything else is a method of postprocess.postprocess run in numpy
+    if nms_method == "c":
+        if (nms): do_nms_obj(dets, num, meta.classes, nms);
+        boxes, scores, class_ids = detections_to_arrays(dets, num, meta.classes, best_class_only=best_class_only)
+        return boxes[:top_k], scores[:top_k], class_ids[:top_k]
+    import postprocess
+    if num == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+    boxes, objectness, probs = detections_to_raw(dets, num, meta.classes)
+    return postprocess.postprocess(boxes, objectness, probs, nms, nms_method, top_k=top_k,
+                                   best_class_only=best_class_only)
+
+def detection_tuples(meta, boxes, scores, class_ids):
+    return [(meta.names[i], s, tuple(b)) for b, s, i in zip(boxes.tolist(), scores.tolist(), class_ids.tolist())]
+
+def decode_detections(meta, dets, num, nms=.45, nms_method="c", top_k=None):
+    return detection_tuples(meta, *decode_detections_arrays(meta, dets, num, nms, nms_method=nms_method, top_k=top_k))
+
+def detect_image(net, meta, im, thresh=.5, hier_thresh=.5, nms=.45, nms_method="c", top_k=None):
+    num = c_int(0)
+    pnum = pointer(num)
+    predict_image(net, im)
+    dets = get_network_boxes(net, im.w, im.h, thresh, hier_thresh, None, 0, pnum)
+    num = pnum[0]
+    res = decode_detections(meta, dets, num, nms, nms_method, top_k)
+    free_detections(dets, num)
+    return res
+
+def detect(net, meta, image, thresh=.5, hier_thresh=.5, nms=.45, nms_method="c", top_k=None):
+    im = load_image(image, 0, 0)
+    res = detect_image(net, meta, im, thresh, hier_thresh, nms, nms_method, top_k)
+    free_image(im)
     return res
 
-def detect(net, meta, image, thresh=.5, hier_thresh=.5, nms=.45):
+def detect_arrays(net, meta, image, thresh=.5, hier_thresh=.5, nms=.45, best_class_only=False, nms_method="c",
+                  top_k=None):
     im = load_image(image, 0, 0)
     num = c_int(0)
     pnum = pointer(num)
     predict_image(net, im)
     dets = get_network_boxes(net, im.w, im.h, thresh, hier_thresh, None, 0, pnum)
     num = pnum[0]
-    if (nms): do_nms_obj(dets, num, meta.classes, nms);
-
-    res = []
-    for j in range(num):
-        for i in range(meta.classes):
-            if dets[j].prob[i] > 0:
-                b = dets[j].bbox
-                res.append((meta.names[i], dets[j].prob[i], (b.x, b.y, b.w, b.h)))
-    res = sorted(res, key=lambda x: -x[1])
-    free_image(im)
+    res = decode_detections_arrays(meta, dets, num, nms, best_class_only, nms_method, top_k)
     free_detections(dets, num)
+    free_image(im)
     return res
-    
+
+def check_batch(net, n):
+    # the buffers of net are allocated for the batch it was loaded with, running more images than that
+    # would write past them
+    max_batch = network_max_batch(net)
+    if n < 1 or n > max_batch:
+        raise ValueError("batch of %d images, the network was loaded for 1 to %d" % (n, max_batch))
+
+def predict_batch(net, images):
+    # letterbox every image into one contiguous n x c x h x w buffer and run a single forward pass,
+    # net must have been loaded with load_net_batch(cfg, weights, 0, batch) where batch >= len(images)
+    n = len(images)
+    check_batch(net, n)
+    w = network_width(net)
+    h = network_height(net)
+    size = 3*w*h
+    data = (c_float*(n*size))()
+    for i, im in enumerate(images):
+        sized = letterbox_image(im, w, h)
+        memmove(byref(data, i*size*sizeof(c_float)), sized.data, size*sizeof(c_float))
+        free_image(sized)
+    set_batch_network(net, n)
+    return network_predict(net, data)
+
+def classify_batch(net, meta, images, top_k=None, hierarchy=True):
+    out = predict_batch(net, images)
+    idx, scores = classify_arrays(net, meta, out, len(images), top_k, hierarchy)
+    return [classification_tuples(meta, i, s) for i, s in zip(idx, scores)]
+
+def detect_batch(net, meta, images, thresh=.5, hier_thresh=.5, nms=.45):
+    # checked before loading, so a rejected batch does not leak the loaded images
+    check_batch(net, len(images))
+    ims = [load_image(image, 0, 0) for image in images]
+    predict_batch(net, ims)
+    results = []
+    for b, im in enumerate(ims):
+        num = c_int(0)
+        pnum = pointer(num)
+        dets = get_network_boxes_batch(net, b, im.w, im.h, thresh, hier_thresh, None, 0, pnum)
+        num = pnum[0]
+        results.append(decode_detections(meta, dets, num, nms))
+        free_detections(dets, num)
+        free_image(im)
+    return results
+
+def tile_offsets(size, tile, overlap):
+    # start of every tile along one axis, spread evenly so neighbours overlap by at least overlap*tile
+    # and the last tile ends at size
+    if size <= tile:
+        return [0]
+    stride = max(1, int(tile*(1 - overlap)))
+    n = int(math.ceil(float(size - tile)/stride)) + 1
+    return [int(round(i*float(size - tile)/(n - 1))) for i in range(n)]
+
+def detect_tiled_arrays(net, meta, image, tile=None, overlap=.2, batch=1, thresh=.5, hier_thresh=.5, nms=.45,
+                        nms_method="obj", top_k=None):
+    # cut image (a path or an IMAGE) into overlapping tiles, run them batch at a time and merge the boxes of all
+    # tiles with one nms in image coordinates. tile is (w, h) and defaults to the network size, in which case
+    # crops are copied straight from views of the image into the batch buffer with no resizing.
+    # net must have been loaded with load_net_batch(cfg, weights, 0, batch)
+    check_batch(net, batch)
+    im = load_image(image, 0, 0) if not isinstance(image, IMAGE) else image
+    arr = image_to_array(im)
+    # the network takes 3 channels: grey is repeated, alpha dropped
+    if im.c == 1:
+        arr = np.repeat(arr, 3, axis=0)
+    elif im.c == 4:
+        arr = arr[:3]
+    elif im.c != 3:
+        if not isinstance(image, IMAGE):
+            free_image(im)
+        raise ValueError("images with %d channels are not supported" % im.c)
+    w = network_width(net)
+    h = network_height(net)
+    tw, th = tile or (w, h)
+    tiles = [(x, y) for y in tile_offsets(im.h, th, overlap) for x in tile_offsets(im.w, tw, overlap)]
+    data = np.empty((batch, 3, h, w), dtype=np.float32)
+    boxes, objectness, probs = [], [], []
+    for start in range(0, len(tiles), batch):
+        chunk = tiles[start:start+batch]
+        sizes = []
+        for b, (x, y) in enumerate(chunk):
+            crop = arr[:, y:y+th, x:x+tw]
+            sizes.append((crop.shape[2], crop.shape[1]))
+            if crop.shape[1:] == (h, w):
+                data[b] = crop
+            else:
+                data[b] = .5
+                letterbox_image_into(image_from_array(np.ascontiguousarray(crop)), w, h, image_from_array(data[b]))
+        set_batch_network(net, len(chunk))
+        network_predict(net, data.ctypes.data_as(POINTER(c_float)))
+        for b, (x, y) in enumerate(chunk):
+            num = c_int(0)
+            pnum = pointer(num)
+            dets = get_network_boxes_batch(net, b, sizes[b][0], sizes[b][1], thresh, hier_thresh, None, 0, pnum)
+            num = pnum[0]
+            if num:
+                bb, o, p = detections_to_raw(dets, num, meta.classes)
+                bb[:, 0] += x
+                bb[:, 1] += y
+                boxes.append(bb)
+                objectness.append(o)
+                probs.append(p)
+            free_detections(dets, num)
+    if not isinstance(image, IMAGE):
+        free_image(im)
+    if not boxes:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+    import postprocess
+    return postprocess.postprocess(np.concatenate(boxes), np.concatenate(objectness), np.concatenate(probs),
+                                   nms, nms_method, top_k=top_k)
+
+def detect_tiled(net, meta, image, tile=None, overlap=.2, batch=1, thresh=.5, hier_thresh=.5, nms=.45,
+                 nms_method="obj", top_k=None):
+    return detection_tuples(meta, *detect_tiled_arrays(net, meta, image, tile, overlap, batch, thresh, hier_thresh,
+                                                       nms, nms_method, top_k))
+
+class PrefetchSlot(object):
+    def __init__(self, image):
+        self.image = image
+        self.ready = threading.Event()
+        self.im = None
+        self.sized = None
+
+    def free(self):
+        if self.im is not None:
+            free_image(self.im)
+            free_image(self.sized)
+            self.im = self.sized = None
+
+def detect_iter(net, meta, images, thresh=.5, hier_thresh=.5, nms=.45, prefetch=4, threads=2):
+    # yields (image, detections) in order while background threads decode and letterbox the next
+    # prefetch images, ctypes releases the GIL so decoding really overlaps the forward pass
+    w = network_width(net)
+    h = network_height(net)
+    slots = queue.Queue(prefetch)
+    work = queue.Queue()
+    stop = threading.Event()
+
+    def produce():
+        # the end of the images is marked with None, or with the exception iterating them raised, which the
+        # consumer re-raises
+        end = None
+        try:
+            for image in images:
+                slot = PrefetchSlot(image)
+                queued = False
+                while not queued and not stop.is_set():
+                    try:
+                        slots.put(slot, timeout=.1)
+                        queued = True
+                    except queue.Full:
+                        pass
+                if not queued:
+                    break
+                work.put(slot)
+        except Exception as e:
+            end = e
+        finally:
+            slots.put(end)
+            for _ in range(threads):
+                work.put(None)
+
+    def load():
+        while True:
+            slot = work.get()
+            if slot is None:
+                break
+            if not stop.is_set():
+                slot.im = load_image(slot.image, 0, 0)
+                slot.sized = letterbox_image(slot.im, w, h)
+            slot.ready.set()
+
+    workers = [threading.Thread(target=produce)] + [threading.Thread(target=load) for _ in range(threads)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    try:
+        while True:
+            slot = slots.get()
+            if slot is None:
+                break
+            if isinstance(slot, Exception):
+                raise slot
+            slot.ready.wait()
+            set_batch_network(net, 1)
+            network_predict(net, slot.sized.data)
+            num = c_int(0)
+            pnum = pointer(num)
+            dets = get_network_boxes(net, slot.im.w, slot.im.h, thresh, hier_thresh, None, 0, pnum)
+            num = pnum[0]
+            res = decode_detections(meta, dets, num, nms)
+            free_detections(dets, num)
+            slot.free()
+            yield slot.image, res
+    finally:
+        # the consumer may stop early, release whatever was already prefetched
+        stop.set()
+        while True:
+            try:
+                slot = slots.get(timeout=.1)
+            except queue.Empty:
+                if not workers[0].is_alive():
+                    break
+                continue
+            if not isinstance(slot, PrefetchSlot):
+                break
+            slot.ready.wait()
+            slot.free()
+        for t in workers:
+            t.join()
+
+class DetectorSession(object):
+    """
+    Owns a network, its metadata and the buffers needed to run it: the letterboxed input image and a
+    detection array large enough for every box the network can output are allocated once and refilled
+    in place by each call, so steady-state inference does no per-frame allocation of its own.
+    replica() makes another session whose network shares this one's weights, e.g. one per thread.
+    """
+    def __init__(self, cfg, weights, datacfg, thresh=.5, hier_thresh=.5, nms=.45, base=None, nms_method="c",
+                 top_k=None):
+        self.cfg = cfg
+        self.base = base
+        if base is None:
+            self.net = load_net(cfg, weights, 0)
+            self.meta = load_meta(datacfg)
+        else:
+            self.net = load_net_shared(cfg, base.net, 0)
+            self.meta = base.meta
+        self.thresh = thresh
+        self.hier_thresh = hier_thresh
+        self.nms = nms
+        self.nms_method = nms_method
+        self.top_k = top_k
+        self.w = network_width(self.net)
+        self.h = network_height(self.net)
+        set_batch_network(self.net, 1)
+        self.boxed = make_image(self.w, self.h, 3)
+        # every yolo cell passes a negative threshold, so this is the most boxes the network can return
+        self.capacity = c_int(0)
+        self.dets = make_network_boxes(self.net, -1, pointer(self.capacity))
+
+    def predict_image(self, im):
+        fill_image(self.boxed, .5)
+        letterbox_image_into(im, self.w, self.h, self.boxed)
+        return network_predict(self.net, self.boxed.data)
+
+    def fill_detections(self, im):
+        # returns the number of boxes of self.dets filled for im, before nms
+        self.predict_image(im)
+        num = num_detections(self.net, self.thresh)
+        fill_network_boxes(self.net, im.w, im.h, self.thresh, self.hier_thresh, None, 0, self.dets)
+        return num
+
+    def detect_image(self, im):
+        return detection_tuples(self.meta, *self.detect_image_arrays(im))
+
+    def detect_image_arrays(self, im, best_class_only=False):
+        num = self.fill_detections(im)
+        return decode_detections_arrays(self.meta, self.dets, num, self.nms, best_class_only, self.nms_method,
+                                        self.top_k)
+
+    def detect(self, image):
+        im = load_image(image, 0, 0)
+        res = self.detect_image(im)
+        free_image(im)
+        return res
+
+    def close(self):
+        if self.net is None:
+            return
+        free_detections(self.dets, self.capacity.value)
+        free_image(self.boxed)
+        if self.base is None:
+            free_network(self.net)
+        else:
+            free_net_shared(self.net)
+        self.net = None
+
+    def replica(self):
+        # the replica only owns activations and workspace, close it before closing this session
+        return DetectorSession(self.cfg, None, None, self.thresh, self.hier_thresh, self.nms, base=self,
+                               nms_method=self.nms_method, top_k=self.top_k)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 if __name__ == "__main__":
     #net = load_net("cfg/densenet201.cfg", "/home/pjreddie/trained/densenet201.weights", 0)
     #im = load_image("data/wolf.jpg", 0, 0)
     #meta = load_meta("cfg/imagenet1k.data")
     #r = classify(net, meta, im)
-    #print r[:10]
+    #print(r[:10])
     net = load_net("cfg/tiny-yolo.cfg", "tiny-yolo.weights", 0)
     meta = load_meta("cfg/coco.data")
     r = detect(net, meta, "data/dog.jpg")
-    print r
+    print(r)
+    #net = load_net_batch("cfg/yolov3-tiny.cfg", "yolov3-tiny.weights", 0, 4)
+    #r = detect_batch(net, meta, ["data/dog.jpg", "data/horses.jpg", "data/person.jpg", "data/eagle.jpg"])
+    #print(r)
     
-
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import darknet as dn
+
+MISSING = object()
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def image_key(image):
+    # hash of the image content, not its name, so renamed or re-uploaded copies of a file share an entry.
+    # image is a path (bytes or str) or an h x w x c uint8 array as taken by array_to_image
+    if isinstance(image, np.ndarray):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(("%s %s" % (image.dtype.str, image.shape)).encode())
+        h.update(np.ascontiguousarray(image).data)
+        return h.hexdigest()
+    with open(image, "rb") as f:
+        return hash_bytes(f.read())
+
+
+def net_key(cfg, weights):
+    # identifies a network by its cfg content and the path, size and mtime of its weights, hashing a
+    # few hundred MB of weights on every start would cost more than most caches save
+    with open(cfg, "rb") as f:
+        h = hashlib.blake2b(f.read(), digest_size=16)
+    if weights:
+        st = os.stat(weights)
+        h.update(("%s %d %d" % (os.path.abspath(weights), st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+
+class DetectionCache(object):
+    """
+    LRU of pickled results keyed by a hash, bounded by max_entries and max_bytes of pickled data.
+    With directory set, entries are also written there, one file per key, and a memory miss is looked
+    up on disk before it counts as a miss; the disk tier is never evicted. Thread-safe.
+    hits, disk_hits, misses and evictions count what happened since the cache was made or reset_stats().
+    """
+    def __init__(self, max_entries=1024, max_bytes=64 << 20, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.reset_stats()
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "evictions": self.evictions, "entries": len(self.entries), "bytes": self.nbytes,
+                "hit_rate": float(self.hits + self.disk_hits) / lookups if lookups else 0.}
+
+    def key(self, *parts):
+        return hash_bytes(repr(parts).encode())
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def insert(self, key, data):
+        # caller holds the lock
+        if key in self.entries:
+            self.nbytes -= len(self.entries.pop(key))
+        if len(data) > self.max_bytes:
+            return
+        self.entries[key] = data
+        self.nbytes += len(data)
+        while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.nbytes -= len(old)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return pickle.loads(data)
+        if self.directory:
+            try:
+                with open(self.disk_path(key), "rb") as f:
+                    data = f.read()
+            except IOError:
+                data = None
+            if data is not None:
+                with self.lock:
+                    self.insert(key, data)
+                    self.disk_hits += 1
+                return pickle.loads(data)
+        with self.lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.insert(key, data)
+        if self.directory:
+            path = self.disk_path(key)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename, so a concurrent reader never sees a partial file
+            tmp = "%s.%d.%d" % (path, os.getpid(), threading.get_ident())
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def memoize(self, key, compute):
+        # cached value of key, or compute() stored under it. Results are unpickled on every hit, so callers
+        # can modify what they get back without touching the cache
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+
+class CachedDetector(object):
+    """
+    detect() and classify() of one network memoized by image content, network identity and every
+    argument that changes the result. net_id must change whenever the weights do, net_key(cfg, weights)
+    gives one. Several detectors may share a cache as long as their net_ids differ.
+    """
+    def __init__(self, net, meta, net_id, cache=None):
+        self.net = net
+        self.meta = meta
+        self.net_id = net_id
+        self.cache = cache if cache is not None else DetectionCache()
+
+    def detect(self, image, thresh=.5, hier_thresh=.5, nms=.45, nms_method="c", top_k=None):
+        key = self.cache.key("detect", self.net_id, image_key(image), thresh, hier_thresh, nms, nms_method, top_k)
+        return self.cache.memoize(key, lambda: self.run_detect(image, thresh, hier_thresh, nms, nms_method, top_k))
+
+    def run_detect(self, image, thresh, hier_thresh, nms, nms_method, top_k):
+        if isinstance(image, np.ndarray):
+            return dn.detect_image(self.net, self.meta, dn.array_to_image(image), thresh, hier_thresh, nms,
+                                   nms_method, top_k)
+        return dn.detect(self.net, self.meta, image, thresh, hier_thresh, nms, nms_method, top_k)
+
+    def classify(self, image, top_k=None):
+        key = self.cache.key("classify", self.net_id, image_key(image), top_k)
+        return self.cache.memoize(key, lambda: self.run_classify(image, top_k))
+
+    def run_classify(self, image, top_k):
+        if isinstance(image, np.ndarray):
+            return dn.classify(self.net, self.meta, dn.array_to_image(image), top_k)
+        im = dn.load_image(image, 0, 0)
+        res = dn.classify(self.net, self.meta, im, top_k)
+        dn.free_image(im)
+        return res
@@ -0,0 +1,185 @@
+import multiprocessing as mp
+from collections import deque
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def worker_main(worker_id, cfg, weights, datacfg, session_args, tasks, results, current, session=None):
+    # a network handle can't be shared, so every worker process loads its own unless it
+    # was forked from a parent that already loaded one
+    if session is None:
+        import darknet as dn
+        session = dn.DetectorSession(cfg, weights, datacfg, **session_args)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, image = task
+        # lets the pool tell which image was being detected if darknet exits the process
+        current.value = task_id
+        try:
+            results.put((task_id, worker_id, True, session.detect(image)))
+        except Exception as e:
+            results.put((task_id, worker_id, False, repr(e)))
+        current.value = -1
+    session.close()
+
+
+class Worker(object):
+    def __init__(self, worker_id, pool):
+        self.worker_id = worker_id
+        self.tasks = pool.context.Queue()
+        self.inflight = {}
+        self.current = pool.context.Value("q", -1, lock=False)
+        self.process = pool.context.Process(target=worker_main,
+                                            args=(worker_id, pool.cfg, pool.weights, pool.datacfg,
+                                                  pool.session_args, self.tasks, pool.results, self.current,
+                                                  pool.session))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, task_id, image):
+        self.inflight[task_id] = image
+        self.tasks.put((task_id, image))
+
+
+class DetectorPool(object):
+    """
+    Runs detection in worker processes, each with its own network loaded via DetectorSession.
+    Images are handed to the least busy worker, at most max_pending of them are in flight at once,
+    and map() yields the results in input order. A worker that dies is restarted and its in-flight
+    images are resubmitted, up to max_restarts times over the life of the pool. The image a worker was
+    detecting when it died is resubmitted until it has taken down max_task_crashes workers, then it
+    fails with ok=False instead, and that last restart is not charged against max_restarts: darknet
+    exits on an unreadable image, which would otherwise crash every replacement in turn.
+    With share_weights the network is loaded once in this process and the workers are forked from it,
+    so the weight pages stay shared copy-on-write and only activations are private to each worker.
+    """
+    def __init__(self, cfg, weights, datacfg, workers=None, max_pending=None, max_restarts=3, poll_interval=.5,
+                 share_weights=False, max_task_crashes=1, **session_args):
+        self.cfg = cfg
+        self.weights = weights
+        self.datacfg = datacfg
+        self.session_args = session_args
+        self.num_workers = workers or mp.cpu_count()
+        self.max_pending = max_pending or 2*self.num_workers
+        self.max_restarts = max_restarts
+        self.poll_interval = poll_interval
+        self.restarts = 0
+        self.max_task_crashes = max_task_crashes
+        self.task_crashes = {}
+        self.failed = deque()
+        self.next_task_id = 0
+        self.session = None
+        self.context = mp
+        if share_weights:
+            import darknet as dn
+            self.context = mp.get_context("fork")
+            self.session = dn.DetectorSession(cfg, weights, datacfg, **session_args)
+        self.results = self.context.Queue()
+        self.workers = [Worker(i, self) for i in range(self.num_workers)]
+
+    def pending(self):
+        return sum(len(w.inflight) for w in self.workers)
+
+    def submit(self, image):
+        worker = min(self.workers, key=lambda w: len(w.inflight))
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        worker.submit(task_id, image)
+        return task_id
+
+    def check_workers(self):
+        for i, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                continue
+            culprit = worker.current.value
+            if culprit in worker.inflight:
+                self.task_crashes[culprit] = self.task_crashes.get(culprit, 0) + 1
+                if self.task_crashes[culprit] >= self.max_task_crashes:
+                    del worker.inflight[culprit]
+                    del self.task_crashes[culprit]
+                    self.failed.append((culprit, False, "detector worker %d exited with code %s on this image"
+                                        % (worker.worker_id, worker.process.exitcode)))
+                    culprit = None
+            if culprit is not None:
+                if self.restarts >= self.max_restarts:
+                    raise RuntimeError("detector worker %d exited with code %s, restart limit reached"
+                                       % (worker.worker_id, worker.process.exitcode))
+                self.restarts += 1
+            replacement = Worker(worker.worker_id, self)
+            for task_id, image in sorted(worker.inflight.items()):
+                replacement.submit(task_id, image)
+            self.workers[i] = replacement
+
+    def collect(self):
+        # wait for one result, returns (task_id, ok, result)
+        while True:
+            if self.failed:
+                return self.failed.popleft()
+            try:
+                task_id, worker_id, ok, res = self.results.get(timeout=self.poll_interval)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            worker = self.workers[worker_id]
+            # a result from a worker that was replaced after sending it
+            if task_id not in worker.inflight:
+                continue
+            del worker.inflight[task_id]
+            self.task_crashes.pop(task_id, None)
+            return task_id, ok, res
+
+    def map(self, images):
+        images = iter(images)
+        first = self.next_task_id
+        done = {}
+        exhausted = False
+        next_id = first
+        while True:
+            while not exhausted and self.pending() < self.max_pending:
+                try:
+                    self.submit(next(images))
+                except StopIteration:
+                    exhausted = True
+            if next_id in done:
+                ok, res = done.pop(next_id)
+                next_id += 1
+                if not ok:
+                    raise RuntimeError("detection failed for image %d: %s" % (next_id - 1 - first, res))
+                yield res
+                continue
+            if exhausted and next_id == self.next_task_id:
+                return
+            task_id, ok, res = self.collect()
+            done[task_id] = (ok, res)
+
+    def detect(self, image):
+        return next(self.map([image]))
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(self.poll_interval*10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self.workers = []
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    with DetectorPool("cfg/yolov3-tiny.cfg", "yolov3-tiny.weights", "cfg/coco.data", workers=4) as pool:
+        for r in pool.map(["data/dog.jpg", "data/horses.jpg", "data/person.jpg", "data/eagle.jpg"]):
+            print(r)
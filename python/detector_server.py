@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""A local HTTP detection server that groups concurrent requests into micro-batches.
+
+Requests wait in a bounded queue, up to max_batch of them are taken at once (waiting at most max_wait_ms
+for the batch to fill up) and run through one batched forward pass in an executor thread, then every
+request gets its own detections back. A full queue is answered with 503 right away.
+
+    POST /detect   {"path": "data/dog.jpg"}  ->  {"detections": [{"name": "dog", "prob": 0.9, "box": [x, y, w, h]}]}
+    GET  /stats    counters for requests, batches and the current queue depth
+
+Example usage:
+    ./python/detector_server.py -c cfg/yolov3-tiny.cfg -w yolov3-tiny.weights -d cfg/coco.data --port 8080
+    ./python/detector_server.py -c cfg/yolov3-tiny.cfg -w yolov3-tiny.weights -d cfg/coco.data --unix /tmp/dn.sock
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+
+import darknet as dn
+
+
+class MicroBatchDetector(object):
+    def __init__(self, cfg, weights, datacfg, max_batch=8, max_wait_ms=5, queue_depth=64,
+                 thresh=.5, hier_thresh=.5, nms=.45):
+        self.net = dn.load_net_batch(cfg.encode(), weights.encode(), 0, max_batch)
+        self.meta = dn.load_meta(datacfg.encode())
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.thresh = thresh
+        self.hier_thresh = hier_thresh
+        self.nms = nms
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        # the network is not thread safe, every forward pass goes through this single thread
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "batched_images": 0}
+
+    def detect_batch(self, paths):
+        results = dn.detect_batch(self.net, self.meta, [p.encode() for p in paths],
+                                  self.thresh, self.hier_thresh, self.nms)
+        return [[{"name": name.decode(), "prob": prob, "box": list(box)} for name, prob, box in res]
+                for res in results]
+
+    def submit(self, path):
+        # returns a future for the detections of path, raises asyncio.QueueFull when the queue is full
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((path, future))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise
+        self.stats["requests"] += 1
+        return future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.stats["batches"] += 1
+            self.stats["batched_images"] += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.detect_batch, [p for p, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+            for (_, future), res in zip(batch, results):
+                if not future.cancelled():
+                    future.set_result(res)
+
+
+class DetectionServer(object):
+    def __init__(self, detector):
+        self.detector = detector
+
+    async def respond(self, writer, status, body):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+                   503: "Service Unavailable"}
+        data = json.dumps(body).encode()
+        writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                      % (status, reasons[status], len(data))).encode() + data)
+        await writer.drain()
+
+    async def handle_request(self, method, target, body):
+        if method == "GET" and target == "/stats":
+            stats = dict(self.detector.stats)
+            stats["queue_depth"] = self.detector.queue.qsize()
+            if stats["batches"]:
+                stats["mean_batch_size"] = float(stats["batched_images"]) / stats["batches"]
+            return 200, stats
+        if method != "POST" or target != "/detect":
+            return 404, {"error": "unknown endpoint %s %s" % (method, target)}
+        try:
+            path = json.loads(body.decode())["path"]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "expected a json body like {\"path\": \"image.jpg\"}"}
+        # darknet exits the whole process on an unreadable image, so check it up front
+        if not os.path.isfile(path):
+            return 400, {"error": "%s does not exist" % path}
+        try:
+            future = self.detector.submit(path)
+        except asyncio.QueueFull:
+            return 503, {"error": "queue is full"}
+        try:
+            detections = await future
+        except Exception as e:
+            # the whole batch failed, every request in it gets the error rather than a closed socket
+            return 500, {"error": str(e)}
+        return 200, {"detections": detections}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target = request_line.decode().split()[:2]
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, value = line.split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, res = await self.handle_request(method, target, body)
+                await self.respond(writer, status, res)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    detector = MicroBatchDetector(args.cfg, args.weights, args.data, args.max_batch, args.max_wait_ms,
+                                  args.queue_depth, args.thresh, args.hier_thresh, args.nms)
+    server = DetectionServer(detector)
+    if args.unix:
+        srv = await asyncio.start_unix_server(server.handle_connection, path=args.unix)
+        print("listening on %s" % args.unix)
+    else:
+        srv = await asyncio.start_server(server.handle_connection, args.host, args.port)
+        print("listening on http://%s:%d" % (args.host, args.port))
+    batcher = asyncio.ensure_future(detector.run())
+    try:
+        await srv.serve_forever()
+    finally:
+        batcher.cancel()
+        detector.executor.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="micro-batching local detection server",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--cfg", "-c", required=True, help="network cfg file")
+    parser.add_argument("--weights", "-w", required=True, help="network weights file")
+    parser.add_argument("--data", "-d", required=True, help="data file listing the class names")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--unix", default=None, help="listen on this unix socket instead of tcp")
+    parser.add_argument("--max_batch", type=int, default=8, help="largest batch run in one forward pass")
+    parser.add_argument("--max_wait_ms", type=float, default=5, help="longest wait for a batch to fill up")
+    parser.add_argument("--queue_depth", type=int, default=64, help="requests allowed to wait before 503")
+    parser.add_argument("--thresh", type=float, default=.5)
+    parser.add_argument("--hier_thresh", type=float, default=.5)
+    parser.add_argument("--nms", type=float, default=.45)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parse_args()))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""Fold the batchnorm of convolutional, deconvolutional and connected layers into their weights and biases.
+
+At inference a layer with batch_normalize=1 computes
+    y = scale*(x - rolling_mean)/(sqrt(rolling_variance) + .000001) + bias
+over its output (normalize_cpu, scale_bias and add_bias in src/), which is the same as using
+    weights' = weights*s,  bias' = bias - rolling_mean*s,  s = scale/(sqrt(rolling_variance) + .000001)
+without batchnorm. The tool reads the .weights file through a memory map, writes a cfg with batch_normalize
+removed from the folded layers and the matching weights file, which drops three floats per filter. The
+output pair is for inference only, training it again would start without batchnorm.
+
+Example usage:
+    ./python/fold_batchnorm.py -c cfg/yolov3.cfg -w yolov3.weights -o yolov3-folded
+    ./darknet detector test cfg/coco.data yolov3-folded.cfg yolov3-folded.weights data/dog.jpg
+"""
+
+import argparse
+
+import numpy as np
+
+import cfg_cost
+
+FOLDABLE = ("convolutional", "deconvolutional", "connected")
+
+
+def read_header(mm):
+    # (header bytes, transpose flag, offset of the first layer) as read by load_weights_upto in src/parser.c
+    major, minor, revision = np.frombuffer(mm, dtype=np.int32, count=3)
+    seen_bytes = 8 if (major*10 + minor) >= 2 and major < 1000 and minor < 1000 else 4
+    offset = 12 + seen_bytes
+    return mm[:offset].tobytes(), major > 1000 or minor > 1000, offset
+
+
+def layer_blocks(kind, options, layer):
+    # names and float counts of the arrays a layer stores, in file order
+    bn = cfg_cost.get_int(options, "batch_normalize", 0)
+    w, h, c = layer["input"]
+    if kind in ("convolutional", "deconvolutional"):
+        n = cfg_cost.get_int(options, "filters", 1)
+        size = cfg_cost.get_int(options, "size", 1)
+        groups = cfg_cost.get_int(options, "groups", 1) if kind == "convolutional" else 1
+        blocks = [("biases", n)]
+        if bn:
+            blocks += [("scales", n), ("rolling_mean", n), ("rolling_variance", n)]
+        return blocks + [("weights", c // groups * n * size*size)]
+    if kind == "connected":
+        inputs = int(np.prod(layer["input"])) if layer["input"][0] else layer["inputs"]
+        n = layer["outputs"]
+        blocks = [("biases", n), ("weights", n*inputs)]
+        if bn:
+            blocks += [("scales", n), ("rolling_mean", n), ("rolling_variance", n)]
+        return blocks
+    if kind == "batchnorm":
+        return [("scales", c), ("rolling_mean", c), ("rolling_variance", c)]
+    if kind == "local":
+        size = cfg_cost.get_int(options, "size", 1)
+        n = cfg_cost.get_int(options, "filters", 1)
+        ow, oh, _ = layer["output"]
+        return [("biases", layer["outputs"]), ("weights", size*size*c*n*ow*oh)]
+    if kind in ("rnn", "gru", "lstm", "crnn"):
+        raise ValueError("%s layers are not supported" % kind)
+    return []
+
+
+def read_weights(cfg, weights):
+    """
+    Returns (header bytes, transpose flag, layers), where every layer is (type, cfg options, arrays) and
+    arrays maps names to float32 views of the memory-mapped weights file, in the order load_weights reads them.
+    """
+    sections = cfg_cost.read_cfg(cfg)
+    cost = cfg_cost.analyze(sections)
+    mm = np.memmap(weights, dtype=np.uint8, mode="r")
+    header, transpose, offset = read_header(mm)
+    layers = []
+    for (section, options), layer in zip(sections[1:], cost["layers"]):
+        arrays = {}
+        if not cfg_cost.get_int(options, "dontload", 0):
+            if cfg_cost.get_int(options, "dontloadscales", 0):
+                raise ValueError("layer %d has dontloadscales, its file layout is ambiguous" % layer["layer"])
+            for name, count in layer_blocks(layer["type"], options, layer):
+                arrays[name] = np.ndarray((count,), dtype=np.float32, buffer=mm, offset=offset)
+                offset += 4*count
+        layers.append((layer["type"], options, arrays))
+    if offset > len(mm):
+        raise ValueError("%s has %d bytes but %s needs %d" % (weights, len(mm), cfg, offset))
+    return header, transpose, layers
+
+
+def fold(kind, options, arrays, transpose):
+    # returns folded (biases, weights) for a layer with batchnorm
+    s = arrays["scales"].astype(np.float64) / (np.sqrt(arrays["rolling_variance"].astype(np.float64)) + .000001)
+    n = len(s)
+    weights = arrays["weights"].astype(np.float64)
+    if kind == "deconvolutional":
+        # c x n x size x size, the output channel is the second axis
+        size = cfg_cost.get_int(options, "size", 1)
+        weights = (weights.reshape(-1, n, size*size)*s[None, :, None]).ravel()
+    elif (kind == "convolutional" and cfg_cost.get_int(options, "flipped", 0)) or (kind == "connected" and transpose):
+        # stored transposed, one column per output
+        weights = (weights.reshape(-1, n)*s[None, :]).ravel()
+    else:
+        weights = (weights.reshape(n, -1)*s[:, None]).ravel()
+    biases = arrays["biases"] - arrays["rolling_mean"]*s
+    return biases.astype(np.float32), weights.astype(np.float32)
+
+
+def write_cfg(cfg, out, folded):
+    # copy the cfg dropping batch_normalize from the folded sections, everything else stays as written
+    index = -1
+    with open(cfg) as f, open(out, "w") as o:
+        for line in f:
+            stripped = line.strip()
+            if stripped.startswith("["):
+                index += 1
+            elif index - 1 in folded and stripped.replace(" ", "").startswith("batch_normalize="):
+                continue
+            o.write(line)
+
+
+def fold_batchnorm(cfg, weights, out_cfg, out_weights):
+    """
+    Writes out_cfg and out_weights with the batchnorm of every foldable layer folded in, the other layers
+    are copied unchanged. Returns the indexes of the folded layers.
+    """
+    header, transpose, layers = read_weights(cfg, weights)
+    folded = set()
+    with open(out_weights, "wb") as f:
+        f.write(header)
+        for i, (kind, options, arrays) in enumerate(layers):
+            if kind in FOLDABLE and "scales" in arrays:
+                arrays = dict(zip(("biases", "weights"), fold(kind, options, arrays, transpose)))
+                folded.add(i)
+            for a in arrays.values():
+                f.write(a.tobytes())
+    write_cfg(cfg, out_cfg, folded)
+    return folded
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="fold batchnorm into conv/connected weights for inference",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--cfg", "-c", required=True, help="network cfg file")
+    parser.add_argument("--weights", "-w", required=True, help="weights file trained with that cfg")
+    parser.add_argument("--out", "-o", required=True, help="output prefix, writes <out>.cfg and <out>.weights")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    folded = fold_batchnorm(args.cfg, args.weights, args.out + ".cfg", args.out + ".weights")
+    print("folded batchnorm of %d layers into %s.cfg and %s.weights" % (len(folded), args.out, args.out))
@@ -0,0 +1,152 @@
+import numpy as np
+
+# Detection post-processing in numpy, working on the raw per-box arrays of a DETECTION buffer:
+#     boxes (n x 4, center x/y, w, h), objectness (n), probs (n x classes)
+# nms_obj and nms_sort give the same result as do_nms_obj and do_nms_sort in src/box.c.
+
+
+def box_iou(box, boxes):
+    # iou of one box against many, computed like box_iou in src/box.c
+    left = np.maximum(box[0] - box[2]/2, boxes[:, 0] - boxes[:, 2]/2)
+    right = np.minimum(box[0] + box[2]/2, boxes[:, 0] + boxes[:, 2]/2)
+    top = np.maximum(box[1] - box[3]/2, boxes[:, 1] - boxes[:, 3]/2)
+    bottom = np.minimum(box[1] + box[3]/2, boxes[:, 1] + boxes[:, 3]/2)
+    w = right - left
+    h = bottom - top
+    inter = np.where((w < 0) | (h < 0), 0, w*h)
+    return inter / (box[2]*box[3] + boxes[:, 2]*boxes[:, 3] - inter)
+
+
+def greedy_nms(boxes, scores, thresh):
+    # indices kept by greedy nms, highest score first. each kept box is compared in one vectorized step
+    # against the lower scoring boxes not suppressed yet, so no n x n matrix is built
+    order = np.argsort(-scores, kind='stable')
+    boxes = boxes[order]
+    left = boxes[:, 0] - boxes[:, 2]/2
+    right = boxes[:, 0] + boxes[:, 2]/2
+    top = boxes[:, 1] - boxes[:, 3]/2
+    bottom = boxes[:, 1] + boxes[:, 3]/2
+    area = boxes[:, 2]*boxes[:, 3]
+    keep = []
+    rest = np.arange(len(order))
+    while len(rest):
+        i = rest[0]
+        keep.append(i)
+        rest = rest[1:]
+        w = np.minimum(right[i], right[rest]) - np.maximum(left[i], left[rest])
+        h = np.minimum(bottom[i], bottom[rest]) - np.maximum(top[i], top[rest])
+        inter = np.where((w < 0) | (h < 0), 0, w*h)
+        rest = rest[inter / (area[i] + area[rest] - inter) <= thresh]
+    return order[keep]
+
+
+def nms_obj(boxes, objectness, probs, thresh):
+    # same as do_nms_obj: class agnostic, boxes ranked by objectness, suppressed boxes lose all classes
+    probs = probs.copy()
+    candidates = np.flatnonzero(objectness != 0)
+    keep = candidates[greedy_nms(boxes[candidates], objectness[candidates], thresh)]
+    mask = np.zeros(len(probs), dtype=bool)
+    mask[keep] = True
+    probs[~mask] = 0
+    return probs
+
+
+def nms_sort(boxes, objectness, probs, thresh):
+    # same as do_nms_sort: nms run separately for every class over the boxes scoring in it
+    probs = probs.copy()
+    alive = objectness != 0
+    probs[~alive] = 0
+    for k in range(probs.shape[1]):
+        candidates = np.flatnonzero(probs[:, k] > 0)
+        if len(candidates) < 2:
+            continue
+        keep = candidates[greedy_nms(boxes[candidates], probs[candidates, k], thresh)]
+        column = np.zeros(len(probs), dtype=probs.dtype)
+        column[keep] = probs[keep, k]
+        probs[:, k] = column
+    return probs
+
+
+def soft_nms(boxes, scores, thresh, sigma=.5, method='gaussian', score_thresh=.001):
+    # returns (indices, decayed scores) in the order the boxes were picked
+    scores = scores.astype(np.float32).copy()
+    remaining = np.flatnonzero(scores > score_thresh)
+    picked = []
+    picked_scores = []
+    while len(remaining):
+        best = remaining[np.argmax(scores[remaining])]
+        picked.append(best)
+        picked_scores.append(scores[best])
+        remaining = remaining[remaining != best]
+        if not len(remaining):
+            break
+        iou = box_iou(boxes[best], boxes[remaining])
+        if method == 'linear':
+            decay = np.where(iou > thresh, 1 - iou, 1)
+        else:
+            decay = np.exp(-(iou*iou)/sigma)
+        scores[remaining] *= decay
+        remaining = remaining[scores[remaining] > score_thresh]
+    return np.array(picked, dtype=np.int64), np.array(picked_scores, dtype=np.float32)
+
+
+def soft_nms_probs(boxes, objectness, probs, thresh, sigma=.5, method='gaussian', class_agnostic=False,
+                   score_thresh=.001):
+    out = np.zeros_like(probs)
+    alive = np.flatnonzero(objectness != 0)
+    if class_agnostic:
+        best = probs[alive].argmax(axis=1)
+        picked, scores = soft_nms(boxes[alive], probs[alive, best], thresh, sigma, method, score_thresh)
+        out[alive[picked], best[picked]] = scores
+        return out
+    for k in range(probs.shape[1]):
+        candidates = alive[probs[alive, k] > 0]
+        if not len(candidates):
+            continue
+        picked, scores = soft_nms(boxes[candidates], probs[candidates, k], thresh, sigma, method, score_thresh)
+        out[candidates[picked], k] = scores
+    return out
+
+
+def top_detections(boxes, probs, score_thresh=0, top_k=None, best_class_only=False):
+    # flatten to one row per (box, class) scoring above score_thresh, or per box with best_class_only,
+    # best first, at most top_k rows
+    if best_class_only:
+        best = probs.argmax(axis=1)
+        probs = np.where(np.arange(probs.shape[1]) == best[:, None], probs, 0)
+    rows, cols = np.nonzero(probs > score_thresh)
+    scores = probs[rows, cols]
+    order = np.argsort(-scores, kind='stable')
+    if top_k is not None:
+        order = order[:top_k]
+    return boxes[rows[order]], scores[order], cols[order].astype(np.int32)
+
+
+def postprocess(boxes, objectness, probs, nms=.45, method='obj', score_thresh=0, top_k=None, sigma=.5,
+                best_class_only=False):
+    """
+    Run nms over the raw detections of one image and return (boxes, scores, class_ids), best first.
+    method is 'obj' (like do_nms_obj), 'sort' (like do_nms_sort), 'soft' or 'soft_linear' (per class
+    soft-nms) or 'soft_agnostic'. Boxes are dropped before nms when the score nms ranks them by is not
+    above score_thresh: objectness for 'obj', which lets boxes with no class left still suppress others
+    just like do_nms_obj does, and the best class probability for the per class methods.
+    """
+    if method == 'obj':
+        candidates = np.flatnonzero(objectness > score_thresh)
+    else:
+        candidates = np.flatnonzero((objectness != 0) & (probs > score_thresh).any(axis=1))
+    boxes = boxes[candidates]
+    objectness = objectness[candidates]
+    probs = np.where(probs[candidates] > score_thresh, probs[candidates], 0)
+    if nms:
+        if method == 'obj':
+            probs = nms_obj(boxes, objectness, probs, nms)
+        elif method == 'sort':
+            probs = nms_sort(boxes, objectness, probs, nms)
+        elif method in ('soft', 'soft_linear', 'soft_agnostic'):
+            probs = soft_nms_probs(boxes, objectness, probs, nms, sigma,
+                                   'linear' if method == 'soft_linear' else 'gaussian',
+                                   class_agnostic=method == 'soft_agnostic')
+        else:
+            raise ValueError("unknown nms method %s" % method)
+    return top_detections(boxes, probs, score_thresh, top_k, best_class_only)
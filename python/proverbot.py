@@ -1,5 +1,7 @@
 from darknet import *
 
+CHARS = 256
+
 def predict_tactic(net, s):
     prob = 0
     d = c_array(c_float, [0.0]*256)
@@ -32,6 +34,92 @@ def predict_tactics(net, s, n):
     tacs = sorted(tacs, key=lambda x: -x[1])
     return tacs
 
-net = load_net("cfg/coq.test.cfg", "/home/pjreddie/backup/coq.backup", 0)
-t = predict_tactics(net, "+++++\n", 10)
-print t
+def sample_rows(probs, rng=np.random):
+    # one index per row of probs drawn like sample(), the first index where the running sum reaches r
+    cum = np.cumsum(probs, axis=1)
+    r = rng.uniform(0, 1, (len(probs), 1)) * cum[:, -1:]
+    return np.minimum((cum < r).sum(axis=1), probs.shape[1] - 1)
+
+class CharRNN(object):
+    """
+    Runs a character rnn on a batch of sequences at once, one row of the network per sequence. The
+    network must have been loaded with load_net_batch(cfg, weights, 0, batch) from a cfg with
+    time_steps=1, step() feeds one character per row and returns the batch x 256 output as a numpy view
+    of the network's buffer, valid until the next step().
+    """
+    def __init__(self, net, batch):
+        self.net = net
+        self.batch = batch
+        self.input = np.zeros((batch, CHARS), dtype=np.float32)
+        self.data = self.input.ctypes.data_as(POINTER(c_float))
+        self.rows = np.arange(batch)
+
+    def reset(self):
+        for b in range(self.batch):
+            reset_network_state(self.net, b)
+
+    def step(self, chars):
+        self.input[self.rows, chars] = 1
+        out = network_predict(self.net, self.data)
+        self.input[self.rows, chars] = 0
+        return np.ctypeslib.as_array(out, shape=(self.batch, CHARS))
+
+    def feed(self, s):
+        # same prefix on every row, returns the output after its last character
+        out = None
+        for c in s:
+            out = self.step(ord(c))
+        return out
+
+    def reorder(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.int32)
+        reorder_network_state(self.net, rows.ctypes.data_as(POINTER(c_int)))
+
+def generate_tactics(rnn, s, stop='.', max_len=256, beam=False, rng=np.random):
+    """
+    rnn.batch tactics continuing s, as (tactic, log probability) sorted by probability. Every tactic
+    ends at the first stop character, or after max_len characters. Sampling draws each row
+    independently, beam=True keeps the rnn.batch most probable continuations instead.
+    """
+    rnn.reset()
+    out = rnn.feed(s or '\n')
+    n = rnn.batch
+    tacs = [''] * n
+    probs = np.zeros(n)
+    done = np.zeros(n, dtype=bool)
+    if beam:
+        # every row starts from the same state, expand only the first one on the first step
+        probs[1:] = -np.inf
+    for _ in range(max_len):
+        with np.errstate(divide='ignore'):
+            logp = np.log(out)
+        if beam:
+            scores = probs[:, np.newaxis] + logp
+            # a finished beam survives as itself, in column 0, with its score unchanged
+            scores[done] = -np.inf
+            scores[done, 0] = probs[done]
+            flat = scores.ravel()
+            best = np.argpartition(-flat, n - 1)[:n]
+            best = best[np.argsort(-flat[best], kind='stable')]
+            parents, chars = np.divmod(best, CHARS)
+            rnn.reorder(parents)
+            probs = flat[best]
+            tacs = [tacs[p] if done[p] else tacs[p] + chr(c) for p, c in zip(parents, chars)]
+            done = np.array([done[p] or (len(t) and t[-1] == stop) for p, t in zip(parents, tacs)], dtype=bool)
+        else:
+            chars = sample_rows(out, rng)
+            live = ~done
+            probs[live] += logp[live, chars[live]]
+            for b in np.flatnonzero(live):
+                tacs[b] += chr(chars[b])
+            done |= live & (chars == ord(stop))
+        if done.all():
+            break
+        out = rnn.step(chars)
+    order = np.argsort(-probs, kind='stable')
+    return [(tacs[i], float(probs[i])) for i in order if probs[i] > -np.inf]
+
+if __name__ == "__main__":
+    net = load_net_batch(b"cfg/coq.test.cfg", b"/home/pjreddie/backup/coq.backup", 0, 10)
+    t = generate_tactics(CharRNN(net, 10), "+++++\n")
+    print(t)
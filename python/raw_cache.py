@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+r"""Run the network once over a validation set, then sweep thresh/nms settings from the cached raw outputs.
+
+`cache` stores every box get_network_boxes returns at a low floor threshold, before nms, in one .npz file:
+boxes, objectness and the nonzero class probabilities as sparse (box, class, prob) triples. For yolo layers
+get_network_boxes at any thresh >= floor keeps exactly the boxes with objectness > thresh and the probs
+> thresh, so re-applying a higher thresh to the cache gives the same detections as rerunning the network.
+hier_thresh only matters for softmax-tree region layers (yolo9000) and is fixed when the cache is built.
+
+`sweep` re-applies every combination of --thresh and --nms from the cache, optionally writes a coco
+results file per setting and, given coco-style annotations, prints the mAP at IoU .5 of each setting.
+The results have the boxes and fields of `darknet detector valid`, with category_id the class index + 1 as
+print_cocos in examples/detector.c writes it, not mapped through coco_ids like upstream darknet does.
+
+Example usage:
+    ./python/raw_cache.py cache -c cfg/yolov3.cfg -w yolov3.weights -d cfg/coco.data -o val.npz
+    ./python/raw_cache.py sweep val.npz --thresh .005 .01 .05 --nms .4 .45 .5 -a val_annotations.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+
+import postprocess
+
+
+def read_data_cfg(datacfg):
+    options = {}
+    with open(datacfg) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            options[key.strip()] = value.strip()
+    return options
+
+
+def coco_image_id(path):
+    # same as get_coco_image_id in examples/detector.c
+    name = path.rsplit("/", 1)[-1]
+    if "_" in name:
+        name = name.rsplit("_", 1)[1]
+    digits = ""
+    for c in name:
+        if not c.isdigit():
+            break
+        digits += c
+    return int(digits or 0)
+
+
+def build_cache(cfg, weights, datacfg, images, out, floor=.005, hier_thresh=.5):
+    import darknet as dn
+    session = dn.DetectorSession(cfg.encode(), weights.encode(), datacfg.encode(), floor, hier_thresh, 0)
+    classes = session.meta.classes
+    sizes, counts, boxes, objectness, rows, cols, probs = [], [], [], [], [], [], []
+    total = 0
+    for i, path in enumerate(images):
+        im = dn.load_image(path.encode(), 0, 0)
+        num = session.fill_detections(im)
+        sizes.append((im.w, im.h))
+        dn.free_image(im)
+        if num:
+            b, o, p = dn.detections_to_raw(session.dets, num, classes)
+        else:
+            b, o, p = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros((0, classes), np.float32)
+        r, c = np.nonzero(p)
+        boxes.append(b)
+        objectness.append(o)
+        rows.append((r + total).astype(np.int32))
+        cols.append(c.astype(np.int16))
+        probs.append(p[r, c])
+        counts.append(len(o))
+        total += len(o)
+        if (i + 1) % 100 == 0:
+            print("%d images cached" % (i + 1))
+    session.close()
+    np.savez(out, paths=np.array(images), sizes=np.array(sizes, dtype=np.int32).reshape(-1, 2),
+             offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+             boxes=np.concatenate(boxes), objectness=np.concatenate(objectness),
+             prob_rows=np.concatenate(rows), prob_cols=np.concatenate(cols), probs=np.concatenate(probs),
+             classes=classes, floor=floor, hier_thresh=hier_thresh)
+
+
+class RawCache(object):
+    def __init__(self, filename):
+        data = np.load(filename)
+        self.paths = [str(p) for p in data["paths"]]
+        self.sizes = data["sizes"]
+        self.offsets = data["offsets"]
+        self.boxes = data["boxes"]
+        self.objectness = data["objectness"]
+        self.classes = int(data["classes"])
+        self.floor = float(data["floor"])
+        # per box start of its (class, prob) pairs, the pairs are stored in box order
+        rows = data["prob_rows"]
+        self.prob_offsets = np.searchsorted(rows, np.arange(len(self.objectness) + 1))
+        self.prob_cols = data["prob_cols"]
+        self.probs = data["probs"]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def image(self, i, thresh):
+        # boxes, objectness and dense probs of image i as get_network_boxes would return them at thresh
+        if thresh < self.floor:
+            raise ValueError("thresh %g is below the cache floor %g" % (thresh, self.floor))
+        start, end = self.offsets[i], self.offsets[i + 1]
+        alive = start + np.flatnonzero(self.objectness[start:end] > thresh)
+        probs = np.zeros((len(alive), self.classes), dtype=np.float32)
+        lo, hi = self.prob_offsets[alive], self.prob_offsets[alive + 1]
+        counts = hi - lo
+        pairs = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        values = self.probs[pairs]
+        probs[np.repeat(np.arange(len(alive)), counts), self.prob_cols[pairs]] = np.where(values > thresh, values, 0)
+        return self.boxes[alive], self.objectness[alive], probs
+
+    def detect(self, i, thresh, nms, method="sort"):
+        # detect_arrays style (boxes, scores, class_ids) of image i, do_nms_sort as `detector valid` uses
+        return postprocess.postprocess(*self.image(i, thresh), nms=nms, method=method)
+
+
+def coco_results(cache, detections):
+    # same boxes and fields as print_cocos in examples/detector.c, category_id is the class index + 1
+    results = []
+    for i, (boxes, scores, class_ids) in enumerate(detections):
+        w, h = cache.sizes[i]
+        xmin = np.maximum(boxes[:, 0] - boxes[:, 2]/2, 0)
+        ymin = np.maximum(boxes[:, 1] - boxes[:, 3]/2, 0)
+        xmax = np.minimum(boxes[:, 0] + boxes[:, 2]/2, w)
+        ymax = np.minimum(boxes[:, 1] + boxes[:, 3]/2, h)
+        image_id = coco_image_id(cache.paths[i])
+        for x0, y0, x1, y1, s, c in zip(xmin.tolist(), ymin.tolist(), xmax.tolist(), ymax.tolist(),
+                                        scores.tolist(), class_ids.tolist()):
+            results.append({"image_id": image_id, "category_id": c + 1, "bbox": [x0, y0, x1 - x0, y1 - y0],
+                            "score": s})
+    return results
+
+
+def load_ground_truth(annotations):
+    # {image_id: (boxes as x0/y0/x1/y1, category ids)} from a coco-style annotation file, crowds skipped
+    with open(annotations) as f:
+        coco = json.load(f)
+    gt = {}
+    for ann in coco["annotations"]:
+        if ann.get("iscrowd", 0):
+            continue
+        x, y, w, h = ann["bbox"]
+        gt.setdefault(ann["image_id"], []).append((x, y, x + w, y + h, ann["category_id"]))
+    return {k: (np.array(v, dtype=np.float32)[:, :4], np.array(v)[:, 4].astype(np.int32)) for k, v in gt.items()}
+
+
+def iou_xyxy(a, b):
+    w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(w, 0, None)*np.clip(h, 0, None)
+    area_a = (a[:, 2] - a[:, 0])*(a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0])*(b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-12)
+
+
+def mean_ap(results, gt, iou_thresh=.5):
+    # coco-style 101 point interpolated AP at one IoU threshold, averaged over the categories in gt
+    by_key = {}
+    for r in results:
+        by_key.setdefault((r["image_id"], r["category_id"]), []).append(r)
+    matches = {}
+    for (image_id, category), dets in by_key.items():
+        dets.sort(key=lambda r: -r["score"])
+        scores = np.array([r["score"] for r in dets], dtype=np.float32)
+        tp = np.zeros(len(dets), dtype=bool)
+        if image_id in gt:
+            gt_boxes, gt_classes = gt[image_id]
+            gt_boxes = gt_boxes[gt_classes == category]
+            if len(gt_boxes):
+                b = np.array([r["bbox"] for r in dets], dtype=np.float32)
+                b[:, 2:] += b[:, :2]
+                iou = iou_xyxy(b, gt_boxes)
+                taken = np.zeros(len(gt_boxes), dtype=bool)
+                for d in range(len(dets)):
+                    candidates = np.where(taken, -1, iou[d])
+                    g = candidates.argmax()
+                    if candidates[g] >= iou_thresh:
+                        taken[g] = True
+                        tp[d] = True
+        s, t = matches.setdefault(category, ([], []))
+        s.append(scores)
+        t.append(tp)
+    num_gt = {}
+    for gt_boxes, gt_classes in gt.values():
+        for c in gt_classes.tolist():
+            num_gt[c] = num_gt.get(c, 0) + 1
+    aps = []
+    recall_points = np.linspace(0, 1, 101)
+    for category, n in num_gt.items():
+        if category not in matches:
+            aps.append(0.)
+            continue
+        scores = np.concatenate(matches[category][0])
+        tp = np.concatenate(matches[category][1])[np.argsort(-scores, kind='mergesort')]
+        ctp = np.cumsum(tp)
+        recall = ctp / float(n)
+        precision = ctp / np.arange(1, len(tp) + 1)
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        idx = np.searchsorted(recall, recall_points, side="left")
+        aps.append(np.where(idx < len(precision), precision[np.minimum(idx, len(precision) - 1)], 0).mean())
+    return float(np.mean(aps)) if aps else 0.
+
+
+def sweep(cache, thresholds, nms_values, method="sort", annotations=None, results_dir=None):
+    gt = load_ground_truth(annotations) if annotations else None
+    print("%8s %8s %10s %8s" % ("thresh", "nms", "detections", "mAP@.5" if gt is not None else ""))
+    for thresh, nms in itertools.product(sorted(thresholds), sorted(nms_values)):
+        detections = [cache.detect(i, thresh, nms, method) for i in range(len(cache))]
+        results = coco_results(cache, detections)
+        if results_dir:
+            with open(os.path.join(results_dir, "coco_results_t%g_n%g.json" % (thresh, nms)), "w") as f:
+                json.dump(results, f)
+        print("%8g %8g %10d %8s" % (thresh, nms, len(results), "%.4f" % mean_ap(results, gt) if gt is not None else ""))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="cache raw detections once, sweep thresh/nms from the cache",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    cache = sub.add_parser("cache", help="run the network over the images and store the raw detections")
+    cache.add_argument("--cfg", "-c", required=True, help="network cfg file")
+    cache.add_argument("--weights", "-w", required=True, help="network weights file")
+    cache.add_argument("--data", "-d", required=True, help="data file with the class names and the valid list")
+    cache.add_argument("--images", "-i", default=None, help="image list to cache instead of the data file's valid")
+    cache.add_argument("--out", "-o", required=True, help="cache file to write (.npz)")
+    cache.add_argument("--floor", type=float, default=.005, help="lowest thresh the cache can be swept at")
+    cache.add_argument("--hier_thresh", type=float, default=.5)
+
+    sw = sub.add_parser("sweep", help="re-apply a grid of thresh/nms settings from a cache")
+    sw.add_argument("cache", help="cache file written by the cache command")
+    sw.add_argument("--thresh", type=float, nargs="+", default=[.005])
+    sw.add_argument("--nms", type=float, nargs="+", default=[.45])
+    sw.add_argument("--method", default="sort", help="postprocess nms method, `detector valid` uses sort")
+    sw.add_argument("--annotations", "-a", default=None, help="coco-style annotations to compute mAP against")
+    sw.add_argument("--results_dir", "-r", default=None, help="write coco results json for every setting here")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "cache":
+        images = args.images or read_data_cfg(args.data).get("valid", "data/train.list")
+        with open(images) as f:
+            paths = [line.strip() for line in f if line.strip()]
+        build_cache(args.cfg, args.weights, args.data, paths, args.out, args.floor, args.hier_thresh)
+    else:
+        sweep(RawCache(args.cache), args.thresh, args.nms, args.method, args.annotations, args.results_dir)
@@ -1,6 +1,7 @@
 import xml.etree.ElementTree as ET
 import pickle
 import os
+import sys
 from os import listdir, getcwd
 from os.path import join
 
@@ -22,9 +23,22 @@ def convert(size, box):
     h = h*dh
     return (x,y,w,h)
 
+def convert_indexed_annotation(index, i, out_file):
+    w = int(index.widths[i])
+    h = int(index.heights[i])
+    boxes, class_ids = index.objects(i, class_map)
+    for (x1, y1, x2, y2), cls_id in zip(boxes.tolist(), class_ids.tolist()):
+        bb = convert((w,h), (x1, x2, y1, y2))
+        out_file.write(str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n')
+
 def convert_annotation(year, image_id):
-    in_file = open('VOCdevkit/VOC%s/Annotations/%s.xml'%(year, image_id))
+    xml_path = 'VOCdevkit/VOC%s/Annotations/%s.xml'%(year, image_id)
     out_file = open('VOCdevkit/VOC%s/labels/%s.txt'%(year, image_id), 'w')
+    i = index.find(xml_path) if index is not None else None
+    if i is not None:
+        convert_indexed_annotation(index, i, out_file)
+        return
+    in_file = open(xml_path)
     tree=ET.parse(in_file)
     root = tree.getroot()
     size = root.find('size')
@@ -42,6 +56,15 @@ def convert_annotation(year, image_id):
         bb = convert((w,h), b)
         out_file.write(str(cls_id) + " " + " ".join([str(a) for a in bb]) + '\n')
 
+# an annotation index built by my_tool_scripts/annotation_index.py over VOCdevkit can be given as the only argument,
+# the labels are then written from it instead of parsing every xml file again
+index = None
+if len(sys.argv) > 1:
+    sys.path.insert(0, join(os.path.dirname(os.path.abspath(__file__)), '..', 'my_tool_scripts'))
+    from annotation_index import AnnotationIndex
+    index = AnnotationIndex.load(sys.argv[1])
+    class_map = index.class_map(classes)
+
 wd = getcwd()
 
 for year, image_set in sets:
@@ -44,8 +44,10 @@ layer make_connected_layer(int batch, int inputs, int outputs, ACTIVATION activa
 
     //float scale = 1./sqrt(inputs);
     float scale = sqrt(2./inputs);
-    for(i = 0; i < outputs*inputs; ++i){
-        l.weights[i] = scale*rand_uniform(-1, 1);
+    if(init_weights){
+        for(i = 0; i < outputs*inputs; ++i){
+            l.weights[i] = scale*rand_uniform(-1, 1);
+        }
     }
 
     for(i = 0; i < outputs; ++i){
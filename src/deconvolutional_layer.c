@@ -57,7 +57,7 @@ layer make_deconvolutional_layer(int batch, int h, int w, int c, int n, int size
     //float scale = n/(size*size*c);
     //printf("scale: %f\n", scale);
     float scale = .02;
-    for(i = 0; i < c*n*size*size; ++i) l.weights[i] = scale*rand_normal();
+    if(init_weights) for(i = 0; i < c*n*size*size; ++i) l.weights[i] = scale*rand_normal();
     //bilinear_init(l);
     for(i = 0; i < n; ++i){
         l.biases[i] = 0;
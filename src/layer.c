@@ -3,6 +3,8 @@
 
 #include <stdlib.h>
 
+int init_weights = 1;
+
 void free_layer(layer l)
 {
     if(l.type == DROPOUT){
@@ -1 +1,4 @@
 #include "darknet.h"
+
+// when 0, layers are built without random weights, for callers that overwrite every weight anyway
+extern int init_weights;
@@ -60,18 +60,163 @@ network *load_network(char *cfg, char *weights, int clear)
     return net;
 }
 
+network *load_network_batch(char *cfg, char *weights, int clear, int batch)
+{
+    network *net = parse_network_cfg_batch(cfg, batch);
+    if(weights && weights[0] != 0){
+        load_weights(net, weights);
+    }
+    if(clear) (*net->seen) = 0;
+    return net;
+}
+
+static void reset_layer_batchnorm(network *net, layer l)
+{
+    if(!l.rolling_variance) return;
+    int n = 0;
+    if(l.type == CONVOLUTIONAL || l.type == DECONVOLUTIONAL) n = l.n;
+    else if(l.type == CONNECTED) n = l.outputs;
+    else if(l.type == BATCHNORM) n = l.c;
+    fill_cpu(n, 0, l.rolling_mean, 1);
+    fill_cpu(n, 1, l.rolling_variance, 1);
+#ifdef GPU
+    if(net->gpu_index >= 0){
+        cuda_push_array(l.rolling_mean_gpu, l.rolling_mean, n);
+        cuda_push_array(l.rolling_variance_gpu, l.rolling_variance, n);
+    }
+#endif
+}
+
+void reset_batchnorm_statistics(network *net)
+{
+    int i;
+    for(i = 0; i < net->n; ++i){
+        layer l = net->layers[i];
+        reset_layer_batchnorm(net, l);
+        // recurrent layers keep their batchnorm statistics in their sublayers
+        if(l.type == CRNN || l.type == RNN){
+            reset_layer_batchnorm(net, *l.input_layer);
+            reset_layer_batchnorm(net, *l.self_layer);
+            reset_layer_batchnorm(net, *l.output_layer);
+        }
+        if(l.type == LSTM){
+            reset_layer_batchnorm(net, *l.wi);
+            reset_layer_batchnorm(net, *l.wf);
+            reset_layer_batchnorm(net, *l.wo);
+            reset_layer_batchnorm(net, *l.wg);
+            reset_layer_batchnorm(net, *l.ui);
+            reset_layer_batchnorm(net, *l.uf);
+            reset_layer_batchnorm(net, *l.uo);
+            reset_layer_batchnorm(net, *l.ug);
+        }
+        if(l.type == GRU){
+            reset_layer_batchnorm(net, *l.wz);
+            reset_layer_batchnorm(net, *l.wr);
+            reset_layer_batchnorm(net, *l.wh);
+            reset_layer_batchnorm(net, *l.uz);
+            reset_layer_batchnorm(net, *l.ur);
+            reset_layer_batchnorm(net, *l.uh);
+        }
+    }
+}
+
+static void share_layer_weights(layer *l, layer base)
+{
+    free(l->weights);
+    free(l->biases);
+    free(l->scales);
+    free(l->rolling_mean);
+    free(l->rolling_variance);
+    l->weights = base.weights;
+    l->biases = base.biases;
+    l->scales = base.scales;
+    l->rolling_mean = base.rolling_mean;
+    l->rolling_variance = base.rolling_variance;
+}
+
+static int has_shared_weights(layer l)
+{
+    return l.type == CONVOLUTIONAL || l.type == DECONVOLUTIONAL || l.type == CONNECTED || l.type == BATCHNORM || l.type == LOCAL;
+}
+
+// A network built from cfg whose weights, biases and batchnorm parameters point at the ones of base,
+// only activations and workspace are private. base must outlive it, free it with free_network_shared
+network *load_network_shared(char *cfg, network *base, int batch)
+{
+    // the weights are replaced by the ones of base, skip the random initialization
+    init_weights = 0;
+    network *net = parse_network_cfg_batch(cfg, batch);
+    init_weights = 1;
+#ifdef GPU
+    if(net->gpu_index >= 0) error("Shared networks are only supported on the CPU");
+#endif
+    if(net->n != base->n) error("Shared network must be built from the same cfg as its base");
+    int i;
+    for(i = 0; i < net->n; ++i){
+        layer *l = net->layers + i;
+        layer b = base->layers[i];
+        if(l->type != b.type) error("Shared network must be built from the same cfg as its base");
+        if(has_shared_weights(*l)){
+            share_layer_weights(l, b);
+        }
+        if(l->type == CRNN || l->type == RNN){
+            share_layer_weights(l->input_layer, *b.input_layer);
+            share_layer_weights(l->self_layer, *b.self_layer);
+            share_layer_weights(l->output_layer, *b.output_layer);
+        }
+        if(l->type == LSTM){
+            share_layer_weights(l->wi, *b.wi);
+            share_layer_weights(l->wf, *b.wf);
+            share_layer_weights(l->wo, *b.wo);
+            share_layer_weights(l->wg, *b.wg);
+            share_layer_weights(l->ui, *b.ui);
+            share_layer_weights(l->uf, *b.uf);
+            share_layer_weights(l->uo, *b.uo);
+            share_layer_weights(l->ug, *b.ug);
+        }
+        if(l->type == GRU){
+            share_layer_weights(l->wz, *b.wz);
+            share_layer_weights(l->wr, *b.wr);
+            share_layer_weights(l->wh, *b.wh);
+            share_layer_weights(l->uz, *b.uz);
+            share_layer_weights(l->ur, *b.ur);
+            share_layer_weights(l->uh, *b.uh);
+        }
+    }
+    *net->seen = *base->seen;
+    return net;
+}
+
 size_t get_current_batch(network *net)
 {
     size_t batch_num = (*net->seen)/(net->batch*net->subdivisions);
     return batch_num;
 }
 
+static int recurrent_state_size(layer l)
+{
+    if(l.type == RNN || l.type == GRU || l.type == LSTM) return l.outputs;
+    if(l.type == CRNN) return l.hidden;
+    return 0;
+}
+
+/* zeroes the recurrent state of row b on the cpu as well as the gpu; before, only the gpu copies were
+ * cleared, so reset_rnn and reset_network_state did nothing on a cpu build */
 void reset_network_state(network *net, int b)
 {
     int i;
     for (i = 0; i < net->n; ++i) {
-        #ifdef GPU
         layer l = net->layers[i];
+        int size = recurrent_state_size(l);
+        if(size){
+            if(l.type == LSTM){
+                fill_cpu(size, 0, l.h_cpu + size*b, 1);
+                fill_cpu(size, 0, l.c_cpu + size*b, 1);
+            } else {
+                fill_cpu(size, 0, l.state + size*b, 1);
+            }
+        }
+        #ifdef GPU
         if(l.state_gpu){
             fill_gpu(l.outputs, 0, l.state_gpu + l.outputs*b, 1);
         }
@@ -82,6 +227,52 @@ void reset_network_state(network *net, int b)
     }
 }
 
+static void gather_rows(float *x, int size, int *rows, int n)
+{
+    float *copy = calloc(size*n, sizeof(float));
+    int b;
+    for(b = 0; b < n; ++b){
+        memcpy(copy + b*size, x + rows[b]*size, size*sizeof(float));
+    }
+    memcpy(x, copy, size*n*sizeof(float));
+    free(copy);
+}
+
+#ifdef GPU
+static void gather_rows_gpu(float *x_gpu, int size, int *rows, int n)
+{
+    float *x = calloc(size*n, sizeof(float));
+    cuda_pull_array(x_gpu, x, size*n);
+    gather_rows(x, size, rows, n);
+    cuda_push_array(x_gpu, x, size*n);
+    free(x);
+}
+#endif
+
+void reorder_network_state(network *net, int *rows)
+{
+    // row b of every recurrent state becomes row rows[b], e.g. to follow the surviving hypotheses of a beam search
+    int i;
+    for (i = 0; i < net->n; ++i) {
+        layer l = net->layers[i];
+        int size = recurrent_state_size(l);
+        if(!size) continue;
+        if(l.type == LSTM){
+            gather_rows(l.h_cpu, size, rows, l.batch);
+            gather_rows(l.c_cpu, size, rows, l.batch);
+        } else {
+            gather_rows(l.state, size, rows, l.batch);
+        }
+        #ifdef GPU
+        if(gpu_index >= 0){
+            if(l.state_gpu) gather_rows_gpu(l.state_gpu, size, rows, l.batch);
+            if(l.h_gpu) gather_rows_gpu(l.h_gpu, size, rows, l.batch);
+            if(l.c_gpu) gather_rows_gpu(l.c_gpu, size, rows, l.batch);
+        }
+        #endif
+    }
+}
+
 void reset_rnn(network *net)
 {
     reset_network_state(net, 0);
@@ -168,6 +359,12 @@ char *get_layer_string(LAYER_TYPE a)
             return "normalization";
         case BATCHNORM:
             return "batchnorm";
+        case UPSAMPLE:
+            return "upsample";
+        case L2NORM:
+            return "l2norm";
+        case LOGXENT:
+            return "logxent";
         default:
             break;
     }
@@ -201,12 +398,15 @@ void forward_network(network *netp)
         if(l.delta){
             fill_cpu(l.outputs * l.batch, 0, l.delta, 1);
         }
+        double start = netp->profile ? what_time_is_it_now() : 0;
         l.forward(l, net);
+        if(netp->profile) netp->profile[i] += what_time_is_it_now() - start;
         net.input = l.output;
         if(l.truth) {
             net.truth = l.output;
         }
     }
+    if(netp->profile) ++*netp->profile_runs;
     calc_network_cost(netp);
 }
 
@@ -566,6 +766,62 @@ detection *get_network_boxes(network *net, int w, int h, float thresh, float hie
     return dets;
 }
 
+static layer batch_layer(layer l, int b)
+{
+    l.output += b*l.outputs;
+    l.batch = 1;
+    return l;
+}
+
+static int num_detections_batch(network *net, int b, float thresh)
+{
+    int i;
+    int s = 0;
+    for(i = 0; i < net->n; ++i){
+        layer l = net->layers[i];
+        if(l.type == YOLO){
+            s += yolo_num_detections(batch_layer(l, b), thresh);
+        }
+        if(l.type == DETECTION || l.type == REGION){
+            s += l.w*l.h*l.n;
+        }
+    }
+    return s;
+}
+
+// Same as get_network_boxes, but reads the b-th image of the last batched forward pass
+detection *get_network_boxes_batch(network *net, int b, int w, int h, float thresh, float hier, int *map, int relative, int *num)
+{
+    layer last = net->layers[net->n - 1];
+    int i, j;
+    int nboxes = num_detections_batch(net, b, thresh);
+    if(num) *num = nboxes;
+    detection *dets = calloc(nboxes, sizeof(detection));
+    for(i = 0; i < nboxes; ++i){
+        dets[i].prob = calloc(last.classes, sizeof(float));
+        if(last.coords > 4){
+            dets[i].mask = calloc(last.coords-4, sizeof(float));
+        }
+    }
+    detection *d = dets;
+    for(j = 0; j < net->n; ++j){
+        layer l = net->layers[j];
+        if(l.type == YOLO){
+            int count = get_yolo_detections(batch_layer(l, b), w, h, net->w, net->h, thresh, map, relative, d);
+            d += count;
+        }
+        if(l.type == REGION){
+            get_region_detections(batch_layer(l, b), w, h, net->w, net->h, thresh, map, hier, relative, d);
+            d += l.w*l.h*l.n;
+        }
+        if(l.type == DETECTION){
+            get_detection_detections(batch_layer(l, b), w, h, thresh, d);
+            d += l.w*l.h*l.n;
+        }
+    }
+    return dets;
+}
+
 void free_detections(detection *dets, int n)
 {
     int i;
@@ -585,8 +841,21 @@ float *network_predict_image(network *net, image im)
     return p;
 }
 
+int network_hierarchy_predictions(network *net, float *predictions, int n, int only_leaves)
+{
+    // applies the softmax tree of a hierarchical classifier to n rows of its output, in place,
+    // returns 0 and leaves predictions untouched when the network has no tree
+    if(!net->hierarchy) return 0;
+    int b;
+    for(b = 0; b < n; ++b){
+        hierarchy_predictions(predictions + b*net->outputs, net->outputs, net->hierarchy, only_leaves, 1);
+    }
+    return 1;
+}
+
 int network_width(network *net){return net->w;}
 int network_height(network *net){return net->h;}
+int network_max_batch(network *net){return net->max_batch;}
 
 matrix network_predict_data_multi(network *net, data test, int n)
 {
@@ -713,9 +982,81 @@ float network_accuracy_multi(network *net, data d, int n)
     return acc;
 }
 
+void set_network_profiling(network *net, int on)
+{
+    if(on && !net->profile){
+        net->profile = calloc(net->n, sizeof(double));
+        net->profile_runs = calloc(1, sizeof(int));
+    } else if(!on && net->profile){
+        free(net->profile);
+        free(net->profile_runs);
+        net->profile = 0;
+        net->profile_runs = 0;
+    }
+}
+
+void reset_network_profile(network *net)
+{
+    if(!net->profile) return;
+    memset(net->profile, 0, net->n*sizeof(double));
+    *net->profile_runs = 0;
+}
+
+static double layer_flops(layer l)
+{
+    switch(l.type){
+        case CONVOLUTIONAL:
+            return 2.0 * l.n * l.size*l.size*l.c/l.groups * l.out_h*l.out_w * l.batch;
+        case DECONVOLUTIONAL:
+            return 2.0 * l.n * l.size*l.size*l.c * l.h*l.w * l.batch;
+        case LOCAL:
+            return 2.0 * l.n * l.size*l.size*l.c * l.out_h*l.out_w * l.batch;
+        case CONNECTED:
+            return 2.0 * l.inputs*l.outputs * l.batch;
+        case RNN:
+        case CRNN:
+            return l.steps * (layer_flops(*l.input_layer) + layer_flops(*l.self_layer) + layer_flops(*l.output_layer));
+        case GRU:
+            return l.steps * (layer_flops(*l.wz) + layer_flops(*l.uz) + layer_flops(*l.wr) + layer_flops(*l.ur) +
+                    layer_flops(*l.wh) + layer_flops(*l.uh));
+        case LSTM:
+            return l.steps * (layer_flops(*l.wf) + layer_flops(*l.uf) + layer_flops(*l.wi) + layer_flops(*l.ui) +
+                    layer_flops(*l.wg) + layer_flops(*l.ug) + layer_flops(*l.wo) + layer_flops(*l.uo));
+        default:
+            return (double)l.outputs * l.batch;
+    }
+}
+
+int get_network_profile(network *net, layer_profile *profile, int n)
+{
+    int i;
+    for(i = 0; i < n && i < net->n; ++i){
+        layer l = net->layers[i];
+        layer_profile p = {0};
+        p.type = l.type;
+        p.w = l.w;
+        p.h = l.h;
+        p.c = l.c;
+        p.out_w = l.out_w;
+        p.out_h = l.out_h;
+        p.out_c = l.out_c;
+        if(net->profile){
+            p.runs = *net->profile_runs;
+            if(p.runs) p.ms = 1000. * net->profile[i] / p.runs;
+        }
+        p.flops = layer_flops(l);
+        p.output_bytes = (size_t)l.outputs * l.batch * sizeof(float);
+        p.workspace_bytes = l.workspace_size;
+        profile[i] = p;
+    }
+    return net->n;
+}
+
 void free_network(network *net)
 {
     int i;
+    if(net->snapshot) release_network_snapshot(net);
+    if(net->profile) set_network_profiling(net, 0);
     for(i = 0; i < net->n; ++i){
         free_layer(net->layers[i]);
     }
@@ -729,6 +1070,22 @@ void free_network(network *net)
     free(net);
 }
 
+void free_network_shared(network *net)
+{
+    int i;
+    for(i = 0; i < net->n; ++i){
+        layer *l = net->layers + i;
+        if(has_shared_weights(*l)){
+            l->weights = 0;
+            l->biases = 0;
+            l->scales = 0;
+            l->rolling_mean = 0;
+            l->rolling_variance = 0;
+        }
+    }
+    free_network(net);
+}
+
 // Some day...
 // ^ What the hell is this comment for?
 
@@ -775,7 +1132,12 @@ void forward_network_gpu(network *netp)
         if(l.delta_gpu){
             fill_gpu(l.outputs * l.batch, 0, l.delta_gpu, 1);
         }
+        double start = netp->profile ? what_time_is_it_now() : 0;
         l.forward_gpu(l, net);
+        if(netp->profile){
+            cudaDeviceSynchronize();
+            netp->profile[i] += what_time_is_it_now() - start;
+        }
         net.input_gpu = l.output_gpu;
         net.input = l.output;
         if(l.truth) {
@@ -783,6 +1145,7 @@ void forward_network_gpu(network *netp)
             net.truth = l.output;
         }
     }
+    if(netp->profile) ++*netp->profile_runs;
     pull_network_output(netp);
     calc_network_cost(netp);
 }
@@ -2,6 +2,10 @@
 #include <string.h>
 #include <stdlib.h>
 #include <assert.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "activation_layer.h"
 #include "logistic_layer.h"
@@ -42,6 +46,8 @@ typedef struct{
 }section;
 
 list *read_cfg(char *filename);
+list *read_cfg_file(FILE *file);
+static network *parse_network_sections(list *sections, int batch);
 
 LAYER_TYPE string_to_layer_type(char * type)
 {
@@ -729,7 +735,16 @@ int is_network(section *s)
 
 network *parse_network_cfg(char *filename)
 {
-    list *sections = read_cfg(filename);
+    return parse_network_cfg_batch(filename, 0);
+}
+
+network *parse_network_cfg_batch(char *filename, int batch)
+{
+    return parse_network_sections(read_cfg(filename), batch);
+}
+
+static network *parse_network_sections(list *sections, int batch)
+{
     node *n = sections->front;
     if(!n) error("Config file has no sections");
     network *net = make_network(sections->size - 1);
@@ -740,6 +755,10 @@ network *parse_network_cfg(char *filename)
     list *options = s->options;
     if(!is_network(s)) error("First section must be [net] or [network]");
     parse_net_options(options, net);
+    // like the cfg batch, the override counts sequences and recurrent layers get time_steps rows for each
+    if(batch > 0) net->batch = batch*net->time_steps;
+    // every buffer is allocated for this batch, set_batch_network must not go above it
+    net->max_batch = net->batch;
 
     params.h = net->h;
     params.w = net->w;
@@ -877,6 +896,13 @@ list *read_cfg(char *filename)
 {
     FILE *file = fopen(filename, "r");
     if(file == 0) file_error(filename);
+    list *options = read_cfg_file(file);
+    fclose(file);
+    return options;
+}
+
+list *read_cfg_file(FILE *file)
+{
     char *line;
     int nu = 0;
     list *options = make_list();
@@ -904,7 +930,6 @@ list *read_cfg(char *filename)
                 break;
         }
     }
-    fclose(file);
     return options;
 }
 
@@ -1289,6 +1314,203 @@ void load_weights_upto(network *net, char *filename, int start, int cutoff)
     fclose(fp);
 }
 
+/*
+ * A network snapshot is one file holding the cfg text and every layer parameter, each array aligned
+ * so the file can be memory-mapped and used in place:
+ *     snapshot_header | cfg text | biases, scales, rolling mean/variance, weights of each layer
+ * The arrays come in the same layer order as in a .weights file.
+ */
+#define SNAPSHOT_MAGIC 0x50414e53
+#define SNAPSHOT_VERSION 1
+#define SNAPSHOT_ALIGN 64
+
+#define SNAPSHOT_SIZE 0
+#define SNAPSHOT_SAVE 1
+#define SNAPSHOT_MAP 2
+#define SNAPSHOT_RELEASE 3
+
+typedef struct{
+    int magic;
+    int version;
+    size_t seen;
+    size_t cfg_size;
+    size_t size;
+} snapshot_header;
+
+static size_t align_snapshot(size_t offset)
+{
+    return (offset + SNAPSHOT_ALIGN - 1) / SNAPSHOT_ALIGN * SNAPSHOT_ALIGN;
+}
+
+static int snapshot_layers(layer *l, layer **sub)
+{
+    if(l->type == CONVOLUTIONAL || l->type == DECONVOLUTIONAL || l->type == CONNECTED
+            || l->type == BATCHNORM || l->type == LOCAL){
+        sub[0] = l;
+        return 1;
+    }
+    if(l->type == CRNN || l->type == RNN){
+        sub[0] = l->input_layer;
+        sub[1] = l->self_layer;
+        sub[2] = l->output_layer;
+        return 3;
+    }
+    if(l->type == LSTM){
+        sub[0] = l->wi; sub[1] = l->wf; sub[2] = l->wo; sub[3] = l->wg;
+        sub[4] = l->ui; sub[5] = l->uf; sub[6] = l->uo; sub[7] = l->ug;
+        return 8;
+    }
+    if(l->type == GRU){
+        sub[0] = l->wz; sub[1] = l->wr; sub[2] = l->wh;
+        sub[3] = l->uz; sub[4] = l->ur; sub[5] = l->uh;
+        return 6;
+    }
+    return 0;
+}
+
+static int snapshot_params(layer *l, float ***ptrs, size_t *sizes)
+{
+    size_t nb = 0, ns = 0, nw = 0;
+    int n = 0;
+    if(l->type == CONVOLUTIONAL || l->type == DECONVOLUTIONAL){
+        nb = l->n;
+        ns = l->batch_normalize ? l->n : 0;
+        nw = l->nweights;
+    }else if(l->type == CONNECTED){
+        nb = l->outputs;
+        ns = l->batch_normalize ? l->outputs : 0;
+        nw = (size_t)l->outputs*l->inputs;
+    }else if(l->type == BATCHNORM){
+        ns = l->c;
+    }else if(l->type == LOCAL){
+        nb = l->outputs;
+        nw = (size_t)l->size*l->size*l->c*l->n*l->out_w*l->out_h;
+    }
+    if(nb){
+        ptrs[n] = &l->biases; sizes[n++] = nb;
+    }
+    if(ns){
+        ptrs[n] = &l->scales; sizes[n++] = ns;
+        ptrs[n] = &l->rolling_mean; sizes[n++] = ns;
+        ptrs[n] = &l->rolling_variance; sizes[n++] = ns;
+    }
+    if(nw){
+        ptrs[n] = &l->weights; sizes[n++] = nw;
+    }
+    return n;
+}
+
+// Visits every parameter array in file order, returns the offset just past the last one
+static size_t walk_snapshot(network *net, size_t offset, int mode, FILE *fp, char *map)
+{
+    char zeros[SNAPSHOT_ALIGN] = {0};
+    int i, j, k;
+    for(i = 0; i < net->n; ++i){
+        layer *sub[8];
+        int nsub = snapshot_layers(net->layers + i, sub);
+        for(j = 0; j < nsub; ++j){
+            float **ptrs[5];
+            size_t sizes[5];
+            int nparams = snapshot_params(sub[j], ptrs, sizes);
+            for(k = 0; k < nparams; ++k){
+                size_t aligned = align_snapshot(offset);
+                if(mode == SNAPSHOT_SAVE){
+                    fwrite(zeros, 1, aligned - offset, fp);
+                    fwrite(*ptrs[k], sizeof(float), sizes[k], fp);
+                }else if(mode == SNAPSHOT_MAP){
+                    free(*ptrs[k]);
+                    *ptrs[k] = (float *)(map + aligned);
+                }else if(mode == SNAPSHOT_RELEASE){
+                    *ptrs[k] = 0;
+                }
+                offset = aligned + sizes[k]*sizeof(float);
+            }
+        }
+    }
+    return offset;
+}
+
+void save_network_snapshot(network *net, char *cfgfile, char *filename)
+{
+#ifdef GPU
+    if(net->gpu_index >= 0){
+        cuda_set_device(net->gpu_index);
+        int i;
+        for(i = 0; i < net->n; ++i){
+            layer l = net->layers[i];
+            if(l.type == CONVOLUTIONAL || l.type == DECONVOLUTIONAL) pull_convolutional_layer(l);
+            if(l.type == CONNECTED) pull_connected_layer(l);
+            if(l.type == BATCHNORM) pull_batchnorm_layer(l);
+        }
+    }
+#endif
+    FILE *cfg = fopen(cfgfile, "rb");
+    if(!cfg) file_error(cfgfile);
+    fseek(cfg, 0, SEEK_END);
+    size_t cfg_size = ftell(cfg);
+    fseek(cfg, 0, SEEK_SET);
+    char *text = calloc(cfg_size, sizeof(char));
+    fread(text, 1, cfg_size, cfg);
+    fclose(cfg);
+
+    fprintf(stderr, "Saving snapshot to %s\n", filename);
+    FILE *fp = fopen(filename, "wb");
+    if(!fp) file_error(filename);
+    snapshot_header h = {0};
+    h.magic = SNAPSHOT_MAGIC;
+    h.version = SNAPSHOT_VERSION;
+    h.seen = *net->seen;
+    h.cfg_size = cfg_size;
+    h.size = walk_snapshot(net, sizeof(snapshot_header) + cfg_size, SNAPSHOT_SIZE, 0, 0);
+    fwrite(&h, sizeof(snapshot_header), 1, fp);
+    fwrite(text, 1, cfg_size, fp);
+    walk_snapshot(net, sizeof(snapshot_header) + cfg_size, SNAPSHOT_SAVE, fp, 0);
+    fclose(fp);
+    free(text);
+}
+
+// The parameters are used straight from a private mapping of the file, so pages are only read when
+// first touched and stay shared through the page cache between processes loading the same snapshot
+network *load_network_snapshot(char *filename, int batch)
+{
+    int fd = open(filename, O_RDONLY);
+    if(fd < 0) file_error(filename);
+    struct stat st;
+    if(fstat(fd, &st) || st.st_size < sizeof(snapshot_header)) file_error(filename);
+    char *map = mmap(0, st.st_size, PROT_READ | PROT_WRITE, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if(map == MAP_FAILED) file_error(filename);
+    snapshot_header *h = (snapshot_header *)map;
+    if(h->magic != SNAPSHOT_MAGIC || h->version != SNAPSHOT_VERSION || h->size != st.st_size){
+        error("Not a valid network snapshot");
+    }
+
+    FILE *cfg = fmemopen(map + sizeof(snapshot_header), h->cfg_size, "r");
+    // every weight comes from the snapshot, skip the random initialization
+    init_weights = 0;
+    network *net = parse_network_sections(read_cfg_file(cfg), batch);
+    init_weights = 1;
+    fclose(cfg);
+#ifdef GPU
+    if(net->gpu_index >= 0) error("Network snapshots are only supported on the CPU");
+#endif
+    size_t start = sizeof(snapshot_header) + h->cfg_size;
+    if(walk_snapshot(net, start, SNAPSHOT_SIZE, 0, 0) != h->size) error("Network snapshot does not match its cfg");
+    walk_snapshot(net, start, SNAPSHOT_MAP, 0, map);
+    *net->seen = h->seen;
+    net->snapshot = map;
+    net->snapshot_size = st.st_size;
+    return net;
+}
+
+void release_network_snapshot(network *net)
+{
+    walk_snapshot(net, 0, SNAPSHOT_RELEASE, 0, 0);
+    munmap(net->snapshot, net->snapshot_size);
+    net->snapshot = 0;
+    net->snapshot_size = 0;
+}
+
 void load_weights(network *net, char *filename)
 {
     load_weights_upto(net, filename, 0, net->n);
@@ -5,5 +5,6 @@
 
 void save_network(network net, char *filename);
 void save_weights_double(network net, char *filename);
+void release_network_snapshot(network *net);
 
 #endif
@@ -0,0 +1,95 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ("python", "my_tool_scripts", os.path.join("my_tool_scripts", "tools_for_yolo")):
+    sys.path.insert(0, os.path.join(ROOT, path))
+
+
+@pytest.fixture(scope="session")
+def dn():
+    # the python bindings, tests using them are skipped when libdarknet has not been built
+    import darknet
+    try:
+        darknet.load_library()
+    except OSError as e:
+        pytest.skip("libdarknet not available: %s" % e)
+    return darknet
+
+
+@pytest.fixture
+def write_cfg(tmp_path):
+    def write(text, name="net.cfg"):
+        path = tmp_path / name
+        path.write_text(text)
+        return str(path).encode()
+    return write
+
+
+TINY_YOLO_CFG = """
+[net]
+batch=1
+width=64
+height=64
+channels=3
+
+[convolutional]
+filters=8
+size=3
+stride=2
+pad=1
+activation=leaky
+
+[convolutional]
+filters=21
+size=1
+stride=1
+activation=linear
+
+[yolo]
+mask=0,1,2
+anchors=10,14, 23,27, 37,58
+classes=2
+num=3
+"""
+
+
+@pytest.fixture
+def tiny_detector(dn, tmp_path, write_cfg):
+    # (cfg, datacfg) of a two class yolo network small enough to run with random weights in a test
+    names = tmp_path / "tiny.names"
+    names.write_text("cat\ndog\n")
+    data = tmp_path / "tiny.data"
+    data.write_text("classes=2\nnames=%s\n" % names)
+    return write_cfg(TINY_YOLO_CFG, "tiny.cfg"), str(data).encode()
+
+
+VOC_OBJECTS = [
+    [("cat", 0, 10, 20, 110, 220), ("Dog", 0, 30, 40, 80, 90)],
+    [],
+    [("dog", 1, 5, 5, 50, 50), ("zebra", 0, 1, 2, 3, 4), ("cat", 0, 200, 100, 400, 300)],
+]
+
+
+def write_voc_xml(path, width, height, objects):
+    xml = "".join("<object><name>%s</name><difficult>%d</difficult><bndbox><xmin>%g</xmin><ymin>%g</ymin>"
+                  "<xmax>%g</xmax><ymax>%g</ymax></bndbox></object>" % obj for obj in objects)
+    path.write_text("<annotation><size><width>%d</width><height>%d</height></size>%s</annotation>"
+                    % (width, height, xml))
+
+
+@pytest.fixture
+def voc_dataset(tmp_path):
+    # image paths of a small VOC style dataset, each image next to its xml file, with mixed case names,
+    # a difficult object and a class outside the categories ["cat", "dog"]
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    paths = []
+    for i, objects in enumerate(VOC_OBJECTS):
+        image = image_dir / ("img_%d.jpg" % (i + 1))
+        image.write_bytes(b"not decoded by the tools")
+        write_voc_xml(image_dir / ("img_%d.xml" % (i + 1)), 640, 480, objects)
+        paths.append(str(image))
+    return paths
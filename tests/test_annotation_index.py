@@ -0,0 +1,71 @@
+import pathlib
+
+import numpy as np
+import pytest
+
+import annotation_index
+from annotation_index import AnnotationIndex, parse_xml
+from conftest import write_voc_xml
+from create_coco_annotations import ImageInfoLoader
+
+
+def xml_path(image_path):
+    return image_path.rsplit(".", 1)[0] + ".xml"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_round_trip_keeps_every_record(voc_dataset, tmp_path, jobs):
+    xml_paths = [xml_path(p) for p in voc_dataset]
+    index = AnnotationIndex.build(xml_paths, jobs=jobs)
+    index.save(str(tmp_path / "index.npz"))
+    loaded = AnnotationIndex.load(str(tmp_path / "index.npz"))
+    assert len(loaded) == len(xml_paths)
+    for path in xml_paths:
+        i = loaded.find(path)
+        assert i is not None
+        assert loaded.record(i) == parse_xml(path)
+    # names are kept as written
+    assert sorted(loaded.names.tolist()) == ["Dog", "cat", "dog", "zebra"]
+
+
+def test_changed_or_unknown_file_is_not_found(voc_dataset):
+    path = xml_path(voc_dataset[0])
+    index = AnnotationIndex.build([path])
+    assert index.find(path) == 0
+    write_voc_xml(pathlib.Path(path), 640, 480, [("cat", 0, 1, 1, 2, 2)])
+    assert index.find(path) is None
+    assert index.find(xml_path(voc_dataset[1])) is None
+
+
+def test_rebuild_parses_only_changed_files(voc_dataset, monkeypatch):
+    xml_paths = [xml_path(p) for p in voc_dataset]
+    previous = AnnotationIndex.build(xml_paths)
+    parsed = []
+    monkeypatch.setattr(annotation_index, "parse_xml", lambda path: parsed.append(path) or parse_xml(path))
+    with open(xml_paths[1], "a") as f:
+        f.write("\n")
+    index = AnnotationIndex.build(xml_paths, previous=previous)
+    assert parsed == [xml_paths[1]]
+    assert [index.record(i) for i in range(len(index))] == [parse_xml(p) for p in xml_paths]
+
+
+def test_class_map_and_objects(voc_dataset):
+    index = AnnotationIndex.build([xml_path(p) for p in voc_dataset])
+    names = index.names.tolist()
+    exact = index.class_map(["cat", "dog"])
+    lower = index.class_map(["cat", "dog"], lower_case=True)
+    assert exact[names.index("Dog")] == -1 and lower[names.index("Dog")] == 1
+    assert exact[names.index("zebra")] == -1
+    boxes, class_ids = index.objects(2, lower)
+    assert class_ids.tolist() == [0]
+    np.testing.assert_array_equal(boxes, [[200, 100, 400, 300]])
+    boxes, class_ids = index.objects(2, lower, skip_difficult=False)
+    assert class_ids.tolist() == [1, 0]
+
+
+def test_coco_annotations_are_the_same_with_the_index(voc_dataset):
+    index = AnnotationIndex.build([xml_path(p) for p in voc_dataset])
+    from_xml = ImageInfoLoader(["cat", "dog"])
+    from_index = ImageInfoLoader(["cat", "dog"], index)
+    for path in voc_dataset:
+        assert from_index.load_image_info(path) == from_xml.load_image_info(path)
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from create_coco_annotations import CocoAnnotationWriter, process_image_set
+
+
+def write_image_set(tmp_path, paths):
+    image_set = tmp_path / "images.txt"
+    image_set.write_text("\n".join(paths) + "\n")
+    return str(image_set)
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_writer_output_is_valid_json(tmp_path, indent):
+    output = str(tmp_path / "out.json")
+    writer = CocoAnnotationWriter(output, ["cat", "dog"], indent)
+    writer.add({"id": 1}, [{"category_id": 1}, {"category_id": 2}])
+    writer.add({"id": 2}, [])
+    writer.add({"id": 3}, [{"category_id": 2}])
+    writer.close()
+    with open(output) as f:
+        coco = json.load(f)
+    assert [image["id"] for image in coco["images"]] == [1, 2, 3]
+    assert [(a["id"], a["category_id"]) for a in coco["annotations"]] == [(1, 1), (2, 2), (3, 2)]
+    assert [c["name"] for c in coco["categories"]] == ["cat", "dog"]
+    assert set(coco) == {"info", "licenses", "images", "annotations", "categories"}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.json"]
+
+
+def test_empty_image_set_is_valid_json(tmp_path):
+    output = str(tmp_path / "out.json")
+    process_image_set(write_image_set(tmp_path, []), ["cat"], output)
+    with open(output) as f:
+        coco = json.load(f)
+    assert coco["images"] == [] and coco["annotations"] == []
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_image_set(voc_dataset, tmp_path, jobs):
+    output = str(tmp_path / "out.json")
+    process_image_set(write_image_set(tmp_path, voc_dataset), ["cat", "dog"], output, jobs=jobs)
+    with open(output) as f:
+        coco = json.load(f)
+    assert [image["id"] for image in coco["images"]] == [1, 2, 3]
+    # difficult objects and classes outside the categories are left out, names are matched lower-cased
+    assert [(a["image_id"], a["category_id"]) for a in coco["annotations"]] == [(1, 1), (1, 2), (3, 1)]
+    assert [a["id"] for a in coco["annotations"]] == [1, 2, 3]
+    assert not (tmp_path / "out.json.tmp").exists() and not (tmp_path / "out.json.annotations.tmp").exists()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_failure_leaves_no_partial_output(voc_dataset, tmp_path, jobs):
+    output = tmp_path / "out.json"
+    output.write_text("previous")
+    image_set = write_image_set(tmp_path, voc_dataset + [str(tmp_path / "images" / "img_9.jpg")])
+    with pytest.raises(AssertionError):
+        process_image_set(image_set, ["cat", "dog"], str(output), jobs=jobs)
+    assert output.read_text() == "previous"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["images", "images.txt", "out.json"]
@@ -0,0 +1,57 @@
+import pytest
+
+CONV_CFG = """
+[net]
+batch=%d
+width=32
+height=32
+channels=3
+
+[convolutional]
+filters=4
+size=3
+stride=1
+pad=1
+activation=leaky
+"""
+
+GRU_CFG = """
+[net]
+batch=%d
+inputs=16
+time_steps=%d
+
+[gru]
+output=8
+"""
+
+
+def test_max_batch_follows_the_batch_loaded(dn, write_cfg):
+    cfg = write_cfg(CONV_CFG % 1)
+    net = dn.load_net(cfg, None, 0)
+    assert dn.network_max_batch(net) == 1
+    dn.free_network(net)
+    net = dn.load_net_batch(cfg, None, 0, 3)
+    assert dn.network_max_batch(net) == 3
+    dn.free_network(net)
+
+
+def test_batch_override_scales_by_time_steps(dn, write_cfg):
+    net = dn.load_net_batch(write_cfg(GRU_CFG % (1, 4)), None, 0, 2)
+    assert dn.network_max_batch(net) == 8
+    dn.free_network(net)
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_check_batch_accepts_up_to_max_batch(dn, write_cfg, n):
+    net = dn.load_net_batch(write_cfg(CONV_CFG % 1), None, 0, 3)
+    dn.check_batch(net, n)
+    dn.free_network(net)
+
+
+@pytest.mark.parametrize("n", [0, 4])
+def test_check_batch_rejects_out_of_range(dn, write_cfg, n):
+    net = dn.load_net_batch(write_cfg(CONV_CFG % 1), None, 0, 3)
+    with pytest.raises(ValueError):
+        dn.check_batch(net, n)
+    dn.free_network(net)
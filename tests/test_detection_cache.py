@@ -0,0 +1,107 @@
+import pickle
+
+import numpy as np
+
+from detection_cache import CachedDetector, DetectionCache, image_key, net_key
+
+
+def test_lru_evicts_least_recently_used():
+    cache = DetectionCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 2
+
+
+def test_max_bytes_bounds_the_pickled_size():
+    value = list(range(100))
+    size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    cache = DetectionCache(max_bytes=2*size)
+    for key in "abc":
+        cache.put(key, value)
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.nbytes == 2*size
+    # a value larger than the whole cache is not kept, and does not evict anything
+    cache.put("big", list(range(1000)))
+    assert cache.get("big") is None and list(cache.entries) == ["b", "c"]
+
+
+def test_replacing_a_key_keeps_the_byte_count():
+    cache = DetectionCache()
+    cache.put("a", [1, 2, 3])
+    cache.put("a", [1])
+    assert cache.nbytes == len(pickle.dumps([1], pickle.HIGHEST_PROTOCOL))
+
+
+def test_hits_return_copies():
+    cache = DetectionCache()
+    cache.put("a", [1])
+    cache.get("a").append(2)
+    assert cache.get("a") == [1]
+
+
+def test_disk_tier_survives_memory_eviction_and_new_instances(tmp_path):
+    cache = DetectionCache(max_entries=1, directory=str(tmp_path))
+    cache.put("aa11", {"x": 1})
+    cache.put("bb22", {"x": 2})
+    assert "aa11" not in cache.entries
+    assert cache.get("aa11") == {"x": 1}
+    assert cache.stats()["disk_hits"] == 1
+    fresh = DetectionCache(directory=str(tmp_path))
+    assert fresh.get("bb22") == {"x": 2}
+    # a disk hit is promoted to memory
+    assert fresh.get("bb22") == {"x": 2}
+    assert (fresh.hits, fresh.disk_hits, fresh.misses) == (1, 1, 0)
+    assert fresh.get("cc33") is None and fresh.misses == 1
+    assert not [p for p in tmp_path.rglob("*") if p.is_file() and p.suffix != ".pkl"]
+
+
+def test_memoize_computes_once():
+    cache = DetectionCache()
+    calls = []
+    for _ in range(3):
+        assert cache.memoize("k", lambda: calls.append(1) or "value") == "value"
+    assert len(calls) == 1
+    assert cache.stats()["hit_rate"] == 2./3
+
+
+def test_image_key_is_by_content(tmp_path):
+    a = tmp_path / "a.jpg"
+    b = tmp_path / "b.jpg"
+    a.write_bytes(b"same bytes")
+    b.write_bytes(b"same bytes")
+    assert image_key(str(a)) == image_key(str(b))
+    image = np.zeros((4, 4, 3), np.uint8)
+    assert image_key(image) == image_key(image.copy())
+    assert image_key(image) != image_key(image.reshape(4, 12, 1))
+    assert image_key(image) != image_key(image.astype(np.float32))
+
+
+def test_net_key_changes_with_the_weights(tmp_path):
+    cfg = tmp_path / "net.cfg"
+    cfg.write_text("[net]\n")
+    weights = tmp_path / "net.weights"
+    weights.write_bytes(b"1234")
+    key = net_key(str(cfg), str(weights))
+    assert net_key(str(cfg), str(weights)) == key
+    weights.write_bytes(b"123456")
+    assert net_key(str(cfg), str(weights)) != key
+    assert net_key(str(cfg), None) != key
+
+
+def test_cached_detector_runs_the_network_once(dn, tiny_detector, monkeypatch):
+    cfg, data = tiny_detector
+    net = dn.load_net(cfg, None, 0)
+    detector = CachedDetector(net, dn.load_meta(data), net_key(cfg, None))
+    image = np.random.RandomState(0).randint(0, 255, (48, 64, 3)).astype(np.uint8)
+    first = detector.detect(image, thresh=.1)
+    runs = []
+    monkeypatch.setattr(detector, "run_detect", lambda *args: runs.append(args))
+    assert detector.detect(image.copy(), thresh=.1) == first
+    assert not runs
+    detector.detect(image, thresh=.2)
+    assert len(runs) == 1
+    dn.free_network(net)
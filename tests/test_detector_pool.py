@@ -0,0 +1,27 @@
+import os
+
+from conftest import ROOT
+from detector_pool import DetectorPool
+
+DOG = os.path.join(ROOT, "data", "dog.jpg").encode()
+HORSES = os.path.join(ROOT, "data", "horses.jpg").encode()
+
+
+def test_map_yields_one_result_per_image(tiny_detector):
+    cfg, data = tiny_detector
+    with DetectorPool(cfg, None, data, workers=2, max_pending=2, poll_interval=.1) as pool:
+        results = list(pool.map([DOG, HORSES, DOG, HORSES, DOG]))
+    assert len(results) == 5
+    assert all(isinstance(res, list) for res in results)
+
+
+def test_unreadable_image_fails_alone(tiny_detector, tmp_path):
+    # darknet exits the worker on an image it can't read, only that image fails and the worker is replaced
+    cfg, data = tiny_detector
+    missing = str(tmp_path / "missing.jpg").encode()
+    with DetectorPool(cfg, None, data, workers=2, poll_interval=.1, max_restarts=0) as pool:
+        task_ids = [pool.submit(image) for image in [DOG, missing, HORSES]]
+        results = dict((task_id, ok) for task_id, ok, _ in (pool.collect() for _ in task_ids))
+        assert results == {task_ids[0]: True, task_ids[1]: False, task_ids[2]: True}
+        assert pool.restarts == 0
+        assert all(w.process.is_alive() for w in pool.workers)
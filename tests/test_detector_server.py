@@ -0,0 +1,72 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+
+from conftest import ROOT
+from detector_server import DetectionServer, MicroBatchDetector
+
+DOG = os.path.join(ROOT, "data", "dog.jpg")
+
+
+class StubDetector(MicroBatchDetector):
+    # the batching of MicroBatchDetector around a detect_batch that returns result or raises it, no network
+    def __init__(self, result, max_batch=4, queue_depth=8):
+        self.result = result
+        self.max_batch = max_batch
+        self.max_wait = .01
+        self.queue = asyncio.Queue(maxsize=queue_depth)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "batched_images": 0}
+
+    def detect_batch(self, paths):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return [self.result for _ in paths]
+
+
+def post_detect(detector, paths):
+    async def run():
+        server = DetectionServer(detector)
+        batching = asyncio.ensure_future(detector.run())
+        try:
+            return await asyncio.gather(*[server.handle_request("POST", "/detect", json.dumps({"path": p}).encode())
+                                          for p in paths])
+        finally:
+            batching.cancel()
+    return asyncio.run(run())
+
+
+def test_detections_are_returned_per_request():
+    detections = [{"name": "dog", "prob": .9, "box": [1, 2, 3, 4]}]
+    responses = post_detect(StubDetector(detections), [DOG, DOG, DOG])
+    assert responses == [(200, {"detections": detections})]*3
+
+
+def test_failed_batch_answers_every_request_with_500():
+    detector = StubDetector(RuntimeError("forward pass failed"))
+    responses = post_detect(detector, [DOG, DOG, DOG])
+    assert responses == [(500, {"error": "forward pass failed"})]*3
+    assert detector.stats["batches"] >= 1
+
+
+def test_bad_requests():
+    detector = StubDetector([])
+    server = DetectionServer(detector)
+    assert asyncio.run(server.handle_request("POST", "/detect", b"not json"))[0] == 400
+    assert asyncio.run(server.handle_request("POST", "/detect", b'{"path": "missing.jpg"}'))[0] == 400
+    assert asyncio.run(server.handle_request("GET", "/detect", b""))[0] == 404
+
+
+def test_full_queue_is_rejected_with_503():
+    async def run():
+        detector = StubDetector([], queue_depth=1)
+        server = DetectionServer(detector)
+        body = json.dumps({"path": DOG}).encode()
+        # nothing takes from the queue, so the first request keeps its slot
+        first = asyncio.ensure_future(server.handle_request("POST", "/detect", body))
+        await asyncio.sleep(0)
+        status, _ = await server.handle_request("POST", "/detect", body)
+        first.cancel()
+        return status, detector.stats["rejected"]
+    assert asyncio.run(run()) == (503, 1)
@@ -0,0 +1,149 @@
+import contextlib
+import io
+import json
+import random
+
+import numpy as np
+import pytest
+
+import evaluate_detections as ed
+
+# stats of summarize() which are -1 below because all boxes are large
+SMALL_MEDIUM = [3, 4, 9, 10]
+
+
+def evaluate(tmp_path, gts, results, categories=(1,), images=(1,), **kwargs):
+    # gts are (image_id, category_id, [x, y, w, h], iscrowd), returns (evaluation, summarize stats)
+    annotations = {"images": [{"id": i} for i in images],
+                   "categories": [{"id": c, "name": "class_%d" % c} for c in categories],
+                   "annotations": [{"id": k + 1, "image_id": i, "category_id": c, "bbox": box, "area": box[2]*box[3],
+                                    "iscrowd": crowd} for k, (i, c, box, crowd) in enumerate(gts)]}
+    (tmp_path / "gt.json").write_text(json.dumps(annotations))
+    (tmp_path / "res.json").write_text(json.dumps(results))
+    evaluation = ed.evaluate(str(tmp_path / "gt.json"), str(tmp_path / "res.json"), **kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return evaluation, ed.summarize(evaluation)
+
+
+def result(image_id, box, score, category_id=1):
+    return {"image_id": image_id, "category_id": category_id, "bbox": box, "score": score}
+
+
+def test_perfect_detections(tmp_path):
+    gts = [(1, 1, [0, 0, 100, 100], 0), (1, 1, [200, 200, 120, 100], 0), (2, 2, [10, 10, 150, 150], 0)]
+    results = [result(i, box, .9, c) for i, c, box, _ in gts]
+    evaluation, stats = evaluate(tmp_path, gts, results, categories=(1, 2), images=(1, 2))
+    # AR at one detection per image finds one of the two gts of category 1 in image 1
+    assert stats[6] == pytest.approx((.5 + 1)/2)
+    np.testing.assert_allclose(np.delete(stats, SMALL_MEDIUM + [6]), 1)
+    np.testing.assert_array_equal(stats[SMALL_MEDIUM], -1)
+    np.testing.assert_allclose(evaluation["voc_ap"], [1, 1])
+    assert evaluation["num_gts"].tolist() == [2, 1] and evaluation["num_dets"].tolist() == [2, 1]
+
+
+def test_false_positive_ranked_first_halves_precision(tmp_path):
+    gts = [(1, 1, [0, 0, 100, 100], 0)]
+    results = [result(1, [300, 300, 100, 100], .9), result(1, [0, 0, 100, 100], .8)]
+    evaluation, stats = evaluate(tmp_path, gts, results)
+    assert stats[0] == pytest.approx(.5) and stats[8] == pytest.approx(1)
+    assert evaluation["voc_ap"][0] == pytest.approx(.5)
+
+
+def test_iou_thresholds(tmp_path):
+    # iou .62 matches at the thresholds .5, .55 and .6 only, and the VOC iou of .5 whose boxes are a pixel larger
+    gts = [(1, 1, [0, 0, 100, 100], 0)]
+    evaluation, stats = evaluate(tmp_path, gts, [result(1, [0, 0, 100, 62], .9)])
+    assert stats[0] == pytest.approx(.3)
+    assert (stats[1], stats[2]) == (pytest.approx(1), pytest.approx(0))
+    assert evaluation["voc_ap"][0] == pytest.approx(1)
+    evaluation, _ = evaluate(tmp_path, gts, [result(1, [0, 0, 100, 62], .9)], voc_iou=.7)
+    assert evaluation["voc_ap"][0] == pytest.approx(0)
+
+
+def test_duplicate_detection_is_a_false_positive(tmp_path):
+    gts = [(1, 1, [0, 0, 100, 100], 0), (2, 1, [0, 0, 100, 100], 0)]
+    results = [result(1, [0, 0, 100, 100], .9), result(1, [1, 1, 100, 100], .8), result(2, [0, 0, 100, 100], .7)]
+    evaluation, stats = evaluate(tmp_path, gts, results, images=(1, 2))
+    # precision 1, 1/2, 2/3 at recall 1/2, 1/2, 1
+    assert stats[1] == pytest.approx((51 + 50*2./3) / 101)
+    assert evaluation["voc_ap"][0] == pytest.approx(.5 + .5*2./3)
+
+
+def test_detections_of_crowds_are_ignored(tmp_path):
+    # coco measures a detection inside a crowd by its own area, VOC only ignores it above the iou threshold
+    gts = [(1, 1, [0, 0, 100, 100], 0), (1, 1, [300, 300, 200, 200], 1)]
+    results = [result(1, [310, 310, 50, 50], .9), result(1, [300, 300, 190, 190], .85), result(1, [0, 0, 100, 100], .8)]
+    evaluation, stats = evaluate(tmp_path, gts, results)
+    assert stats[0] == pytest.approx(1)
+    # precision 0, 1/2 at recall 0, 1
+    assert evaluation["voc_ap"][0] == pytest.approx(.5)
+    evaluation, _ = evaluate(tmp_path, gts, results[1:])
+    assert evaluation["voc_ap"][0] == pytest.approx(1)
+    assert evaluation["num_gts"].tolist() == [1]
+
+
+def test_max_dets_limits_recall(tmp_path):
+    gts = [(1, 1, [0, 0, 100, 100], 0), (1, 1, [200, 200, 100, 100], 0)]
+    results = [result(1, [0, 0, 100, 100], .9), result(1, [200, 200, 100, 100], .8)]
+    _, stats = evaluate(tmp_path, gts, results)
+    assert (stats[6], stats[7]) == (pytest.approx(.5), pytest.approx(1))
+
+
+def test_categories_without_gts_or_detections(tmp_path):
+    gts = [(1, 1, [0, 0, 100, 100], 0)]
+    evaluation, stats = evaluate(tmp_path, gts, [result(1, [0, 0, 100, 100], .9, 3)], categories=(1, 2, 3))
+    # category 1 is missed, 2 and 3 have no gts and do not count
+    assert evaluation["voc_ap"].tolist() == [0, -1, -1]
+    assert stats[0] == 0
+    assert evaluation["num_dets"].tolist() == [0, 0, 1]
+
+
+def test_results_for_unknown_images_are_rejected(tmp_path):
+    with pytest.raises(AssertionError):
+        evaluate(tmp_path, [(1, 1, [0, 0, 10, 10], 0)], [result(5, [0, 0, 10, 10], .9)])
+
+
+def random_dataset(seed, num_images=30, num_categories=5):
+    rng = random.Random(seed)
+    gts, results = [], []
+    for image_id in range(1, num_images + 1):
+        for _ in range(rng.randint(0, 6)):
+            category = rng.randint(1, num_categories)
+            size = rng.choice([8, 20, 40, 70, 120, 250])
+            box = [rng.uniform(0, 600), rng.uniform(0, 450), size*rng.uniform(.5, 1.5), size*rng.uniform(.5, 1.5)]
+            gts.append((image_id, category, box, int(rng.random() < .05)))
+            for _ in range(rng.choice([0, 1, 1, 2])):
+                jittered = [v + rng.gauss(0, .1*box[2 + k % 2]) for k, v in enumerate(box)]
+                jittered[2:] = [max(1, v) for v in jittered[2:]]
+                results.append(result(image_id, jittered, round(rng.random(), 2), category))
+        for _ in range(rng.randint(0, 8)):
+            box = [rng.uniform(0, 600), rng.uniform(0, 450), rng.uniform(2, 200), rng.uniform(2, 200)]
+            results.append(result(image_id, box, round(rng.random()*.5, 2), rng.randint(1, num_categories)))
+    return gts, results, tuple(range(1, num_categories + 1)), tuple(range(1, num_images + 1))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_jobs_give_the_same_result(tmp_path, seed):
+    gts, results, categories, images = random_dataset(seed)
+    evaluation, stats = evaluate(tmp_path, gts, results, categories, images)
+    parallel, parallel_stats = evaluate(tmp_path, gts, results, categories, images, jobs=2)
+    np.testing.assert_array_equal(parallel_stats, stats)
+    np.testing.assert_array_equal(parallel["precision"], evaluation["precision"])
+    np.testing.assert_array_equal(parallel["voc_ap"], evaluation["voc_ap"])
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_pycocotools(tmp_path, seed):
+    pytest.importorskip("pycocotools")
+    from pycocotools.coco import COCO
+    from pycocotools.cocoeval import COCOeval
+    gts, results, categories, images = random_dataset(seed)
+    evaluation, stats = evaluate(tmp_path, gts, results, categories, images)
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco = COCO(str(tmp_path / "gt.json"))
+        coco_eval = COCOeval(coco, coco.loadRes(str(tmp_path / "res.json")), "bbox")
+        coco_eval.evaluate()
+        coco_eval.accumulate()
+        coco_eval.summarize()
+    np.testing.assert_allclose(evaluation["precision"], coco_eval.eval["precision"], atol=1e-12)
+    np.testing.assert_allclose(stats, coco_eval.stats, atol=1e-12)
@@ -0,0 +1,74 @@
+from ctypes import POINTER, c_float, cast
+
+import numpy as np
+import pytest
+
+import postprocess
+
+
+def random_detections(n=80, classes=4, seed=0):
+    # boxes in a few clusters so nms has overlaps to resolve, probs zero wherever objectness is, as
+    # get_network_boxes leaves them
+    rng = np.random.RandomState(seed)
+    centers = rng.rand(5, 2)
+    boxes = np.empty((n, 4), dtype=np.float32)
+    boxes[:, :2] = centers[rng.randint(0, 5, n)] + rng.normal(0, .03, (n, 2))
+    boxes[:, 2:] = rng.uniform(.1, .3, (n, 2))
+    objectness = np.where(rng.rand(n) < .2, 0, rng.rand(n)).astype(np.float32)
+    probs = np.where(rng.rand(n, classes) < .3, 0, rng.rand(n, classes)).astype(np.float32)
+    probs[objectness == 0] = 0
+    return boxes, objectness, probs
+
+
+def c_nms(dn, nms, boxes, objectness, probs, thresh):
+    # runs nms from src/box.c over a DETECTION array holding the given boxes and returns the probs it leaves,
+    # in the original box order although the C code sorts the array
+    n, classes = probs.shape
+    prob_arrays = [(c_float*classes)(*row) for row in probs.tolist()]
+    dets = (dn.DETECTION*n)()
+    for d, box, obj, prob in zip(dets, boxes.tolist(), objectness.tolist(), prob_arrays):
+        d.bbox = dn.BOX(*box)
+        d.classes = classes
+        d.prob = cast(prob, POINTER(c_float))
+        d.objectness = obj
+    nms(dets, n, classes, thresh)
+    return np.array([list(prob) for prob in prob_arrays], dtype=np.float32)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("thresh", [.3, .45, .7])
+def test_nms_obj_matches_c(dn, seed, thresh):
+    boxes, objectness, probs = random_detections(seed=seed)
+    expected = c_nms(dn, dn.do_nms_obj, boxes, objectness, probs, thresh)
+    np.testing.assert_array_equal(postprocess.nms_obj(boxes, objectness, probs, thresh), expected)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("thresh", [.3, .45, .7])
+def test_nms_sort_matches_c(dn, seed, thresh):
+    boxes, objectness, probs = random_detections(seed=seed)
+    expected = c_nms(dn, dn.do_nms_sort, boxes, objectness, probs, thresh)
+    np.testing.assert_array_equal(postprocess.nms_sort(boxes, objectness, probs, thresh), expected)
+
+
+def test_greedy_nms_keeps_best_of_overlapping_boxes():
+    boxes = np.array([[.5, .5, .2, .2], [.51, .5, .2, .2], [.1, .1, .1, .1]], dtype=np.float32)
+    scores = np.array([.6, .9, .5], dtype=np.float32)
+    assert postprocess.greedy_nms(boxes, scores, .45).tolist() == [1, 2]
+
+
+def test_soft_nms_decays_instead_of_dropping():
+    boxes = np.array([[.5, .5, .2, .2], [.51, .5, .2, .2]], dtype=np.float32)
+    scores = np.array([.9, .8], dtype=np.float32)
+    picked, decayed = postprocess.soft_nms(boxes, scores, .45, method='linear')
+    iou = postprocess.box_iou(boxes[0], boxes[1:])[0]
+    assert picked.tolist() == [0, 1]
+    np.testing.assert_allclose(decayed, [.9, .8*(1 - iou)], rtol=1e-6)
+
+
+def test_postprocess_top_k_and_order():
+    boxes, objectness, probs = random_detections()
+    out_boxes, scores, class_ids = postprocess.postprocess(boxes, objectness, probs, method='sort', top_k=5)
+    assert len(scores) == 5
+    assert np.all(np.diff(scores) <= 0)
+    assert out_boxes.shape == (5, 4) and class_ids.dtype == np.int32
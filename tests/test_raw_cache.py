@@ -0,0 +1,74 @@
+import os
+from ctypes import c_char_p, c_void_p
+
+import numpy as np
+import pytest
+
+import raw_cache
+from conftest import ROOT
+
+IMAGES = [os.path.join(ROOT, "data", name) for name in ("dog.jpg", "horses.jpg")]
+
+
+@pytest.fixture
+def cached(dn, tiny_detector, tmp_path):
+    # (cfg, weights, datacfg, cache file) of the tiny detector with random weights saved to disk
+    cfg, data = tiny_detector
+    weights = str(tmp_path / "tiny.weights").encode()
+    net = dn.load_net(cfg, None, 0)
+    save_weights = dn.lib.save_weights
+    save_weights.argtypes = [c_void_p, c_char_p]
+    save_weights(net, weights)
+    dn.free_network(net)
+    out = str(tmp_path / "raw.npz")
+    raw_cache.build_cache(cfg.decode(), weights.decode(), data.decode(), IMAGES, out, floor=.005)
+    return cfg, weights, data, out
+
+
+@pytest.mark.parametrize("thresh", [.005, .2, .5])
+def test_cache_matches_get_network_boxes(dn, cached, thresh):
+    cfg, weights, data, out = cached
+    cache = raw_cache.RawCache(out)
+    session = dn.DetectorSession(cfg, weights, data, thresh, .5, 0)
+    for i, path in enumerate(IMAGES):
+        im = dn.load_image(path.encode(), 0, 0)
+        num = session.fill_detections(im)
+        dn.free_image(im)
+        boxes, objectness, probs = dn.detections_to_raw(session.dets, num, session.meta.classes)
+        cached_boxes, cached_objectness, cached_probs = cache.image(i, thresh)
+        assert num and len(boxes)
+        np.testing.assert_array_equal(cached_boxes, boxes)
+        np.testing.assert_array_equal(cached_objectness, objectness)
+        np.testing.assert_array_equal(cached_probs, probs)
+    session.close()
+
+
+def test_thresh_below_floor_is_rejected(cached):
+    cache = raw_cache.RawCache(cached[3])
+    with pytest.raises(ValueError):
+        cache.image(0, .001)
+
+
+def test_coco_results_clip_boxes_and_offset_category_ids(cached):
+    cache = raw_cache.RawCache(cached[3])
+    w, h = cache.sizes[0]
+    boxes = np.array([[10, 20, 40, 60], [w - 5, h - 5, 20, 20]], dtype=np.float32)
+    detections = [(boxes, np.array([.9, .5], np.float32), np.array([0, 1], np.int32))]
+    results = raw_cache.coco_results(cache, detections)
+    assert [r["category_id"] for r in results] == [1, 2]
+    assert results[0]["bbox"] == [0, 0, 30, 50]
+    x, y, bw, bh = results[1]["bbox"]
+    assert (x + bw, y + bh) == (w, h)
+
+
+def test_coco_image_id():
+    assert raw_cache.coco_image_id("val2014/COCO_val2014_000000000042.jpg") == 42
+    assert raw_cache.coco_image_id("data/dog.jpg") == 0
+
+
+def test_mean_ap_of_perfect_results_is_one():
+    gt = {1: (np.array([[0, 0, 10, 10], [20, 20, 40, 40]], np.float32), np.array([1, 2], np.int32))}
+    results = [{"image_id": 1, "category_id": 1, "bbox": [0, 0, 10, 10], "score": .9},
+               {"image_id": 1, "category_id": 2, "bbox": [20, 20, 20, 20], "score": .8}]
+    assert raw_cache.mean_ap(results, gt) == pytest.approx(1)
+    assert raw_cache.mean_ap(results[:1], gt) == pytest.approx(.5)